@@ -0,0 +1,435 @@
+/*
+ *  cameraLatticeBenchmark.cpp
+ *  cameraLattice
+ *
+ *  Times the deformation kernel and the functions it is made of, without Maya.
+ *  Every sweep changes one parameter of the default configuration at a time, the results are written as JSON.
+ *
+ *  deform          LatticeDeformerData, the kernel of the tools, on points stored as doubles
+ *  double, float   the two precisions of the deformer, CameraLatticeData and CameraLatticeFloatData, on the raw floats
+ *                  of a mesh; the projections are computed on every run, the influence weights come from their cache
+ *  interpolation   the lattice lookup alone
+ *  influence       the influence areas alone
+ *
+ *  cameraLatticeBenchmark [-quick] [-repeat n] [-threads 1,2,4] [-output file.json]
+ *
+ */
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <string>
+#include <vector>
+#include <algorithm>
+
+#include <tbb/tick_count.h>
+#include <tbb/task_arena.h>
+#include <tbb/parallel_for.h>
+#include <tbb/blocked_range.h>
+
+#include "cameraLatticeCore.h"
+#include "cameraLatticeKernel.h"
+
+/**********************************************************
+ SCENE
+ **********************************************************/
+
+struct BenchmarkConfig
+{
+    BenchmarkConfig() : vertices(100000), resolution(10), behaviour(kLinear), recursion(10), influencers(0), threads(1) {};
+
+    int vertices;
+    int resolution;
+    int behaviour;
+    int recursion;
+    int influencers;
+    int threads;
+};
+
+// fixed seed, so every run and every machine times the same points
+class Random
+{
+public:
+    Random(unsigned int seed) : m_state(seed) {};
+
+    // uniform in (min, max)
+    double next(double min, double max)
+    {
+        m_state = m_state * 1664525u + 1013904223u;
+        return min + (max - min) * (double(m_state >> 8) / double(1 << 24));
+    }
+
+private:
+    unsigned int m_state;
+};
+
+// a 35mm camera at z = 10 looking down the negative z axis, the points fill its gate and a bit around it
+struct BenchmarkScene
+{
+    void build(const BenchmarkConfig &config)
+    {
+        double values[4][4] = {{1, 0, 0, 0}, {0, 1, 0, 0}, {0, 0, 1, 0}, {0, 0, 10, 1}};
+        camera.compile(Matrix4(values), false, 0.0, 1.417, 0.945, 35.0);
+
+        Random random(1);
+        points.resize(config.vertices);
+        for (size_t i = 0; i < points.size(); i++)
+            points[i] = Point3(random.next(-3.0, 3.0), random.next(-2.0, 2.0), random.next(-5.0, 5.0));
+        deformedPoints = points;
+
+        rawPoints.resize(3 * points.size());
+        for (size_t i = 0; i < points.size(); i++)
+        {
+            rawPoints[3 * i] = float(points[i].x);
+            rawPoints[3 * i + 1] = float(points[i].y);
+            rawPoints[3 * i + 2] = float(points[i].z);
+        }
+        rawDeformedPoints = rawPoints;
+        projectionCache.u.resize(points.size());
+        projectionCache.v.resize(points.size());
+        projectionCache.cameraZ.resize(points.size());
+        weightCache.weights.assign(points.size(), -1.0f);
+
+        //a rest lattice with every point moved, so no cell is skipped by the identity mask
+        int D = config.resolution;
+        std::vector<Point3> planePoints(D * D);
+        for (int t = 0; t < D; t++)
+            for (int s = 0; s < D; s++)
+            {
+                double x = double(s) / (D - 1) - 0.5;
+                double y = double(t) / (D - 1) - 0.5;
+                planePoints[s + t * D] = Point3(x + 0.05 * sin(7.0 * y), y + 0.05 * cos(5.0 * x), 0.0);
+            }
+
+        lattice = CompiledLattice();
+        lattice.compile(planePoints, D, D);
+        if (config.behaviour == kBezier)
+            lattice.compileBezierWindows(config.recursion);
+        lattice.compileIdentityMask(config.behaviour);
+
+        influencers.resize(config.influencers);
+        for (int i = 0; i < config.influencers; i++)
+        {
+            double scale = random.next(0.5, 2.0);
+            double values[4][4] = {{scale, 0, 0, 0}, {0, scale, 0, 0}, {0, 0, scale, 0},
+                                   {random.next(-3.0, 3.0), random.next(-2.0, 2.0), random.next(-5.0, 5.0), 1}};
+            influencers[i].set(Matrix4(values), 0.5);
+        }
+        influencerGrid.build(influencers);
+
+        stage.lattice = &lattice;
+        stage.setCamera(camera, Matrix4(), Matrix4());
+        stage.behaviour = config.behaviour;
+        stage.gateOffsetValue = 0.0;
+        stage.envelopeValue = 1.0;
+        stage.useInfluencers = true;
+    }
+
+    CompiledCamera camera;
+    CompiledLattice lattice;
+    LatticeStage stage;
+    std::vector<Influencer> influencers;
+    InfluencerGrid influencerGrid;
+    std::vector<Point3> points, deformedPoints;
+    Matrix4 toWorldMatrix;
+
+    // the raw points of a mesh and the caches of the deformer, for the double and float kernels
+    std::vector<float> rawPoints, rawDeformedPoints;
+    ProjectionCache projectionCache;
+    InfluenceWeightCache weightCache;
+};
+
+/**********************************************************
+ KERNELS
+ **********************************************************/
+
+// the interpolation alone, at the lattice parameters of the vertices
+class InterpolationKernel
+{
+public:
+    InterpolationKernel(BenchmarkScene &scene, const std::vector<double> &parameters) : m_scene(scene), m_parameters(parameters) {};
+
+    void operator()(const tbb::blocked_range<size_t> &r) const
+    {
+        const CompiledLattice *lattice = &m_scene.lattice;
+        int behaviour = m_scene.stage.behaviour;
+        std::vector<double> uBasis(lattice->sD), vBasis(lattice->tD);
+
+        for (size_t i = r.begin(); i != r.end(); ++i)
+        {
+            double u = m_parameters[2 * i];
+            double v = m_parameters[2 * i + 1];
+            Point3 &point = m_scene.deformedPoints[i];
+            if (behaviour == kBezier)
+                findBezierDeformedPoint(point, lattice, u, v, &uBasis[0], &vBasis[0]);
+            else if (behaviour == kBSpline || behaviour == kCatmullRom)
+                findCubicDeformedPoint(point, lattice, u, v, behaviour);
+            else
+                findLinearDeformedPoint(point, lattice, u, v);
+        }
+    }
+
+private:
+    BenchmarkScene &m_scene;
+    const std::vector<double> &m_parameters;
+};
+
+class InfluenceKernel
+{
+public:
+    InfluenceKernel(BenchmarkScene &scene) : m_scene(scene) {};
+
+    void operator()(const tbb::blocked_range<size_t> &r) const
+    {
+        for (size_t i = r.begin(); i != r.end(); ++i)
+            m_scene.deformedPoints[i].x = get_influencers_weight(m_scene.points[i], &m_scene.influencers, &m_scene.influencerGrid);
+    }
+
+private:
+    BenchmarkScene &m_scene;
+};
+
+/**********************************************************
+ RESULTS
+ **********************************************************/
+
+static const char *interpolationNames[] = {"linear", "bezier", "bspline", "catmullrom"};
+
+struct BenchmarkResult
+{
+    std::string name;
+    std::string kernel;
+    BenchmarkConfig config;
+    double bestTime, medianTime;
+};
+
+template <typename Kernel>
+void timeKernel(const Kernel &kernel, const BenchmarkConfig &config, int repeat, double &bestTime, double &medianTime)
+{
+    tbb::task_arena arena(config.threads);
+    std::vector<double> times;
+
+    //the first run only warms up the caches and the threads
+    for (int run = 0; run <= repeat; run++)
+    {
+        tbb::tick_count start = tbb::tick_count::now();
+        arena.execute([&] { tbb::parallel_for(tbb::blocked_range<size_t>(0, size_t(config.vertices)), kernel); });
+        double seconds = (tbb::tick_count::now() - start).seconds();
+        if (run > 0)
+            times.push_back(seconds);
+    }
+
+    std::sort(times.begin(), times.end());
+    bestTime = times.front();
+    medianTime = times[times.size() / 2];
+}
+
+std::string resultName(const std::string &kernel, const BenchmarkConfig &config)
+{
+    char buffer[256];
+    snprintf(buffer, sizeof(buffer), "%s vertices=%d resolution=%d interpolation=%s recursion=%d influencers=%d threads=%d",
+             kernel.c_str(), config.vertices, config.resolution, interpolationNames[config.behaviour],
+             config.behaviour == kBezier ? config.recursion : 0, config.influencers, config.threads);
+    return buffer;
+}
+
+void runBenchmark(const std::string &kernel, const BenchmarkConfig &config, int repeat, std::vector<BenchmarkResult> &results)
+{
+    BenchmarkResult result;
+    result.kernel = kernel;
+    result.config = config;
+    result.name = resultName(kernel, config);
+
+    //the same configuration may be reached by several sweeps
+    for (size_t i = 0; i < results.size(); i++)
+        if (results[i].name == result.name)
+            return;
+
+    BenchmarkScene scene;
+    scene.build(config);
+
+    //the points are in world space, the deformed points are not read back so every run deforms the same points
+    if (kernel == "deform")
+        timeKernel(LatticeDeformerData(&scene.stage, &scene.toWorldMatrix, &scene.influencers, &scene.influencerGrid,
+                                       &scene.points[0], &scene.deformedPoints[0]), config, repeat, result.bestTime, result.medianTime);
+    else if (kernel == "double" || kernel == "float")
+    {
+        //the projection cache is never marked valid, so every run projects the points again
+        FloatPointBuffer points(&scene.rawPoints[0], (unsigned int)config.vertices);
+        FloatPointBuffer deformedPoints(&scene.rawDeformedPoints[0], (unsigned int)config.vertices);
+        LatticeStage &stage = scene.stage;
+        if (kernel == "float")
+            timeKernel(CameraLatticeFloatKernel<FloatPointBuffer>(&stage.projectionMatrix, &stage.invProjectionMatrix, &scene.toWorldMatrix,
+                                                                  points, deformedPoints, &scene.lattice, &scene.projectionCache,
+                                                                  &scene.weightCache, stage.filmHAperture, stage.filmVAperture,
+                                                                  stage.isOrtho, stage.behaviour, &scene.influencers, &scene.influencerGrid,
+                                                                  stage.gateOffsetValue, stage.envelopeValue),
+                       config, repeat, result.bestTime, result.medianTime);
+        else
+            timeKernel(CameraLatticeKernel<FloatPointBuffer>(&stage.projectionMatrix, &stage.invProjectionMatrix, &scene.toWorldMatrix,
+                                                             points, deformedPoints, &scene.lattice, &scene.projectionCache,
+                                                             &scene.weightCache, stage.filmHAperture, stage.filmVAperture,
+                                                             stage.isOrtho, stage.behaviour, &scene.influencers, &scene.influencerGrid,
+                                                             stage.gateOffsetValue, stage.envelopeValue),
+                       config, repeat, result.bestTime, result.medianTime);
+    }
+    else if (kernel == "interpolation")
+    {
+        std::vector<double> parameters(2 * config.vertices);
+        for (size_t i = 0; i < scene.points.size(); i++)
+        {
+            double cameraZ;
+            projectPoint(scene.points[i], scene.stage.projectionMatrix, scene.stage.filmHAperture, scene.stage.filmVAperture,
+                         scene.stage.isOrtho, parameters[2 * i], parameters[2 * i + 1], cameraZ);
+        }
+        timeKernel(InterpolationKernel(scene, parameters), config, repeat, result.bestTime, result.medianTime);
+    }
+    else
+        timeKernel(InfluenceKernel(scene), config, repeat, result.bestTime, result.medianTime);
+
+    fprintf(stderr, "%-100s %10.3f ms %8.2f Mvertices/s\n", result.name.c_str(), result.bestTime * 1000.0,
+            config.vertices / result.bestTime / 1000000.0);
+    results.push_back(result);
+}
+
+bool writeResults(const char *path, const std::vector<BenchmarkResult> &results, int repeat)
+{
+    FILE *file = path ? fopen(path, "w") : stdout;
+    if (!file)
+    {
+        fprintf(stderr, "cameraLatticeBenchmark: cannot write %s\n", path);
+        return false;
+    }
+
+    fprintf(file, "{\n  \"hardwareThreads\": %d,\n  \"repeat\": %d,\n  \"results\": [\n",
+            tbb::this_task_arena::max_concurrency(), repeat);
+    for (size_t i = 0; i < results.size(); i++)
+    {
+        const BenchmarkResult &result = results[i];
+        const BenchmarkConfig &config = result.config;
+        fprintf(file, "    {\"name\": \"%s\", \"kernel\": \"%s\", \"vertices\": %d, \"resolution\": %d, \"interpolation\": \"%s\", "
+                      "\"recursion\": %d, \"influencers\": %d, \"threads\": %d, \"seconds\": %.9f, \"medianSeconds\": %.9f, "
+                      "\"verticesPerSecond\": %.1f}%s\n",
+                result.name.c_str(), result.kernel.c_str(), config.vertices, config.resolution, interpolationNames[config.behaviour],
+                config.behaviour == kBezier ? config.recursion : 0, config.influencers, config.threads,
+                result.bestTime, result.medianTime, config.vertices / result.bestTime, i + 1 < results.size() ? "," : "");
+    }
+    fprintf(file, "  ]\n}\n");
+
+    if (path)
+        fclose(file);
+    return true;
+}
+
+/**********************************************************
+ MAIN
+ **********************************************************/
+
+int main(int argc, char **argv)
+{
+    bool quick = false;
+    int repeat = 5;
+    const char *outputPath = NULL;
+    std::vector<int> threadCounts;
+
+    for (int i = 1; i < argc; i++)
+    {
+        if (strcmp(argv[i], "-quick") == 0)
+            quick = true;
+        else if (strcmp(argv[i], "-repeat") == 0 && i + 1 < argc)
+            repeat = std::max(1, atoi(argv[++i]));
+        else if (strcmp(argv[i], "-output") == 0 && i + 1 < argc)
+            outputPath = argv[++i];
+        else if (strcmp(argv[i], "-threads") == 0 && i + 1 < argc)
+        {
+            for (char *token = strtok(argv[++i], ","); token; token = strtok(NULL, ","))
+                threadCounts.push_back(std::max(1, atoi(token)));
+        }
+        else
+        {
+            fprintf(stderr, "usage: cameraLatticeBenchmark [-quick] [-repeat n] [-threads 1,2,4] [-output file.json]\n");
+            return 1;
+        }
+    }
+
+    //powers of two up to the cores of the machine
+    int maxThreads = tbb::this_task_arena::max_concurrency();
+    if (threadCounts.empty())
+    {
+        for (int threads = 1; threads < maxThreads; threads *= 2)
+            threadCounts.push_back(threads);
+        threadCounts.push_back(maxThreads);
+    }
+
+    BenchmarkConfig defaultConfig;
+    defaultConfig.threads = maxThreads;
+
+    int vertexCounts[] = {10000, 100000, 1000000, 10000000};
+    int numVertexCounts = quick ? 3 : 4;
+    int resolutions[] = {4, 10, 25, 50};
+    int recursions[] = {1, 2, 5, 10};
+    int influencerCounts[] = {0, 1, 8, 64};
+
+    std::vector<BenchmarkResult> results;
+    BenchmarkConfig config;
+
+    for (int i = 0; i < numVertexCounts; i++)
+    {
+        config = defaultConfig;
+        config.vertices = vertexCounts[i];
+        runBenchmark("deform", config, repeat, results);
+    }
+
+    for (int i = 0; i < 4; i++)
+    {
+        config = defaultConfig;
+        config.resolution = resolutions[i];
+        runBenchmark("deform", config, repeat, results);
+
+        config.behaviour = kBezier;
+        runBenchmark("deform", config, repeat, results);
+    }
+
+    for (int behaviour = kLinear; behaviour <= kCatmullRom; behaviour++)
+    {
+        config = defaultConfig;
+        config.behaviour = behaviour;
+        runBenchmark("deform", config, repeat, results);
+        runBenchmark("double", config, repeat, results);
+        runBenchmark("float", config, repeat, results);
+        runBenchmark("interpolation", config, repeat, results);
+    }
+
+    for (int i = 0; i < 4; i++)
+    {
+        config = defaultConfig;
+        config.behaviour = kBezier;
+        config.resolution = 25;
+        config.recursion = recursions[i];
+        runBenchmark("deform", config, repeat, results);
+        runBenchmark("interpolation", config, repeat, results);
+    }
+
+    for (int i = 0; i < 4; i++)
+    {
+        config = defaultConfig;
+        config.influencers = influencerCounts[i];
+        runBenchmark("deform", config, repeat, results);
+        if (config.influencers > 0)
+            runBenchmark("influence", config, repeat, results);
+    }
+
+    for (size_t i = 0; i < threadCounts.size(); i++)
+    {
+        config = defaultConfig;
+        config.vertices = quick ? 100000 : 1000000;
+        config.threads = threadCounts[i];
+        runBenchmark("deform", config, repeat, results);
+
+        config.behaviour = kBezier;
+        config.influencers = 8;
+        runBenchmark("deform", config, repeat, results);
+    }
+
+    return writeResults(outputPath, results, repeat) ? 0 : 1;
+}
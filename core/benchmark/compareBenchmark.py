@@ -0,0 +1,72 @@
+"""
+Compares the results of cameraLatticeBenchmark with a baseline and flags the slower configurations.
+
+    python compareBenchmark.py results.json [-baseline baseline.json] [-threshold 0.1]
+
+Exits with 1 when a configuration is slower than the baseline by more than the threshold,
+or when the baseline has no time for a configuration of the results, like the thread counts
+of a baseline written on a machine with fewer cores.
+The baseline times belong to the machine which wrote them, regenerate it with -output when the machine changes.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import sys
+
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def _load_results(path):
+    with open(path) as f:
+        return dict((result['name'], result) for result in json.load(f)['results'])
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    unchecked = []
+    for name in sorted(results):
+        if name not in baseline:
+            print('NO BASELINE %s' % name)
+            unchecked.append(name)
+            continue
+
+        ratio = results[name]['seconds'] / baseline[name]['seconds']
+        if ratio > 1.0 + threshold:
+            status = 'REGRESSION'
+            regressions.append(name)
+        elif ratio < 1.0 - threshold:
+            status = 'faster'
+        else:
+            status = 'same'
+        print('%-11s %s  %.3f ms -> %.3f ms (%+.1f%%)' % (status, name, baseline[name]['seconds'] * 1000.0,
+                                                          results[name]['seconds'] * 1000.0, (ratio - 1.0) * 100.0))
+
+    # -quick runs leave out the largest meshes of the baseline
+    for name in sorted(set(baseline) - set(results)):
+        print('not run     %s' % name)
+
+    return regressions, unchecked
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare cameraLatticeBenchmark results with a baseline.')
+    parser.add_argument('results', help='json file written by cameraLatticeBenchmark -output')
+    parser.add_argument('-baseline', default=DEFAULT_BASELINE, help='json file of the reference run')
+    parser.add_argument('-threshold', type=float, default=0.1, help='relative slowdown flagged as a regression')
+    args = parser.parse_args()
+
+    regressions, unchecked = compare(_load_results(args.results), _load_results(args.baseline), args.threshold)
+    if regressions:
+        print('%d configurations slower than the baseline by more than %d%%' % (len(regressions), args.threshold * 100))
+    if unchecked:
+        print('%d configurations missing from the baseline, write it again with the same -threads on this machine' %
+              len(unchecked))
+    return 1 if regressions or unchecked else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,761 @@
+/*
+ *  cameraLatticeConformance.cpp
+ *  cameraLattice
+ *
+ *  Checks the current deformation against the reference of the first release over random scenes:
+ *  perspective and orthographic cameras, lattices at rest, partly and fully edited, gate offsets, envelopes and influence areas.
+ *
+ *  Tolerances, the reference rounds the lattice parameters to floats:
+ *  - cells: findCell picks the cell of findBoundaryCells, or its neighbour when the parameter is on their shared edge
+ *  - interpolation: 1e-5 in lattice units, the lattice spans 1. Bezier extrapolates in the gate offset, where the bernstein
+ *    polynomials amplify the rounding of the parameters, so its error is divided by the sum of their absolute values there
+ *  - influence areas: 1e-12
+ *  - deformation: 1e-5 relative to the depth of the point from the camera, or to the orthographic width
+ *  - stacked lattices against the deformer kernel, and any thread count against one thread: identical bits
+ *  - CameraLatticeKernel against LatticeDeformerData: 1e-5 like the deformation, the influence weights are cached as floats
+ *  - CameraLatticeFloatKernel against CameraLatticeKernel: 1e-4 relative to the depth. A point within 1e-5 of the edge of the gate
+ *    may be culled by one precision and not the other, those are counted apart
+ *  - a second evaluation reading the projection and influence weight caches, an incremental update after moving a few
+ *    lattice points against a full evaluation, in both precisions: identical bits
+ *  - result cache fingerprints: equal for the same inputs, different as soon as one setting, painted weight or point changes
+ *
+ *  The b-spline and catmull-rom interpolations came after the reference, their scenes are only checked across thread counts.
+ *  The reference divides by zero when a lattice has 2 subdivisions and the parameter reaches 1, and with a bezier recursion of 0,
+ *  so the scenes use 3 subdivisions or more and a recursion of 1 or more, like the user interface.
+ *  findBoundaryCells misses the parameters between (k - 1) * step + step and k * step, which differ by the rounding of its steps,
+ *  and returns the last cell for them. Those are counted as defects of the reference as long as findCell picks k - 1 or k,
+ *  any other difference is a failure.
+ *
+ *  cameraLatticeConformance [-seed n] [-scenes n] [-points n]
+ *
+ */
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <math.h>
+#include <string>
+#include <vector>
+#include <algorithm>
+
+#include <tbb/task_arena.h>
+#include <tbb/parallel_for.h>
+#include <tbb/blocked_range.h>
+#include <tbb/partitioner.h>
+
+#include "cameraLatticeCore.h"
+#include "cameraLatticeKernel.h"
+#include "referenceDeformer.h"
+
+static const double interpolationTolerance = 0.00001;
+static const double influenceTolerance = 0.000000000001;
+static const double deformTolerance = 0.00001;
+static const double kernelTolerance = 0.00001;
+static const double floatTolerance = 0.0001;
+static const double floatGateTolerance = 0.00001;
+
+/**********************************************************
+ RANDOM SCENES
+ **********************************************************/
+
+class Random
+{
+public:
+    Random(unsigned int seed) : m_state(seed) {};
+
+    // uniform in (min, max)
+    double next(double min, double max)
+    {
+        m_state = m_state * 1664525u + 1013904223u;
+        return min + (max - min) * (double(m_state >> 8) / double(1 << 24));
+    }
+
+    int nextInt(int min, int max)
+    {
+        int value = int(next(min, max + 1));
+        return value > max ? max : value;
+    }
+
+    bool chance(double probability) { return next(0.0, 1.0) < probability; }
+
+private:
+    unsigned int m_state;
+};
+
+// rotation, scale along the rotated axes then translation, as a Maya transform with row vectors
+Matrix4 randomTransform(Random &random, double minScale, double maxScale, double translation)
+{
+    double angles[3] = {random.next(-M_PI, M_PI), random.next(-M_PI, M_PI), random.next(-M_PI, M_PI)};
+    double c[3], s[3];
+    for (int axis = 0; axis < 3; axis++)
+    {
+        c[axis] = cos(angles[axis]);
+        s[axis] = sin(angles[axis]);
+    }
+
+    double rx[4][4] = {{1, 0, 0, 0}, {0, c[0], s[0], 0}, {0, -s[0], c[0], 0}, {0, 0, 0, 1}};
+    double ry[4][4] = {{c[1], 0, -s[1], 0}, {0, 1, 0, 0}, {s[1], 0, c[1], 0}, {0, 0, 0, 1}};
+    double rz[4][4] = {{c[2], s[2], 0, 0}, {-s[2], c[2], 0, 0}, {0, 0, 1, 0}, {0, 0, 0, 1}};
+    Matrix4 result = Matrix4(rx) * Matrix4(ry) * Matrix4(rz);
+
+    for (int row = 0; row < 3; row++)
+    {
+        double scale = random.next(minScale, maxScale);
+        for (int column = 0; column < 3; column++)
+            result[row][column] *= scale;
+        result[3][row] = random.next(-translation, translation);
+    }
+    return result;
+}
+
+struct ConformanceScene
+{
+    void build(Random &random, int numPoints, int behaviour)
+    {
+        this->behaviour = behaviour;
+
+        cameraMatrix = randomTransform(random, 1.0, 1.0, 20.0);
+        isOrtho = random.chance(0.3);
+        camera.compile(cameraMatrix, isOrtho, random.next(1.0, 50.0), random.next(0.5, 2.0), random.next(0.3, 1.5), random.next(12.0, 150.0));
+
+        objectMatrix = randomTransform(random, 0.5, 2.0, 10.0);
+        invObjectMatrix = objectMatrix.inverse();
+        //the matrices of the reference
+        projectionMatrix = objectMatrix * camera.inverseMatrix;
+        invProjectionMatrix = camera.matrix * invObjectMatrix;
+
+        gateOffsetValue = random.chance(0.2) ? 0.0 : random.next(0.0, 0.3);
+        envelopeValue = random.chance(0.5) ? 1.0 : random.next(0.0, 1.0);
+        maxRecursion = random.nextInt(1, 10);
+
+        //at rest, a few points edited or every point edited
+        sD = random.nextInt(3, 12);
+        tD = random.nextInt(3, 12);
+        int state = random.nextInt(0, 2);
+        planePoints.resize(sD * tD);
+        for (int t = 0; t < tD; t++)
+            for (int s = 0; s < sD; s++)
+            {
+                Point3 &point = planePoints[s + t * sD];
+                point = Point3(double(s) / (sD - 1) - 0.5, double(t) / (tD - 1) - 0.5, 0.0);
+                if (state == 2 || (state == 1 && random.chance(0.1)))
+                {
+                    point.x += random.next(-0.5, 0.5) / (sD - 1);
+                    point.y += random.next(-0.5, 0.5) / (tD - 1);
+                }
+            }
+
+        lattice = CompiledLattice();
+        lattice.compile(planePoints, sD, tD);
+        if (behaviour == kBezier)
+            lattice.compileBezierWindows(maxRecursion);
+        lattice.compileIdentityMask(behaviour);
+
+        //around the gate, with a few points behind a perspective camera
+        points.resize(numPoints);
+        for (int i = 0; i < numPoints; i++)
+        {
+            double depth = isOrtho ? random.next(-50.0, 50.0) : (random.chance(0.05) ? random.next(0.1, 10.0) : -random.next(0.5, 50.0));
+            double scale = isOrtho ? 1.0 : fabs(depth);
+            Point3 cameraPoint(random.next(-0.7, 0.7) * camera.filmHAperture * scale,
+                               random.next(-0.7, 0.7) * camera.filmVAperture * scale, depth);
+            points[i] = cameraPoint * camera.matrix * invObjectMatrix;
+        }
+
+        //world space areas centred on some of the points
+        influencers.resize(random.chance(0.4) ? 0 : random.nextInt(1, 5));
+        for (size_t i = 0; i < influencers.size(); i++)
+        {
+            Matrix4 matrix = randomTransform(random, 0.5, 10.0, 0.0);
+            Point3 centre = points[random.nextInt(0, numPoints - 1)] * objectMatrix;
+            matrix[3][0] = centre.x;
+            matrix[3][1] = centre.y;
+            matrix[3][2] = centre.z;
+            influencers[i].set(matrix, random.chance(0.2) ? 0.0 : random.next(0.0, 1.0));
+        }
+        influencerGrid.build(influencers);
+
+        stage.lattice = &lattice;
+        stage.setCamera(camera, objectMatrix, invObjectMatrix);
+        stage.behaviour = behaviour;
+        stage.gateOffsetValue = gateOffsetValue;
+        stage.envelopeValue = envelopeValue;
+        stage.useInfluencers = true;
+    }
+
+    // the distance the tolerance of the deformation is relative to
+    double depthScale(const Point3 &point) const
+    {
+        if (isOrtho)
+            return camera.filmHAperture > camera.filmVAperture ? camera.filmHAperture : camera.filmVAperture;
+        return fabs((point * projectionMatrix).z);
+    }
+
+    Matrix4 cameraMatrix, objectMatrix, invObjectMatrix, projectionMatrix, invProjectionMatrix;
+    CompiledCamera camera;
+    bool isOrtho;
+
+    std::vector<Point3> planePoints;
+    int sD, tD, behaviour, maxRecursion;
+    CompiledLattice lattice;
+    LatticeStage stage;
+
+    double gateOffsetValue, envelopeValue;
+    std::vector<Influencer> influencers;
+    InfluencerGrid influencerGrid;
+
+    std::vector<Point3> points;
+};
+
+/**********************************************************
+ DEFORMATIONS UNDER TEST
+ **********************************************************/
+
+// the per vertex steps of StackedLatticeData::operator() with a single lattice
+class StageDeformer
+{
+public:
+    StageDeformer(const ConformanceScene &scene, std::vector<Point3> &deformedPoints) : m_scene(scene), m_deformedPoints(deformedPoints) {};
+
+    void operator()(const tbb::blocked_range<size_t> &r) const
+    {
+        std::vector<double> uBasis(m_scene.sD), vBasis(m_scene.tD);
+        bool hasInfluencers = !m_scene.influencers.empty();
+
+        for (size_t i = r.begin(); i != r.end(); ++i)
+        {
+            Point3 point = m_scene.points[i];
+
+            double weight = m_scene.stage.envelopeValue;
+            if (hasInfluencers)
+                weight *= get_influencers_weight(point * m_scene.objectMatrix, &m_scene.influencers, &m_scene.influencerGrid);
+            if (weight < 0.00001)
+                continue;
+
+            if (deformStagePoint(m_scene.stage, point, weight, &uBasis[0], &vBasis[0]))
+                m_deformedPoints[i] = point;
+        }
+    }
+
+private:
+    const ConformanceScene &m_scene;
+    std::vector<Point3> &m_deformedPoints;
+};
+
+// the caches the deformer keeps for a geometry between two evaluations
+struct KernelCaches
+{
+    void reset(size_t numPoints)
+    {
+        projection.invalidate();
+        projection.u.resize(numPoints);
+        projection.v.resize(numPoints);
+        projection.cameraZ.resize(numPoints);
+        weights.weights.assign(numPoints, -1.0f);
+        weights.valid = true;
+    }
+
+    ProjectionCache projection;
+    InfluenceWeightCache weights;
+};
+
+// CameraLatticeKernel or CameraLatticeFloatKernel of the deformer over all the points, or over vertexIndices when given,
+// deformedPoints holds the previous result, the points which do not move are not written
+template <typename Kernel, typename Buffer>
+void runKernel(const ConformanceScene &scene, const CompiledLattice &lattice, KernelCaches &caches, const Buffer &points,
+               const Buffer &deformedPoints, const std::vector<unsigned int> *vertexIndices)
+{
+    Matrix4 projectionMatrix = scene.projectionMatrix;
+    Matrix4 invProjectionMatrix = scene.invProjectionMatrix;
+    Matrix4 objectMatrix = scene.objectMatrix;
+    std::vector<Influencer> influencers = scene.influencers;
+
+    Kernel kernel(&projectionMatrix, &invProjectionMatrix, &objectMatrix, points, deformedPoints, &lattice, &caches.projection, &caches.weights,
+                  scene.camera.filmHAperture, scene.camera.filmVAperture, scene.isOrtho, scene.behaviour,
+                  &influencers, &scene.influencerGrid, scene.gateOffsetValue, scene.envelopeValue);
+
+    size_t count = points.length();
+    if (vertexIndices)
+    {
+        kernel.setVertexIndices(vertexIndices->empty() ? NULL : &(*vertexIndices)[0]);
+        count = vertexIndices->size();
+    }
+    kernel(tbb::blocked_range<size_t>(0, count));
+
+    //like the deformer, the projections are reused from the next evaluation on
+    caches.projection.valid = true;
+}
+
+/**********************************************************
+ CHECKS
+ **********************************************************/
+
+struct CheckResult
+{
+    CheckResult(const char *name, double tolerance) : name(name), tolerance(tolerance), cases(0), failures(0), referenceDefects(0), gateEdges(0), maxError(0.0) {};
+
+    void add(double error)
+    {
+        cases++;
+        //nan fails too
+        if (!(error <= tolerance))
+            failures++;
+        if (error > maxError || error != error)
+            maxError = error;
+    }
+
+    std::string name;
+    double tolerance;
+    unsigned long long cases, failures, referenceDefects, gateEdges;
+    double maxError;
+};
+
+double distance(const Point3 &a, const Point3 &b)
+{
+    return (a - b).length();
+}
+
+// the cell k when the parameter falls between the last step of findBoundaryCells, (k - 1) * step + step, and its first step, k * step,
+// which differ by the rounding of the steps, -1 when it does not
+int referenceMissedCell(double w, int D)
+{
+    double step = 1.0 / (D - 1);
+    for (int k = 1; k < D - 1; k++)
+    {
+        if (step * (k - 1) + step <= w && w < step * k)
+            return k;
+    }
+    return -1;
+}
+
+void checkCells(Random &random, CheckResult &result)
+{
+    int D = random.nextInt(3, 40);
+    for (int i = 0; i < 1000; i++)
+    {
+        //exact cell edges are the hard cases
+        double w = random.chance(0.2) ? double(random.nextInt(0, D - 1)) / (D - 1) : random.next(-0.5, 1.5);
+
+        int min, max;
+        referenceFindBoundaryCells(w, D, min, max);
+        double local;
+        int cell = findCell(w, D, local);
+
+        //the reference returns the last cell for the parameters it misses, findCell must pick one of the two cells of the edge
+        int missedCell = referenceMissedCell(w, D);
+        if (missedCell != -1)
+        {
+            if (min != D - 2)
+            {
+                result.add(1.0);
+                continue;
+            }
+            result.referenceDefects++;
+            result.add(cell == missedCell - 1 || cell == missedCell ? 0.0 : 1.0);
+            continue;
+        }
+
+        //the neighbour cell is right too when the parameter is on their shared edge
+        bool sharedEdge = (cell == min + 1 && local < 0.000000001) || (cell == min - 1 && local > 1.0 - 0.000000001);
+        result.add(cell == min || sharedEdge ? 0.0 : 1.0);
+    }
+}
+
+// sum of the absolute values of the bernstein polynomials of the window at the parameter, 1 inside the window
+double bernsteinGrowth(const std::vector<BezierWindow> &windows, double w)
+{
+    double local;
+    const BezierWindow &window = windows[findCell(w, int(windows.size()) + 1, local)];
+    double s = (w - window.minParam) * window.invRange;
+    return pow(fabs(s) + fabs(1.0 - s), window.max - window.min - 1);
+}
+
+void checkInterpolation(const ConformanceScene &scene, Random &random, CheckResult &linear, CheckResult &bezier)
+{
+    CompiledLattice bezierLattice = scene.lattice;
+    bezierLattice.compileBezierWindows(scene.maxRecursion);
+    std::vector<double> uBasis(scene.sD), vBasis(scene.tD);
+
+    for (int i = 0; i < 200; i++)
+    {
+        double u = random.next(-0.3, 1.3);
+        double v = random.next(-0.3, 1.3);
+
+        Point3 expected, actual;
+        referenceFindLinearDeformedPoint(expected, &scene.planePoints, u, v, scene.sD, scene.tD);
+        findLinearDeformedPoint(actual, &scene.lattice, u, v);
+        linear.add(std::max(fabs(expected.x - actual.x), fabs(expected.y - actual.y)));
+
+        referenceFindBezierWindowPoint(expected, &scene.planePoints, u, v, scene.sD, scene.tD, scene.maxRecursion);
+        findBezierDeformedPoint(actual, &bezierLattice, u, v, &uBasis[0], &vBasis[0]);
+        bezier.add(std::max(fabs(expected.x - actual.x), fabs(expected.y - actual.y)) /
+                   (bernsteinGrowth(bezierLattice.sWindows, u) * bernsteinGrowth(bezierLattice.tWindows, v)));
+    }
+}
+
+void checkInfluencers(const ConformanceScene &scene, Random &random, CheckResult &result)
+{
+    if (scene.influencers.empty())
+        return;
+
+    for (size_t i = 0; i < scene.points.size(); i++)
+    {
+        //world space points around the areas, half of them inside one
+        Point3 point = scene.points[i] * scene.objectMatrix;
+        if (random.chance(0.5))
+        {
+            const Influencer &influencer = scene.influencers[random.nextInt(0, int(scene.influencers.size()) - 1)];
+            point = influencer.pos + Point3(random.next(-1.0, 1.0), random.next(-1.0, 1.0), random.next(-1.0, 1.0)) * influencer.maxAxisLength;
+        }
+
+        result.add(fabs(referenceInfluencersWeight(point, &scene.influencers) -
+                        get_influencers_weight(point, &scene.influencers, &scene.influencerGrid)));
+    }
+}
+
+// LatticeDeformerData, the kernel of the tools, or the stacked lattices of the deformer
+void runDeformer(const ConformanceScene &scene, bool stacked, int threads, size_t grainSize, std::vector<Point3> &deformedPoints)
+{
+    deformedPoints = scene.points;
+    tbb::task_arena arena(threads);
+    tbb::blocked_range<size_t> range(0, scene.points.size(), grainSize);
+    if (stacked)
+    {
+        StageDeformer deformer(scene, deformedPoints);
+        arena.execute([&] { tbb::parallel_for(range, deformer, tbb::simple_partitioner()); });
+    }
+    else
+    {
+        LatticeDeformerData deformer(&scene.stage, &scene.objectMatrix, &scene.influencers, &scene.influencerGrid,
+                                     &scene.points[0], &deformedPoints[0]);
+        arena.execute([&] { tbb::parallel_for(range, deformer, tbb::simple_partitioner()); });
+    }
+}
+
+void checkDeformation(const ConformanceScene &scene, CheckResult *kernel, CheckResult &stage, CheckResult &threads)
+{
+    std::vector<Point3> actual, stageActual, threaded;
+    runDeformer(scene, false, 1, scene.points.size(), actual);
+    runDeformer(scene, true, 1, scene.points.size(), stageActual);
+
+    int threadCounts[] = {2, 3, 8};
+    size_t grainSizes[] = {1, 7, 256};
+    for (int t = 0; t < 3; t++)
+    {
+        runDeformer(scene, false, threadCounts[t], grainSizes[t], threaded);
+        threads.add(memcmp(&actual[0], &threaded[0], sizeof(Point3) * actual.size()) == 0 ? 0.0 : 1.0);
+    }
+
+    for (size_t i = 0; i < scene.points.size(); i++)
+        stage.add(memcmp(&actual[i], &stageActual[i], sizeof(Point3)) == 0 ? 0.0 : 1.0);
+
+    if (!kernel)
+        return;
+
+    std::vector<Point3> expected(scene.points);
+    ReferenceDeformer reference(&scene.projectionMatrix, &scene.invProjectionMatrix, &scene.objectMatrix, &scene.points, &expected,
+                                &scene.planePoints, scene.camera.filmHAperture, scene.camera.filmVAperture, scene.sD, scene.tD,
+                                scene.isOrtho, scene.maxRecursion, scene.behaviour, &scene.influencers,
+                                scene.gateOffsetValue, scene.envelopeValue);
+    reference(tbb::blocked_range<size_t>(0, scene.points.size()));
+
+    for (size_t i = 0; i < scene.points.size(); i++)
+        kernel->add(distance(expected[i], actual[i]) / (1.0 + scene.depthScale(scene.points[i])));
+}
+
+// the vertices of the cells supporting the lattice points changed by the last compile, as the deformer updates them
+void changedVertices(const CompiledLattice &lattice, int behaviour, const ProjectionCache &cache, double gateOffsetValue,
+                     std::vector<unsigned int> &vertexIndices)
+{
+    std::vector<unsigned int> cellStart, cellVertices;
+    buildCellIndex(cache, lattice, gateOffsetValue, NULL, cellStart, cellVertices);
+
+    std::vector<char> changedCells;
+    lattice.findChangedCells(behaviour, changedCells);
+    vertexIndices.clear();
+    for (size_t cell = 0; cell < changedCells.size(); cell++)
+    {
+        if (changedCells[cell])
+            vertexIndices.insert(vertexIndices.end(), cellVertices.begin() + cellStart[cell], cellVertices.begin() + cellStart[cell + 1]);
+    }
+}
+
+// true when the lattice parameters are on the edge of the gate grown by the offset, within the rounding of the float kernel
+bool onGateEdge(double u, double v, double gateOffsetValue)
+{
+    double edges[2] = {0.0 - gateOffsetValue, 1.0 + gateOffsetValue};
+    for (int i = 0; i < 2; i++)
+    {
+        if (fabs(u - edges[i]) < floatGateTolerance || fabs(v - edges[i]) < floatGateTolerance)
+            return true;
+    }
+    return false;
+}
+
+// the kernels of the deformer in both precisions, with their projection, influence weight and incremental caches
+void checkKernels(const ConformanceScene &scene, Random &random, CheckResult &doubleKernel, CheckResult &floatKernel,
+                  CheckResult &caches, CheckResult &incremental)
+{
+    typedef CameraLatticeKernel<Point3Buffer> DoubleKernel;
+    typedef CameraLatticeFloatKernel<FloatPointBuffer> FloatKernel;
+
+    unsigned int numPoints = (unsigned int)scene.points.size();
+    std::vector<Point3> points(scene.points);
+    std::vector<float> rawPoints(3 * numPoints);
+    Point3Buffer pointBuffer(&points[0], numPoints);
+    FloatPointBuffer rawBuffer(&rawPoints[0], numPoints);
+    for (unsigned int i = 0; i < numPoints; i++)
+        rawBuffer.set(i, points[i]);
+
+    //full evaluations, the deformed points start as a copy of the input like in the deformer
+    KernelCaches doubleCaches, floatCaches;
+    doubleCaches.reset(numPoints);
+    floatCaches.reset(numPoints);
+    std::vector<Point3> deformed(points);
+    std::vector<float> rawDeformed(rawPoints);
+    Point3Buffer deformedBuffer(&deformed[0], numPoints);
+    FloatPointBuffer rawDeformedBuffer(&rawDeformed[0], numPoints);
+    runKernel<DoubleKernel>(scene, scene.lattice, doubleCaches, pointBuffer, deformedBuffer, NULL);
+    runKernel<FloatKernel>(scene, scene.lattice, floatCaches, rawBuffer, rawDeformedBuffer, NULL);
+
+    std::vector<Point3> expected;
+    runDeformer(scene, false, 1, numPoints, expected);
+    for (unsigned int i = 0; i < numPoints; i++)
+    {
+        double scale = 1.0 + scene.depthScale(points[i]);
+        doubleKernel.add(distance(expected[i], deformed[i]) / scale);
+
+        //the precisions may disagree on the culling of a point on the edge of the gate, only there
+        bool moved = memcmp(&deformed[i], &points[i], sizeof(Point3)) != 0;
+        bool rawMoved = memcmp(&rawDeformed[3 * i], &rawPoints[3 * i], 3 * sizeof(float)) != 0;
+        if (moved != rawMoved && onGateEdge(doubleCaches.projection.u[i], doubleCaches.projection.v[i], scene.gateOffsetValue))
+        {
+            floatKernel.gateEdges++;
+            continue;
+        }
+        floatKernel.add(distance(deformed[i], rawDeformedBuffer.get(i)) / scale);
+    }
+
+    //the projections of the double kernel are the ones of projectPoint, the second runs read them and the weights back
+    for (unsigned int i = 0; i < numPoints; i++)
+    {
+        double u, v, cameraZ;
+        projectPoint(points[i], scene.projectionMatrix, scene.camera.filmHAperture, scene.camera.filmVAperture, scene.isOrtho, u, v, cameraZ);
+        const ProjectionCache &cache = doubleCaches.projection;
+        caches.add(u == cache.u[i] && v == cache.v[i] && cameraZ == cache.cameraZ[i] ? 0.0 : 1.0);
+    }
+
+    std::vector<float> weights(doubleCaches.weights.weights), rawWeights(floatCaches.weights.weights);
+    std::vector<Point3> again(points);
+    std::vector<float> rawAgain(rawPoints);
+    runKernel<DoubleKernel>(scene, scene.lattice, doubleCaches, pointBuffer, Point3Buffer(&again[0], numPoints), NULL);
+    runKernel<FloatKernel>(scene, scene.lattice, floatCaches, rawBuffer, FloatPointBuffer(&rawAgain[0], numPoints), NULL);
+    caches.add(memcmp(&again[0], &deformed[0], sizeof(Point3) * numPoints) == 0 ? 0.0 : 1.0);
+    caches.add(rawAgain == rawDeformed ? 0.0 : 1.0);
+    caches.add(weights == doubleCaches.weights.weights && rawWeights == floatCaches.weights.weights ? 0.0 : 1.0);
+
+    //a few lattice points move, only the vertices around them are updated on top of the previous result
+    std::vector<Point3> planePoints(scene.planePoints);
+    int numMoved = random.nextInt(1, 3);
+    for (int i = 0; i < numMoved; i++)
+    {
+        Point3 &point = planePoints[random.nextInt(0, scene.sD * scene.tD - 1)];
+        point.x += random.next(-0.3, 0.3) / (scene.sD - 1);
+        point.y += random.next(-0.3, 0.3) / (scene.tD - 1);
+    }
+
+    CompiledLattice lattice = scene.lattice;
+    lattice.compile(planePoints, scene.sD, scene.tD);
+    if (scene.behaviour == kBezier)
+        lattice.compileBezierWindows(scene.maxRecursion);
+    lattice.compileIdentityMask(scene.behaviour);
+
+    std::vector<unsigned int> vertexIndices, rawVertexIndices;
+    changedVertices(lattice, scene.behaviour, doubleCaches.projection, scene.gateOffsetValue, vertexIndices);
+    changedVertices(lattice, scene.behaviour, floatCaches.projection, scene.gateOffsetValue, rawVertexIndices);
+    runKernel<DoubleKernel>(scene, lattice, doubleCaches, pointBuffer, deformedBuffer, &vertexIndices);
+    runKernel<FloatKernel>(scene, lattice, floatCaches, rawBuffer, rawDeformedBuffer, &rawVertexIndices);
+
+    KernelCaches fullCaches, rawFullCaches;
+    fullCaches.reset(numPoints);
+    rawFullCaches.reset(numPoints);
+    std::vector<Point3> full(points);
+    std::vector<float> rawFull(rawPoints);
+    runKernel<DoubleKernel>(scene, lattice, fullCaches, pointBuffer, Point3Buffer(&full[0], numPoints), NULL);
+    runKernel<FloatKernel>(scene, lattice, rawFullCaches, rawBuffer, FloatPointBuffer(&rawFull[0], numPoints), NULL);
+
+    for (unsigned int i = 0; i < numPoints; i++)
+    {
+        incremental.add(memcmp(&deformed[i], &full[i], sizeof(Point3)) == 0 ? 0.0 : 1.0);
+        incremental.add(memcmp(&rawDeformed[3 * i], &rawFull[3 * i], 3 * sizeof(float)) == 0 ? 0.0 : 1.0);
+    }
+}
+
+// the inputs of fingerprintEvaluation in the deformer
+struct FingerprintInputs
+{
+    FingerprintInputs(const ConformanceScene &scene)
+        : lattice(scene.lattice), behaviour(scene.behaviour), camera(scene.camera), objectMatrix(scene.objectMatrix),
+          envelopeValue(scene.envelopeValue), gateOffsetValue(scene.gateOffsetValue), precisionValue(0),
+          influencers(scene.influencers), points(scene.points) {};
+
+    unsigned long long value() const
+    {
+        Fingerprint fingerprint;
+        fingerprintSettings(fingerprint, lattice, behaviour, camera, objectMatrix, envelopeValue, gateOffsetValue, precisionValue,
+                            influencers, paintedWeights.empty() ? NULL : &paintedWeights[0], paintedWeights.size());
+        fingerprint.add(&points[0], sizeof(Point3) * points.size());
+        return fingerprint.value();
+    }
+
+    CompiledLattice lattice;
+    int behaviour;
+    CompiledCamera camera;
+    Matrix4 objectMatrix;
+    double envelopeValue, gateOffsetValue;
+    int precisionValue;
+    std::vector<Influencer> influencers;
+    std::vector<float> paintedWeights;
+    std::vector<Point3> points;
+};
+
+// the result cache returns a previous result only when nothing it depends on changed
+void checkFingerprint(const ConformanceScene &scene, Random &random, CheckResult &result)
+{
+    FingerprintInputs base(scene);
+    unsigned long long baseValue = base.value();
+    result.add(FingerprintInputs(scene).value() == baseValue ? 0.0 : 1.0);
+
+    //every setting changed on its own, each must give its own value
+    std::vector<unsigned long long> values(1, baseValue);
+    for (int setting = 0; setting < 15; setting++)
+    {
+        FingerprintInputs inputs(scene);
+        switch (setting)
+        {
+            case 0:
+            {
+                std::vector<Point3> planePoints(scene.planePoints);
+                planePoints[random.nextInt(0, scene.sD * scene.tD - 1)].x += 0.001;
+                inputs.lattice.compile(planePoints, scene.sD, scene.tD);
+                break;
+            }
+            case 1: inputs.behaviour = (scene.behaviour + 1) % 4; break;
+            case 2:
+                //the recursion only counts for the bezier interpolation
+                if (scene.behaviour != kBezier)
+                    continue;
+                inputs.lattice.compileBezierWindows(scene.maxRecursion + 1);
+                break;
+            case 3: inputs.camera.matrix[3][0] += 0.001; break;
+            case 4: inputs.camera.filmHAperture *= 1.001; break;
+            case 5: inputs.camera.filmVAperture *= 1.001; break;
+            case 6: inputs.camera.isOrtho = !scene.isOrtho; break;
+            case 7: inputs.objectMatrix[3][1] += 0.001; break;
+            case 8: inputs.envelopeValue = scene.envelopeValue > 0.5 ? scene.envelopeValue - 0.25 : scene.envelopeValue + 0.25; break;
+            case 9: inputs.gateOffsetValue += 0.01; break;
+            case 10: inputs.precisionValue = 1; break;
+            case 11:
+                if (inputs.influencers.empty())
+                {
+                    Influencer influencer;
+                    influencer.set(randomTransform(random, 0.5, 10.0, 10.0), 0.5);
+                    inputs.influencers.push_back(influencer);
+                }
+                else
+                    inputs.influencers[0].falloff += 0.1;
+                break;
+            case 12: inputs.paintedWeights.assign(scene.points.size(), 1.0f); break;
+            case 13:
+                inputs.paintedWeights.assign(scene.points.size(), 1.0f);
+                inputs.paintedWeights[random.nextInt(0, int(scene.points.size()) - 1)] = 0.5f;
+                break;
+            case 14: inputs.points[random.nextInt(0, int(scene.points.size()) - 1)].z += 0.001; break;
+        }
+        values.push_back(inputs.value());
+    }
+
+    for (size_t i = 0; i < values.size(); i++)
+        result.add(std::count(values.begin(), values.end(), values[i]) == 1 ? 0.0 : 1.0);
+}
+
+/**********************************************************
+ MAIN
+ **********************************************************/
+
+int main(int argc, char **argv)
+{
+    unsigned int seed = 1;
+    int numScenes = 200;
+    int numPoints = 2000;
+
+    for (int i = 1; i < argc; i++)
+    {
+        if (strcmp(argv[i], "-seed") == 0 && i + 1 < argc)
+            seed = (unsigned int)atoi(argv[++i]);
+        else if (strcmp(argv[i], "-scenes") == 0 && i + 1 < argc)
+            numScenes = atoi(argv[++i]);
+        else if (strcmp(argv[i], "-points") == 0 && i + 1 < argc)
+            numPoints = atoi(argv[++i]);
+        else
+        {
+            fprintf(stderr, "usage: cameraLatticeConformance [-seed n] [-scenes n] [-points n]\n");
+            return 1;
+        }
+    }
+
+    CheckResult cells("findCell against findBoundaryCells", 0.0);
+    CheckResult linear("findLinearDeformedPoint", interpolationTolerance);
+    CheckResult bezier("findBezierDeformedPoint", interpolationTolerance);
+    CheckResult influence("get_influencers_weight", influenceTolerance);
+    CheckResult linearKernel("deformer kernel, linear", deformTolerance);
+    CheckResult bezierKernel("deformer kernel, bezier", deformTolerance);
+    CheckResult stage("stacked lattice against the kernel", 0.0);
+    CheckResult threads("thread counts against one thread", 0.0);
+    CheckResult doubleKernel("double kernel against LatticeDeformerData", kernelTolerance);
+    CheckResult floatKernel("float kernel against the double kernel", floatTolerance);
+    CheckResult caches("projection and weight caches", 0.0);
+    CheckResult incremental("incremental against full evaluation", 0.0);
+    CheckResult fingerprint("result cache fingerprint", 0.0);
+
+    Random random(seed);
+    for (int i = 0; i < numScenes; i++)
+    {
+        int behaviour = i % 4;
+        ConformanceScene scene;
+        scene.build(random, numPoints, behaviour);
+
+        checkCells(random, cells);
+        checkInterpolation(scene, random, linear, bezier);
+        checkInfluencers(scene, random, influence);
+        CheckResult *kernel = NULL;
+        if (behaviour == kLinear)
+            kernel = &linearKernel;
+        else if (behaviour == kBezier)
+            kernel = &bezierKernel;
+        checkDeformation(scene, kernel, stage, threads);
+        checkKernels(scene, random, doubleKernel, floatKernel, caches, incremental);
+        checkFingerprint(scene, random, fingerprint);
+    }
+
+    CheckResult *results[] = {&cells, &linear, &bezier, &influence, &linearKernel, &bezierKernel, &stage, &threads,
+                              &doubleKernel, &floatKernel, &caches, &incremental, &fingerprint};
+    int numResults = int(sizeof(results) / sizeof(results[0]));
+    int failed = 0;
+    for (int i = 0; i < numResults; i++)
+    {
+        const CheckResult &result = *results[i];
+        printf("%-4s %-44s %10llu cases, max error %.3g, tolerance %.3g", result.failures ? "FAIL" : "ok", result.name.c_str(),
+               result.cases, result.maxError, result.tolerance);
+        if (result.referenceDefects)
+            printf(", %llu reference defects", result.referenceDefects);
+        if (result.gateEdges)
+            printf(", %llu on the edge of the gate", result.gateEdges);
+        printf("\n");
+        if (result.failures)
+            failed++;
+    }
+
+    printf("seed %u, %d scenes of %d points: %s\n", seed, numScenes, numPoints, failed ? "FAILED" : "passed");
+    return failed ? 1 : 0;
+}
@@ -0,0 +1,184 @@
+#                 Toolchefs ltd - Software Disclaimer
+#
+# Copyright 2014 Toolchefs Limited
+#
+# The software, information, code, data and other materials (Software)
+# contained in, or related to, these files is the confidential and proprietary
+# information of Toolchefs ltd.
+# The software is protected by copyright. The Software must not be disclosed,
+# distributed or provided to any third party without the prior written
+# authorisation of Toolchefs ltd.
+
+# Checks tcCameraLattice.deformation against tcCameraLatticeBatch over random scenes:
+# perspective and orthographic cameras, the four interpolations, gate offsets, envelopes and influence areas.
+# Both evaluate the same points in double precision, they must agree within 1e-10 in scene units.
+#
+# compareDeformation.py path/to/tcCameraLatticeBatch [-seed n] [-scenes n] [-points n]
+#
+# Exits with 77, skipped for ctest, when NumPy is not installed.
+
+from __future__ import division, print_function
+
+import argparse
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+
+# the exit code ctest counts as skipped
+SKIPPED = 77
+
+try:
+    import numpy
+except ImportError:
+    print('NumPy is not installed, skipped')
+    sys.exit(SKIPPED)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'python'))
+from tcCameraLattice import deformation
+
+TOLERANCE = 1e-10
+
+INTERPOLATION_NAMES = ['linear', 'bezier', 'bspline', 'catmullrom']
+
+
+def _values(array):
+    return ' '.join(repr(float(value)) for value in numpy.ravel(array))
+
+
+def _write_points(path, points):
+    # raw points of cameraLatticeMeshStream.h, in doubles
+    with open(path, 'wb') as points_file:
+        points_file.write(b'TCLP' + struct.pack('<IIIQ', 1, 8, 0, points.shape[0]))
+        points_file.write(points.astype('<f8').tobytes())
+
+
+def _read_points(path):
+    with open(path, 'rb') as points_file:
+        data = points_file.read()
+    return numpy.frombuffer(data[24:], '<f8').reshape(-1, 3)
+
+
+def _random_scene(rng, index, num_points):
+    scene = {'interpolation': index % 4,
+             'orthographic': index % 5 == 4,
+             's_divisions': rng.randint(3, 9),
+             't_divisions': rng.randint(3, 9),
+             'max_recursion': rng.randint(1, 6),
+             'gate_offset': float(rng.choice([0.0, 0.1, 0.3])),
+             'envelope': float(rng.choice([1.0, 0.6])),
+             'orthographic_width': 14.0,
+             'focal_length': float(rng.uniform(20.0, 80.0))}
+
+    # the camera looks down -z from 12 units away, turned a little around y
+    angle = rng.uniform(-0.5, 0.5)
+    cosine, sine = numpy.cos(angle), numpy.sin(angle)
+    scene['camera_matrix'] = numpy.array([[cosine, 0, -sine, 0], [0, 1, 0, 0], [sine, 0, cosine, 0],
+                                          [rng.uniform(-1, 1), rng.uniform(-1, 1), 12, 1]])
+    object_matrix = numpy.identity(4)
+    object_matrix[3, :3] = rng.uniform(-1, 1, 3)
+    object_matrix[0, 0] = 1.3
+    scene['object_matrix'] = object_matrix
+
+    # about half of the lattice points edited
+    s_divisions, t_divisions = scene['s_divisions'], scene['t_divisions']
+    lattice_points = numpy.array([[s / (s_divisions - 1) - 0.5, t / (t_divisions - 1) - 0.5]
+                                  for t in range(t_divisions) for s in range(s_divisions)])
+    lattice_points += rng.uniform(-0.08, 0.08, lattice_points.shape) * (rng.rand(len(lattice_points), 1) < 0.5)
+    scene['lattice_points'] = lattice_points
+
+    scene['influencer_matrices'] = []
+    scene['influencer_falloffs'] = []
+    for i in range(index % 3):
+        matrix = numpy.identity(4) * rng.uniform(1, 4)
+        matrix[3] = numpy.append(rng.uniform(-2, 2, 3), 1.0)
+        scene['influencer_matrices'].append(matrix)
+        scene['influencer_falloffs'].append(float(rng.uniform(0, 1)))
+
+    scene['points'] = rng.uniform(-6, 6, (num_points, 3))
+    return scene
+
+
+def _write_sidecar(path, scene):
+    # a single frame, see cameraLatticeSidecar.h
+    with open(path, 'w') as sidecar:
+        sidecar.write('frame 1\n')
+        sidecar.write('camera %s\n' % _values(scene['camera_matrix']))
+        sidecar.write('ortho %d\n' % int(scene['orthographic']))
+        sidecar.write('orthographicWidth %r\n' % scene['orthographic_width'])
+        sidecar.write('filmAperture 1.417 0.945\n')
+        sidecar.write('focalLength %r\n' % scene['focal_length'])
+        sidecar.write('objectMatrix %s\n' % _values(scene['object_matrix']))
+        sidecar.write('lattice %d %d\n' % (scene['s_divisions'], scene['t_divisions']))
+        sidecar.write('latticePoints %s\n' % _values(scene['lattice_points']))
+        sidecar.write('interpolation %s\n' % INTERPOLATION_NAMES[scene['interpolation']])
+        sidecar.write('recursion %d\n' % scene['max_recursion'])
+        sidecar.write('gateOffset %r\n' % scene['gate_offset'])
+        sidecar.write('envelope %r\n' % scene['envelope'])
+        for matrix, falloff in zip(scene['influencer_matrices'], scene['influencer_falloffs']):
+            sidecar.write('influencer %r %s\n' % (falloff, _values(matrix)))
+
+
+def _deform(scene):
+    return deformation.deform(scene['points'], scene['lattice_points'], scene['s_divisions'], scene['t_divisions'],
+                              scene['camera_matrix'], scene['object_matrix'], orthographic=scene['orthographic'],
+                              orthographic_width=scene['orthographic_width'], horizontal_aperture=1.417,
+                              vertical_aperture=0.945, focal_length=scene['focal_length'],
+                              interpolation=scene['interpolation'], max_recursion=scene['max_recursion'],
+                              gate_offset=scene['gate_offset'], envelope=scene['envelope'],
+                              influencer_matrices=scene['influencer_matrices'],
+                              influencer_falloffs=scene['influencer_falloffs'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='tcCameraLattice.deformation against tcCameraLatticeBatch')
+    parser.add_argument('batch', help='path of tcCameraLatticeBatch')
+    parser.add_argument('-seed', type=int, default=1)
+    parser.add_argument('-scenes', type=int, default=24)
+    parser.add_argument('-points', type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = numpy.random.RandomState(args.seed)
+    directory = tempfile.mkdtemp(prefix='compareDeformation')
+    failed = 0
+    max_error = 0.0
+    try:
+        input_path = os.path.join(directory, 'input.tclp')
+        output_path = os.path.join(directory, 'output.tclp')
+        sidecar_path = os.path.join(directory, 'scene.tcl')
+
+        for index in range(args.scenes):
+            scene = _random_scene(rng, index, args.points)
+            _write_points(input_path, scene['points'])
+            _write_sidecar(sidecar_path, scene)
+
+            with open(os.devnull, 'w') as devnull:
+                subprocess.check_call([args.batch, '-sidecar', sidecar_path, '-input', input_path, '-output', output_path],
+                                      stdout=devnull)
+            expected = _read_points(output_path)
+            actual = _deform(scene)
+
+            # nan fails too
+            error = numpy.abs(actual - expected).max()
+            moved = int((numpy.abs(expected - scene['points']).max(1) > 0).sum())
+            passed = error <= TOLERANCE
+            if not passed:
+                failed += 1
+            if error > max_error or error != error:
+                max_error = error
+            print('%-4s scene %2d %-10s %-5s %d x %d, %d influence areas, %6d points moved, max error %.3g' % (
+                'ok' if passed else 'FAIL', index, INTERPOLATION_NAMES[scene['interpolation']],
+                'ortho' if scene['orthographic'] else '', scene['s_divisions'], scene['t_divisions'],
+                len(scene['influencer_matrices']), moved, error))
+    finally:
+        shutil.rmtree(directory)
+
+    print('seed %d, %d scenes of %d points, max error %.3g, tolerance %.3g: %s' % (
+        args.seed, args.scenes, args.points, max_error, TOLERANCE, 'FAILED' if failed else 'passed'))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
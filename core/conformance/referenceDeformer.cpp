@@ -0,0 +1,204 @@
+/*
+ *  referenceDeformer.cpp
+ *  cameraLattice
+ *
+ *
+ */
+
+#include <math.h>
+
+#include "referenceDeformer.h"
+
+double fac(int n)
+{
+	if (n == 0 || n == 1)
+		return 1;
+	else
+		return n * fac(n-1) ;
+}
+
+double C(int i, int l)
+{
+	return fac(l) / (fac(i) * fac(l - i));
+}
+
+double B(int i, int l, double s)
+{
+	return C(i, l) * pow(s,i) * pow(1-s,l-i);
+}
+
+void referenceFindBoundaryCells(const double w, const int D, int &min, int &max)
+{
+	double step = 1.0/(D - 1);
+
+	for (int i = 0; i < D - 1; i++)
+	{
+		double thisStep = step * i;
+		if ((w < thisStep + step) && (w >= thisStep))
+		{
+			min = i;
+			max = i+1;
+			return;
+		}
+	}
+
+    //in case we are outside the case (LEFT)
+    if (w < 0)
+    {
+        min = 0;
+        max = 1;
+        return;
+    }
+
+    //in case we are outside the case (RIGHT)
+	if (D > 2)
+		min = D - 2;
+	else
+		min = D - 1;
+
+	max = D - 1;
+}
+
+void referenceFindLinearDeformedPoint(Point3 &tempPoint, const std::vector<Point3> *planePoints, const float u, const float v,
+                                      const int sD, const int tD)
+{
+    int minX, maxX, minY, maxY;
+	referenceFindBoundaryCells(u, sD, minX, maxX);
+	referenceFindBoundaryCells(v, tD, minY, maxY);
+
+    //Finding projection factor on delimiting edges
+	int factorX = sD - 1;
+	int factorY = tD - 1;
+	float uLocal = (u - float(minX) / factorX) / (float(maxX) / factorX - float(minX) / factorX);
+	float vLocal = (v - float(minY) / factorY) / (float(maxY) / factorY - float(minY) / factorY);
+
+	//find the edges --- aligned on the Y
+	Point3 p1 = (*planePoints)[minX + minY * sD];
+	Point3 p2 = (*planePoints)[minX + maxY * sD];
+	Point3 p3 = (*planePoints)[maxX + minY * sD];
+	Point3 p4 = (*planePoints)[maxX + maxY * sD];
+
+	Point3 p21 = (p2 - p1) * vLocal + p1;
+	Point3 p43 = (p4 - p3) * vLocal + p3;
+
+	//finding the point between the edges -- this is on the X
+	tempPoint = (p43 - p21) * uLocal + p21;
+}
+
+void referenceFindBezierDeformedPoint(Point3 &tempPoint, const std::vector<Point3> *planePoints, const float u, const float v,
+                                      const int offsetS, const int offsetT, const int finalS, const int finalT, const int sD)
+{
+	Point3 result;
+
+	for ( int s = 0; s < finalS; s++)
+		for ( int t = 0; t < finalT; t++)
+		{
+            int index = offsetS + s + (offsetT + t) * sD;
+			result = result + (*planePoints)[index] * B(s, finalS - 1, u) * B(t, finalT - 1, v);
+		}
+	tempPoint = result;
+}
+
+void referenceFindBezierWindowPoint(Point3 &tempPoint, const std::vector<Point3> *planePoints, double u, double v,
+                                    const int sD, const int tD, const int maxRecursion)
+{
+    // remapping the u and v
+    int minX, maxX, minY, maxY;
+    referenceFindBoundaryCells(u, sD, minX, maxX);
+    referenceFindBoundaryCells(v, tD, minY, maxY);
+
+    minX = minX - maxRecursion < 0 ? 0 : minX - maxRecursion;
+    maxX = maxX + maxRecursion > sD ? sD: maxX + maxRecursion;
+    minY = minY - maxRecursion < 0 ? 0 : minY - maxRecursion;
+    maxY = maxY + maxRecursion > tD ? tD: maxY + maxRecursion;
+
+    float minSU = float(minX) / (sD - 1); float maxSU = float(maxX - 1) / (sD - 1);
+    u = (u - minSU) / (maxSU - minSU);
+
+    double minTU = double(minY) / (tD - 1); double maxTU = double(maxY - 1) / (tD - 1);
+    v = (v - minTU) / (maxTU - minTU);
+
+    referenceFindBezierDeformedPoint(tempPoint, planePoints, u, v, minX, minY, maxX - minX, maxY - minY, sD);
+}
+
+double referenceInfluencersWeight(const Point3 &pt, const std::vector<Influencer> *influencers)
+{
+    Point3 vec;
+
+    double totalWeight = 0.0;
+    for (unsigned int i = 0; i < influencers->size(); ++i)
+    {
+        const Influencer &influencer = (*influencers)[i];
+        vec = pt - influencer.pos;
+        if (vec.length() > influencer.maxAxisLength)
+            continue;
+
+        vec = pt * (*influencers)[i].invMat;
+
+        double length = vec.length();
+        //the radius of the locator in local space is 1
+        if (length < 1)
+        {
+            if (length <= 0.0001 || influencer.falloff < 0.0001 || length < 1 - influencer.falloff)
+                totalWeight = 1;
+            else
+                totalWeight += 1 - (length - (1 - influencer.falloff)) / influencer.falloff;
+        }
+
+        if (totalWeight >= 0.9999)
+            return 1.0;
+    }
+
+    return totalWeight;
+}
+
+void ReferenceDeformer::operator()( const tbb::blocked_range<size_t>& r ) const
+{
+    for( size_t i=r.begin(); i!=r.end(); ++i )
+    {
+        Point3 intialPosition = (*points)[i];
+
+        double weight = envelopeValue;
+        if ((*influencers).size() != 0)
+            weight = envelopeValue * referenceInfluencersWeight(intialPosition * (*toWorldMatrix), influencers);
+
+        if (weight < 0.00001)
+            continue;
+
+        Point3 pt = intialPosition * *projectionMatrix;
+
+        double zDepth = -pt.z;
+
+        //MPoint divides x, y and z, w is untouched
+        if (!isOrtho)
+            pt = Point3(pt.x / zDepth, pt.y / zDepth, pt.z / zDepth);
+
+        double u = pt.x / filmHAperture + 0.5;
+        double v = pt.y / filmVAperture + 0.5;
+
+        double gov = gateOffsetValue;
+        if (u > 1.0 + gov || v > 1.0 + gov || u < 0.0 - gov || v < 0.0 - gov)
+            continue;
+
+        Point3 finalPoint;
+        if (behaviour == kBezier)
+            referenceFindBezierWindowPoint(finalPoint, planePoints, u, v, sD, tD, maxRecursion);
+        else
+            referenceFindLinearDeformedPoint(finalPoint, planePoints, u, v, sD, tD);
+
+        //we map it back to the (-1,1) range
+        finalPoint.x *= filmHAperture;
+        finalPoint.y *= filmVAperture;
+        finalPoint.z = pt.z;
+
+        if (!isOrtho)
+            finalPoint = finalPoint * zDepth;
+
+        finalPoint = finalPoint * *invProjectionMatrix;
+        if (weight > 0.9999)
+            (*deformedPoints)[i] = finalPoint;
+        else
+            (*deformedPoints)[i] = intialPosition + (finalPoint - intialPosition) * weight;
+
+    }
+};
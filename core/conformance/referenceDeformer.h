@@ -0,0 +1,68 @@
+/*
+ *  referenceDeformer.h
+ *  cameraLattice
+ *
+ *  The deformation of the first release of the plugin, ported from MPoint and MMatrix to the core types
+ *  without changing its arithmetic. It is the golden reference of the conformance checks, do not optimise it.
+ *
+ */
+
+#ifndef REFERENCE_DEFORMER_H
+#define REFERENCE_DEFORMER_H
+
+#include <vector>
+
+#include <tbb/blocked_range.h>
+
+#include "cameraLatticeCore.h"
+
+void referenceFindBoundaryCells(const double w, const int D, int &min, int &max);
+
+// the lattice parameters are floats, as in the plugin
+void referenceFindLinearDeformedPoint(Point3 &tempPoint, const std::vector<Point3> *planePoints, const float u, const float v,
+                                      const int sD, const int tD);
+void referenceFindBezierDeformedPoint(Point3 &tempPoint, const std::vector<Point3> *planePoints, const float u, const float v,
+                                      const int offsetS, const int offsetT, const int finalS, const int finalT, const int sD);
+// the window and the remapping of the parameters done by operator(), split out to check the interpolation on its own
+void referenceFindBezierWindowPoint(Point3 &tempPoint, const std::vector<Point3> *planePoints, double u, double v,
+                                    const int sD, const int tD, const int maxRecursion);
+
+// linear scan over all the influencers
+double referenceInfluencersWeight(const Point3 &pt, const std::vector<Influencer> *influencers);
+
+// CameraLatticeData of the first release, only kLinear and kBezier existed
+class ReferenceDeformer
+{
+public:
+    ReferenceDeformer(const Matrix4 *projectionMatrix, const Matrix4 *invProjectionMatrix, const Matrix4 *toWorldMatrix,
+                      const std::vector<Point3> *points, std::vector<Point3> *deformedPoints, const std::vector<Point3> *planePoints,
+                      double filmHAperture, double filmVAperture, int sD, int tD, bool isOrtho, int maxRecursion, int behaviour,
+                      const std::vector<Influencer> *influencers, double gateOffsetValue, double envelopeValue)
+        : projectionMatrix(projectionMatrix), invProjectionMatrix(invProjectionMatrix), toWorldMatrix(toWorldMatrix),
+          points(points), deformedPoints(deformedPoints), planePoints(planePoints),
+          filmHAperture(filmHAperture), filmVAperture(filmVAperture), sD(sD), tD(tD), maxRecursion(maxRecursion), behaviour(behaviour),
+          gateOffsetValue(gateOffsetValue), influencers(influencers), envelopeValue(envelopeValue), isOrtho(isOrtho) {};
+
+    void operator()(const tbb::blocked_range<size_t> &r) const;
+
+private:
+    const Matrix4 *projectionMatrix;
+    const Matrix4 *invProjectionMatrix;
+    const Matrix4 *toWorldMatrix;
+    const std::vector<Point3> *points;
+    std::vector<Point3> *deformedPoints;
+    const std::vector<Point3> *planePoints;
+
+    double filmHAperture, filmVAperture;
+    int sD, tD;
+    int maxRecursion, behaviour;
+    double gateOffsetValue;
+
+    const std::vector<Influencer> *influencers;
+
+    double envelopeValue;
+
+    bool isOrtho;
+};
+
+#endif
@@ -0,0 +1,293 @@
+/*
+ *  cameraLatticeCore.h
+ *  cameraLattice
+ *
+ *  Camera projection, lattice interpolation and influence areas, independent from Maya.
+ *  The deformer, the benchmarks and the command line tools share this code.
+ *
+ *  Points are row vectors multiplied on the left of the matrices, like in Maya.
+ *
+ */
+
+#ifndef CAMERA_LATTICE_CORE_H
+#define CAMERA_LATTICE_CORE_H
+
+#include <vector>
+#include <math.h>
+#include <stddef.h>
+
+#include <tbb/blocked_range.h>
+
+enum InterpolationType
+{
+    kLinear = 0,
+    kBezier = 1,
+    kBSpline = 2,
+    kCatmullRom = 3
+};
+
+struct Point3
+{
+    Point3() : x(0.0), y(0.0), z(0.0) {};
+    Point3(double x, double y, double z) : x(x), y(y), z(z) {};
+
+    double operator[](int axis) const { return axis == 0 ? x : (axis == 1 ? y : z); };
+
+    Point3 operator+(const Point3 &other) const { return Point3(x + other.x, y + other.y, z + other.z); };
+    Point3 operator-(const Point3 &other) const { return Point3(x - other.x, y - other.y, z - other.z); };
+    Point3 operator*(double scale) const { return Point3(x * scale, y * scale, z * scale); };
+    double dot(const Point3 &other) const { return x * other.x + y * other.y + z * other.z; };
+    double length() const { return sqrt(dot(*this)); };
+
+    double x, y, z;
+};
+
+struct Matrix4
+{
+    // identity
+    Matrix4();
+    Matrix4(const double values[4][4]);
+
+    const double *operator[](int row) const { return m[row]; };
+    double *operator[](int row) { return m[row]; };
+
+    Matrix4 operator*(const Matrix4 &other) const;
+    bool operator==(const Matrix4 &other) const;
+    bool operator!=(const Matrix4 &other) const { return !(*this == other); };
+
+    // general inverse, the identity when the matrix is singular
+    Matrix4 inverse() const;
+
+    double m[4][4];
+};
+
+// the matrices of the lattice are affine, the last column is ignored
+inline Point3 operator*(const Point3 &p, const Matrix4 &m)
+{
+    return Point3(p.x * m.m[0][0] + p.y * m.m[1][0] + p.z * m.m[2][0] + m.m[3][0],
+                  p.x * m.m[0][1] + p.y * m.m[1][1] + p.z * m.m[2][1] + m.m[3][1],
+                  p.x * m.m[0][2] + p.y * m.m[1][2] + p.z * m.m[2][2] + m.m[3][2]);
+}
+
+struct Influencer
+{
+    void set(const Matrix4 &mat, double falloffValue);
+
+    Matrix4 invMat;
+    Point3 pos;
+    double falloff;
+    double maxAxisLength;
+};
+
+// uniform grid over the influencers bounding spheres, each cell lists the influencers overlapping it
+class InfluencerGrid
+{
+public:
+    static const int maxResolution = 32;
+
+    void build(const std::vector<Influencer> &influencers);
+
+    // returns the indices of the influencers which may contain the point, in ascending order
+    const unsigned int *query(const Point3 &pt, unsigned int &count) const;
+
+private:
+    int cellIndex(double value, int axis) const;
+
+    double m_min[3], m_invCellSize[3];
+    int m_resolution[3];
+    std::vector<unsigned int> m_cellStart, m_indices;
+};
+
+// weight of the influence areas at a point in world space, 1 inside an area and fading over its falloff
+double get_influencers_weight(const Point3 &pt, const std::vector<Influencer> *influencers, const InfluencerGrid *grid);
+
+class BernsteinTable
+{
+public:
+    BernsteinTable() : m_maxDegree(-1) {};
+
+    // builds the binomial coefficients up to the given degree, does nothing if already built
+    void build(int maxDegree);
+    int maxDegree() const { return m_maxDegree; };
+
+    // fills basis with the n + 1 bernstein polynomials of degree n evaluated at s
+    void evaluate(int n, double s, double *basis) const;
+
+private:
+    // pascal triangle stored row after row, row n starts at n * (n + 1) / 2
+    std::vector<double> m_binomials;
+    int m_maxDegree;
+};
+
+struct LatticeCell
+{
+    // bilinear patch of the cell, p = origin + du * u + dv * v + duv * u * v
+    // only x and y are stored as the depth of the deformed point comes from the projection
+    double origin[2], du[2], dv[2], duv[2];
+};
+
+struct BezierWindow
+{
+    // control points used by the cells of a row or column, max is excluded
+    int min, max;
+    // remaps the lattice parameter to the (0, 1) range of the window
+    double minParam, invRange;
+};
+
+inline int findCell(const double w, const int D, double &local)
+{
+    double x = w * (D - 1);
+    int cell = int(floor(x));
+    if (cell < 0)
+        cell = 0;
+    else if (cell > D - 2)
+        cell = D - 2;
+
+    local = x - cell;
+    return cell;
+}
+
+class CompiledLattice
+{
+public:
+    // distance from the rest position under which a control point is considered untouched
+    static const double restTolerance;
+
+    CompiledLattice() : sD(0), tD(0), maxRecursion(-1), numEditedPoints(0), maskBehaviour(-1), version(0), hasChangedPoints(false) {};
+
+    // caches the cell coefficients, returns false if the points do not match the subdivisions
+    bool compile(const std::vector<Point3> &planePoints, int sD, int tD);
+    // caches the bezier windows and the bernstein coefficients they need
+    void compileBezierWindows(int maxRecursion);
+    // flags the cells whose control points, for the given interpolation, are all at rest
+    void compileIdentityMask(int behaviour);
+
+    bool isAtRest() const { return numEditedPoints == 0; };
+
+    // flags the cells whose support, for the given interpolation, contains a point changed by the last compile
+    void findChangedCells(int behaviour, std::vector<char> &changedCells) const;
+    bool isIdentityCell(int s, int t) const { return identityCells[s + t * (sD - 1)] != 0; };
+
+    bool isValid() const { return sD > 1 && tD > 1 && cells.size() == size_t((sD - 1) * (tD - 1)); };
+
+    const LatticeCell &cell(int s, int t) const { return cells[s + t * (sD - 1)]; };
+
+    std::vector<Point3> points;
+    int sD, tD, maxRecursion;
+
+    std::vector<LatticeCell> cells;
+    std::vector<BezierWindow> sWindows, tWindows;
+    BernsteinTable bernsteinTable;
+
+    // summed area table of the points moved from their rest position, (sD + 1) * (tD + 1) entries
+    std::vector<int> editedPointsTable;
+    int numEditedPoints;
+    std::vector<char> identityCells;
+    int maskBehaviour;
+
+    // incremented on every compile, changedPoints lists the points which differ from the previous version
+    unsigned int version;
+    std::vector<int> changedPoints;
+    bool hasChangedPoints;
+
+private:
+    int countEditedPoints(int minS, int maxS, int minT, int maxT) const;
+};
+
+// camera values derived once per change and shared by all the geometries of a deformer
+struct CompiledCamera
+{
+    CompiledCamera() : valid(false) {};
+
+    // film apertures at unit depth and the camera matrix with its inverse
+    void compile(const Matrix4 &cameraMatrix, bool isOrtho, double orthographicWidth,
+                 double horizontalAperture, double verticalAperture, double focalLength);
+
+    double filmHAperture, filmVAperture;
+    bool isOrtho;
+    Matrix4 matrix, inverseMatrix;
+    bool valid;
+};
+
+// lattice parameters u, v in the (0, 1) range inside the gate, and the depth in camera space
+void projectPoint(const Point3 &point, const Matrix4 &projectionMatrix, const double filmHAperture, const double filmVAperture, const bool isOrtho,
+                  double &u, double &v, double &cameraZ);
+
+// the deformed lattice coordinates at the lattice parameters, in the x and y of tempPoint
+void findLinearDeformedPoint(Point3 &tempPoint, const CompiledLattice *lattice, const double u, const double v);
+// uBasis and vBasis are scratch space of sD and tD values
+void findBezierDeformedPoint(Point3 &tempPoint, const CompiledLattice *lattice, const double u, const double v, double *uBasis, double *vBasis);
+void findCubicDeformedPoint(Point3 &tempPoint, const CompiledLattice *lattice, const double u, const double v, const int behaviour);
+
+// moves a projected point through the lattice and back to object space, blended with its initial position by weight
+inline Point3 deformProjectedPoint(const Point3 &initialPosition, double u, double v, double cameraZ, const CompiledLattice *lattice,
+                                   int behaviour, double filmHAperture, double filmVAperture, bool isOrtho,
+                                   const Matrix4 &invProjectionMatrix, double weight, double *uBasis, double *vBasis)
+{
+    Point3 finalPoint;
+    if (behaviour == kBezier)
+        findBezierDeformedPoint(finalPoint, lattice, u, v, uBasis, vBasis);
+    else if (behaviour == kBSpline || behaviour == kCatmullRom)
+        findCubicDeformedPoint(finalPoint, lattice, u, v, behaviour);
+    else
+        findLinearDeformedPoint(finalPoint, lattice, u, v);
+
+    //we map it back to the (-1,1) range
+    double zDepth = isOrtho ? 1.0 : -cameraZ;
+    finalPoint.x *= filmHAperture * zDepth;
+    finalPoint.y *= filmVAperture * zDepth;
+    finalPoint.z = cameraZ;
+
+    finalPoint = finalPoint * invProjectionMatrix;
+    if (weight > 0.9999)
+        return finalPoint;
+    return initialPosition + (finalPoint - initialPosition) * weight;
+}
+
+// one lattice of a stack applied in sequence by a single deformer
+struct LatticeStage
+{
+    // projection from the object space of a geometry through the camera, and back
+    void setCamera(const CompiledCamera &camera, const Matrix4 &objMat, const Matrix4 &invObjMat);
+
+    const CompiledLattice *lattice;
+    Matrix4 projectionMatrix, invProjectionMatrix;
+    double filmHAperture, filmVAperture;
+    bool isOrtho;
+    int behaviour;
+    double gateOffsetValue, envelopeValue;
+    // influence areas only weight the deformer's own lattice
+    bool useInfluencers;
+};
+
+// true when the lattice parameters are outside the gate grown by the offset
+inline bool isOutsideGate(double u, double v, double gateOffsetValue)
+{
+    return u > 1.0 + gateOffsetValue || v > 1.0 + gateOffsetValue || u < 0.0 - gateOffsetValue || v < 0.0 - gateOffsetValue;
+}
+
+// moves a point through one lattice of a stack, returns false when the lattice does not affect it
+bool deformStagePoint(const LatticeStage &stage, Point3 &point, double weight, double *uBasis, double *vBasis);
+
+// the kernel of the deformer without its caches, for the tools working on plain arrays of points
+// the points which do not move are not written, deformedPoints may be the points array itself
+class LatticeDeformerData
+{
+public:
+    LatticeDeformerData(const LatticeStage *stage, const Matrix4 *toWorldMatrix, const std::vector<Influencer> *influencers,
+                        const InfluencerGrid *influencerGrid, const Point3 *points, Point3 *deformedPoints)
+        : m_stage(stage), m_toWorldMatrix(toWorldMatrix), m_influencers(influencers), m_influencerGrid(influencerGrid),
+          m_points(points), m_deformedPoints(deformedPoints) {};
+
+    void operator()(const tbb::blocked_range<size_t> &r) const;
+
+private:
+    const LatticeStage *m_stage;
+    const Matrix4 *m_toWorldMatrix;
+    const std::vector<Influencer> *m_influencers;
+    const InfluencerGrid *m_influencerGrid;
+    const Point3 *m_points;
+    Point3 *m_deformedPoints;
+};
+
+#endif
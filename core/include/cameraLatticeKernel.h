@@ -0,0 +1,657 @@
+/*
+ *  cameraLatticeKernel.h
+ *  cameraLattice
+ *
+ *  The deformation kernels of the deformer and the caches they fill, independent from Maya.
+ *  They are templates over the point buffer, so the deformer runs them on the Maya points and
+ *  the conformance checks and the benchmark on plain arrays. A buffer has get(i), set(i, point) and length().
+ *
+ */
+
+#ifndef CAMERA_LATTICE_KERNEL_H
+#define CAMERA_LATTICE_KERNEL_H
+
+#include <vector>
+#include <algorithm>
+#include <math.h>
+
+#include <tbb/spin_mutex.h>
+#include <tbb/tick_count.h>
+#include <tbb/blocked_range.h>
+
+#include "cameraLatticeCore.h"
+
+// positions stored as doubles, for the tools and the checks
+struct Point3Buffer
+{
+    Point3Buffer() : points(NULL), count(0) {};
+    Point3Buffer(Point3 *points, unsigned int count) : points(points), count(count) {};
+    
+    Point3 get(size_t i) const { return points[i]; };
+    void set(size_t i, const Point3 &point) const { points[i] = point; };
+    unsigned int length() const { return count; };
+    
+    Point3 *points;
+    unsigned int count;
+};
+
+// positions stored as x y z floats, like the raw points of a Maya mesh
+struct FloatPointBuffer
+{
+    FloatPointBuffer() : raw(NULL), count(0) {};
+    FloatPointBuffer(float *raw, unsigned int count) : raw(raw), count(count) {};
+    
+    Point3 get(size_t i) const { return Point3(raw[3 * i], raw[3 * i + 1], raw[3 * i + 2]); };
+    void set(size_t i, const Point3 &point) const
+    {
+        raw[3 * i] = float(point.x);
+        raw[3 * i + 1] = float(point.y);
+        raw[3 * i + 2] = float(point.z);
+    };
+    unsigned int length() const { return count; };
+    
+    float *raw;
+    unsigned int count;
+};
+
+struct ProjectionCache
+{
+    ProjectionCache() : valid(false), boundsValid(false) {};
+    
+    void invalidate() { valid = false; boundsValid = false; };
+    
+    // true if the whole geometry can be skipped for the given gate offset
+    bool isOutsideGate(double gateOffset) const
+    {
+        if (behindCamera)
+            return true;
+        if (crossesCamera)
+            return false;
+        return maxU < -gateOffset || minU > 1.0 + gateOffset || maxV < -gateOffset || minV > 1.0 + gateOffset;
+    };
+    
+    // lattice parameters and camera space depth of every vertex of a geometry
+    std::vector<double> u, v, cameraZ;
+    bool valid;
+    
+    // lattice parameter bounds of the geometry bounding box
+    double minU, maxU, minV, maxV;
+    bool behindCamera, crossesCamera;
+    bool boundsValid;
+};
+
+struct InfluenceWeightCache
+{
+    InfluenceWeightCache() : valid(false) {};
+    
+    // influence areas weight of every vertex of a geometry, envelope excluded
+    std::vector<float> weights;
+    bool valid;
+};
+
+// vertex counts and times of a kernel, every range adds its own once it is done
+struct KernelCounters
+{
+    KernelCounters() : processed(0), culled(0), skipped(0), time(0.0), influenceTime(0.0) {};
+    
+    void add(size_t rangeProcessed, size_t rangeCulled, size_t rangeSkipped)
+    {
+        tbb::spin_mutex::scoped_lock lock(mutex);
+        processed += rangeProcessed;
+        culled += rangeCulled;
+        skipped += rangeSkipped;
+    };
+    
+    void addTime(double rangeTime, double rangeInfluenceTime)
+    {
+        tbb::spin_mutex::scoped_lock lock(mutex);
+        time += rangeTime;
+        influenceTime += rangeInfluenceTime;
+    };
+    
+    // part of the time of the kernel spent evaluating influence weights
+    double influenceShare() const { return time > 0.0 ? std::min(influenceTime / time, 1.0) : 0.0; };
+    
+    tbb::spin_mutex mutex;
+    unsigned long long processed, culled, skipped;
+    // seconds summed over the ranges, so over the threads
+    double time, influenceTime;
+};
+
+// influence areas weight of a vertex, evaluated on the first visit and read from the cache afterwards
+inline double cachedInfluenceWeight(const Point3 &point, size_t index, InfluenceWeightCache *weightCache, const Matrix4 &toWorldMatrix,
+                                    const std::vector<Influencer> *influencers, const InfluencerGrid *influencerGrid)
+{
+    //negative weights mark the vertices which have not been evaluated since the cache was reset
+    float &weight = weightCache->weights[index];
+    if (weight < 0.0f)
+        weight = float(get_influencers_weight(point * toWorldMatrix, influencers, influencerGrid));
+    return weight;
+}
+
+// lattice parameter bounds of the bounding box of the points, the whole geometry is culled when they are outside the gate
+template <typename Buffer>
+void computeGateBounds(const Buffer &points, const Matrix4 &projectionMatrix, const double filmHAperture, const double filmVAperture, const bool isOrtho,
+                       ProjectionCache &cache)
+{
+    cache.boundsValid = true;
+    cache.behindCamera = false;
+    cache.crossesCamera = false;
+    
+    unsigned int numPoints = points.length();
+    if (numPoints == 0)
+    {
+        cache.behindCamera = true;
+        return;
+    }
+    
+    //object space bounding box of the points
+    double minCorner[3], maxCorner[3];
+    for (int axis = 0; axis < 3; axis++)
+        minCorner[axis] = maxCorner[axis] = points.get(0)[axis];
+    
+    for (unsigned int i = 1; i < numPoints; i++)
+    {
+        Point3 point = points.get(i);
+        for (int axis = 0; axis < 3; axis++)
+        {
+            if (point[axis] < minCorner[axis])
+                minCorner[axis] = point[axis];
+            else if (point[axis] > maxCorner[axis])
+                maxCorner[axis] = point[axis];
+        }
+    }
+    
+    //the projection of the box lies inside the bounds of its projected corners when they are all in front of the camera
+    int cornersBehind = 0;
+    for (int corner = 0; corner < 8; corner++)
+    {
+        Point3 point(corner & 1 ? maxCorner[0] : minCorner[0],
+                     corner & 2 ? maxCorner[1] : minCorner[1],
+                     corner & 4 ? maxCorner[2] : minCorner[2]);
+        
+        double u, v, cameraZ;
+        projectPoint(point, projectionMatrix, filmHAperture, filmVAperture, isOrtho, u, v, cameraZ);
+        if (!isOrtho && cameraZ >= 0.0)
+        {
+            cornersBehind++;
+            continue;
+        }
+        
+        if (corner == cornersBehind)
+        {
+            cache.minU = cache.maxU = u;
+            cache.minV = cache.maxV = v;
+        }
+        else
+        {
+            cache.minU = u < cache.minU ? u : cache.minU;
+            cache.maxU = u > cache.maxU ? u : cache.maxU;
+            cache.minV = v < cache.minV ? v : cache.minV;
+            cache.maxV = v > cache.maxV ? v : cache.maxV;
+        }
+    }
+    
+    cache.behindCamera = cornersBehind == 8;
+    cache.crossesCamera = cornersBehind > 0 && cornersBehind < 8;
+}
+
+// buckets the vertices inside the gate by lattice cell, from the projections of the cache,
+// so an incremental evaluation only visits the vertices of the cells changed since the last one
+void buildCellIndex(const ProjectionCache &cache, const CompiledLattice &lattice, const double gateOffsetValue, const float *paintedWeights,
+                    std::vector<unsigned int> &cellStart, std::vector<unsigned int> &cellVertices);
+
+// 64 bit hash of the inputs of an evaluation, fed a word at a time
+class Fingerprint
+{
+public:
+    Fingerprint() : hash(14695981039346656037ULL) {};
+    
+    void add(const void *data, size_t size);
+    void add(double value) { add(&value, sizeof(double)); };
+    void add(int value) { add(&value, sizeof(int)); };
+    void add(const Matrix4 &matrix) { add(matrix.m, sizeof(matrix.m)); };
+    
+    unsigned long long value() const;
+    
+private:
+    unsigned long long hash;
+};
+
+// everything the result of an evaluation depends on, but the points and the geometry
+// paintedWeights is NULL when nothing is painted
+void fingerprintSettings(Fingerprint &fingerprint, const CompiledLattice &lattice, int behaviour, const CompiledCamera &camera,
+                         const Matrix4 &objMat, double envelopeValue, double gateOffsetValue, int precisionValue,
+                         const std::vector<Influencer> &influencers, const float *paintedWeights, size_t numPaintedWeights);
+
+/**********************************************************
+ KERNELS
+ **********************************************************/
+
+template <typename Buffer>
+class CameraLatticeKernel
+{
+public:
+    
+    struct ThreadData
+    {
+        Matrix4 *projectionMatrix;
+        Matrix4 *invProjectionMatrix;
+        Matrix4 *toWorldMatrix;
+        Buffer points;
+        Buffer deformedPoints;
+
+        const CompiledLattice *lattice;
+        ProjectionCache *projectionCache;
+        InfluenceWeightCache *weightCache;
+        
+        double filmHAperture, filmVAperture;
+        int behaviour;
+        double gateOffsetValue;
+        
+        std::vector<Influencer> *influencers;
+        const InfluencerGrid *influencerGrid;
+        
+        // when set, the range runs over this list instead of the points
+        const unsigned int *vertexIndices;
+        // painted weight of every vertex, NULL when nothing is painted
+        const float *paintedWeights;
+        KernelCounters *counters;
+        
+        double envelopeValue;
+        
+        bool isOrtho;
+        
+    };
+    
+    ~CameraLatticeKernel(){};
+    
+    CameraLatticeKernel(Matrix4 *projectionMatrix,
+                      Matrix4 *invProjectionMatrix,
+                      Matrix4 *toWorldMatrix,
+                      const Buffer &points,
+                      const Buffer &deformedPoints,
+                      const CompiledLattice *lattice,
+                      ProjectionCache *projectionCache,
+                      InfluenceWeightCache *weightCache,
+                      double filmHAperture, double filmVAperture,
+                      bool isOrtho, int behaviour,
+                      std::vector<Influencer> *influencers, const InfluencerGrid *influencerGrid, double gateOffsetValue, double envelopeValue)
+    {
+        m_data.projectionMatrix = projectionMatrix;
+        m_data.invProjectionMatrix = invProjectionMatrix;
+        m_data.points = points;
+        m_data.deformedPoints = deformedPoints;
+        m_data.lattice = lattice;
+        m_data.projectionCache = projectionCache;
+        m_data.weightCache = weightCache;
+        m_data.filmHAperture = filmHAperture;
+        m_data.filmVAperture = filmVAperture;
+        m_data.isOrtho = isOrtho;
+        m_data.behaviour = behaviour;
+        m_data.influencers = influencers;
+        m_data.influencerGrid = influencerGrid;
+        m_data.vertexIndices = NULL;
+        m_data.paintedWeights = NULL;
+        m_data.counters = NULL;
+        m_data.toWorldMatrix = toWorldMatrix;
+        m_data.gateOffsetValue = gateOffsetValue;
+        m_data.envelopeValue = envelopeValue;
+    }
+    
+    void setVertexIndices(const unsigned int *vertexIndices) { m_data.vertexIndices = vertexIndices; };
+    void setPaintedWeights(const float *paintedWeights) { m_data.paintedWeights = paintedWeights; };
+    void setCounters(KernelCounters *counters) { m_data.counters = counters; };
+    
+    void operator()( const tbb::blocked_range<size_t>& r ) const;
+    
+    protected:
+    
+        struct ThreadData m_data;
+};
+
+// single precision kernel, each range is processed in batches stored as structure of arrays.
+// the projection, the gate test, the linear lookup and the unprojection are plain loops over a batch,
+// which the compiler may vectorise depending on its flags, the bezier and cubic lookups stay scalar per vertex
+template <typename Buffer>
+class CameraLatticeFloatKernel : public CameraLatticeKernel<Buffer>
+{
+public:
+    
+    static const int batchSize = 256;
+    
+    CameraLatticeFloatKernel(Matrix4 *projectionMatrix,
+                           Matrix4 *invProjectionMatrix,
+                           Matrix4 *toWorldMatrix,
+                           const Buffer &points,
+                           const Buffer &deformedPoints,
+                           const CompiledLattice *lattice,
+                           ProjectionCache *projectionCache,
+                           InfluenceWeightCache *weightCache,
+                           double filmHAperture, double filmVAperture,
+                           bool isOrtho, int behaviour,
+                           std::vector<Influencer> *influencers, const InfluencerGrid *influencerGrid, double gateOffsetValue, double envelopeValue) :
+        CameraLatticeKernel<Buffer>(projectionMatrix, invProjectionMatrix, toWorldMatrix, points, deformedPoints, lattice, projectionCache, weightCache,
+                          filmHAperture, filmVAperture, isOrtho, behaviour, influencers, influencerGrid, gateOffsetValue, envelopeValue)
+    {
+    }
+    
+    void operator()( const tbb::blocked_range<size_t>& r ) const;
+    
+protected:
+    using CameraLatticeKernel<Buffer>::m_data;
+};
+
+inline void toFloatMatrix(const Matrix4 &matrix, float result[4][4])
+{
+    for (int row = 0; row < 4; row++)
+        for (int column = 0; column < 4; column++)
+            result[row][column] = float(matrix[row][column]);
+}
+
+template <typename Buffer>
+void CameraLatticeKernel<Buffer>::operator()( const tbb::blocked_range<size_t>& r ) const
+{
+    //scratch space for the bezier basis, allocated once per range instead of once per vertex
+    std::vector<double> uBasis, vBasis;
+    if (m_data.behaviour == kBezier)
+    {
+        uBasis.resize(m_data.lattice->sD);
+        vBasis.resize(m_data.lattice->tD);
+    }
+    
+    ProjectionCache *cache = m_data.projectionCache;
+    bool fillCache = !cache->valid;
+    
+    bool hasInfluencers = !m_data.influencers->empty();
+    size_t processed = 0, culled = 0, skipped = 0;
+    
+    //the influence weights are timed apart for the statistics, only when they are not read from the cache
+    bool timed = m_data.counters != NULL;
+    tbb::tick_count rangeStart = timed ? tbb::tick_count::now() : tbb::tick_count();
+    double influenceTime = 0.0;
+    
+    for( size_t n=r.begin(); n!=r.end(); ++n )
+    {
+        //when updating a subset of the vertices the previous result is reset first, as the kernel skips the points which do not move
+        size_t i = n;
+        if (m_data.vertexIndices)
+        {
+            i = m_data.vertexIndices[n];
+            m_data.deformedPoints.set(i, m_data.points.get(i));
+        }
+        
+        Point3 intialPosition = m_data.points.get(i);
+        
+        //the cache is filled for every vertex, as the gate offset can change without invalidating it
+        if (fillCache)
+            projectPoint(intialPosition, *m_data.projectionMatrix, m_data.filmHAperture, m_data.filmVAperture, m_data.isOrtho,
+                         cache->u[i], cache->v[i], cache->cameraZ[i]);
+        
+        double u = cache->u[i];
+        double v = cache->v[i];
+
+        //the gate test is cheaper than the influence areas, so it runs first
+        double gov = m_data.gateOffsetValue;
+        if (u > 1.0 + gov || v > 1.0 + gov || u < 0.0 - gov || v < 0.0 - gov)
+        {
+            culled++;
+            continue;
+        }
+        
+        //points in cells supported only by control points at rest do not move
+        double uLocal, vLocal;
+        if (m_data.lattice->isIdentityCell(findCell(u, m_data.lattice->sD, uLocal), findCell(v, m_data.lattice->tD, vLocal)))
+        {
+            culled++;
+            continue;
+        }
+        
+        double weight = m_data.envelopeValue;
+        if (m_data.paintedWeights)
+            weight *= m_data.paintedWeights[i];
+        if (hasInfluencers && weight >= 0.00001)
+        {
+            bool timeWeight = timed && m_data.weightCache->weights[i] < 0.0f;
+            tbb::tick_count weightStart = timeWeight ? tbb::tick_count::now() : tbb::tick_count();
+            weight *= cachedInfluenceWeight(intialPosition, i, m_data.weightCache, *m_data.toWorldMatrix,
+                                            m_data.influencers, m_data.influencerGrid);
+            if (timeWeight)
+                influenceTime += (tbb::tick_count::now() - weightStart).seconds();
+        }
+        
+        if (weight < 0.00001)
+        {
+            skipped++;
+            continue;
+        }
+        processed++;
+        
+        double cameraZ = cache->cameraZ[i];
+        m_data.deformedPoints.set(i, deformProjectedPoint(intialPosition, u, v, cameraZ, m_data.lattice, m_data.behaviour,
+                                                          m_data.filmHAperture, m_data.filmVAperture, m_data.isOrtho,
+                                                          *m_data.invProjectionMatrix, weight, &uBasis[0], &vBasis[0]));
+
+    }
+    
+    if (timed)
+    {
+        m_data.counters->add(processed, culled, skipped);
+        m_data.counters->addTime((tbb::tick_count::now() - rangeStart).seconds(), influenceTime);
+    }
+}
+
+template <typename Buffer>
+void CameraLatticeFloatKernel<Buffer>::operator()( const tbb::blocked_range<size_t>& r ) const
+{
+    float pm[4][4], ipm[4][4];
+    toFloatMatrix(*m_data.projectionMatrix, pm);
+    toFloatMatrix(*m_data.invProjectionMatrix, ipm);
+    
+    const CompiledLattice *lattice = m_data.lattice;
+    const float invHAperture = float(1.0 / m_data.filmHAperture);
+    const float invVAperture = float(1.0 / m_data.filmVAperture);
+    const float hAperture = float(m_data.filmHAperture);
+    const float vAperture = float(m_data.filmVAperture);
+    const float minGate = float(0.0 - m_data.gateOffsetValue);
+    const float maxGate = float(1.0 + m_data.gateOffsetValue);
+    const float sFactor = float(lattice->sD - 1);
+    const float tFactor = float(lattice->tD - 1);
+    const int maxSCell = lattice->sD - 2;
+    const int maxTCell = lattice->tD - 2;
+    const bool isOrtho = m_data.isOrtho;
+    const bool hasInfluencers = !m_data.influencers->empty();
+    ProjectionCache *cache = m_data.projectionCache;
+    const bool fillCache = !cache->valid;
+    
+    float x[batchSize], y[batchSize], z[batchSize];
+    float u[batchSize], v[batchSize], cameraZ[batchSize], depth[batchSize], weight[batchSize];
+    size_t index[batchSize];
+    size_t processed = 0, culled = 0, skipped = 0;
+    
+    bool timed = m_data.counters != NULL;
+    tbb::tick_count rangeStart = timed ? tbb::tick_count::now() : tbb::tick_count();
+    double influenceTime = 0.0;
+    
+    std::vector<double> uBasis, vBasis;
+    if (m_data.behaviour == kBezier)
+    {
+        uBasis.resize(lattice->sD);
+        vBasis.resize(lattice->tD);
+    }
+    
+    for (size_t start = r.begin(); start < r.end(); start += batchSize)
+    {
+        const int count = r.end() - start < size_t(batchSize) ? int(r.end() - start) : batchSize;
+        
+        for (int i = 0; i < count; i++)
+            index[i] = m_data.vertexIndices ? m_data.vertexIndices[start + i] : start + i;
+        
+        if (m_data.vertexIndices)
+        {
+            for (int i = 0; i < count; i++)
+                m_data.deformedPoints.set(index[i], m_data.points.get(index[i]));
+        }
+        
+        //gather into structure of arrays
+        for (int i = 0; i < count; i++)
+        {
+            Point3 point = m_data.points.get(index[i]);
+            x[i] = float(point.x);
+            y[i] = float(point.y);
+            z[i] = float(point.z);
+        }
+        
+        //projection, only when the cache is not valid
+        if (fillCache)
+        {
+            for (int i = 0; i < count; i++)
+            {
+                float cx = x[i] * pm[0][0] + y[i] * pm[1][0] + z[i] * pm[2][0] + pm[3][0];
+                float cy = x[i] * pm[0][1] + y[i] * pm[1][1] + z[i] * pm[2][1] + pm[3][1];
+                float cz = x[i] * pm[0][2] + y[i] * pm[1][2] + z[i] * pm[2][2] + pm[3][2];
+                
+                float invDepth = isOrtho ? 1.0f : -1.0f / cz;
+                u[i] = cx * invDepth * invHAperture + 0.5f;
+                v[i] = cy * invDepth * invVAperture + 0.5f;
+                cameraZ[i] = cz;
+            }
+            
+            for (int i = 0; i < count; i++)
+            {
+                cache->u[index[i]] = u[i];
+                cache->v[index[i]] = v[i];
+                cache->cameraZ[index[i]] = cameraZ[i];
+            }
+        }
+        else
+        {
+            for (int i = 0; i < count; i++)
+            {
+                u[i] = float(cache->u[index[i]]);
+                v[i] = float(cache->v[index[i]]);
+                cameraZ[i] = float(cache->cameraZ[index[i]]);
+            }
+        }
+        
+        //gate test and identity mask
+        for (int i = 0; i < count; i++)
+        {
+            bool inside = u[i] >= minGate && u[i] <= maxGate && v[i] >= minGate && v[i] <= maxGate;
+            int s = int(floorf((inside ? u[i] : 0.0f) * sFactor));
+            int t = int(floorf((inside ? v[i] : 0.0f) * tFactor));
+            s = s < 0 ? 0 : (s > maxSCell ? maxSCell : s);
+            t = t < 0 ? 0 : (t > maxTCell ? maxTCell : t);
+            inside = inside && !lattice->isIdentityCell(s, t);
+            culled += inside ? 0 : 1;
+            
+            weight[i] = inside ? float(m_data.envelopeValue) : 0.0f;
+            depth[i] = isOrtho ? 1.0f : -cameraZ[i];
+        }
+        
+        if (m_data.paintedWeights)
+        {
+            for (int i = 0; i < count; i++)
+                weight[i] *= m_data.paintedWeights[index[i]];
+        }
+        
+        //influence areas only for the points inside the gate, in double precision
+        if (hasInfluencers)
+        {
+            tbb::tick_count weightStart = timed ? tbb::tick_count::now() : tbb::tick_count();
+            for (int i = 0; i < count; i++)
+                if (weight[i] >= 0.00001f)
+                    weight[i] *= float(cachedInfluenceWeight(m_data.points.get(index[i]), index[i], m_data.weightCache, *m_data.toWorldMatrix,
+                                                              m_data.influencers, m_data.influencerGrid));
+            if (timed)
+                influenceTime += (tbb::tick_count::now() - weightStart).seconds();
+        }
+        
+        size_t batchProcessed = 0;
+        for (int i = 0; i < count; i++)
+        {
+            bool active = weight[i] >= 0.00001f;
+            batchProcessed += active ? 1 : 0;
+            weight[i] = active ? weight[i] : 0.0f;
+            u[i] = active ? u[i] : 0.0f;
+            v[i] = active ? v[i] : 0.0f;
+        }
+        processed += batchProcessed;
+        
+        //lattice lookup, the lattice parameters are replaced by the deformed lattice coordinates
+        if (m_data.behaviour == kLinear)
+        {
+            for (int i = 0; i < count; i++)
+            {
+                float sx = u[i] * sFactor;
+                float tx = v[i] * tFactor;
+                int s = int(floorf(sx));
+                int t = int(floorf(tx));
+                s = s < 0 ? 0 : (s > maxSCell ? maxSCell : s);
+                t = t < 0 ? 0 : (t > maxTCell ? maxTCell : t);
+                float uLocal = sx - s;
+                float vLocal = tx - t;
+                float uv = uLocal * vLocal;
+                
+                const LatticeCell &cell = lattice->cell(s, t);
+                u[i] = float(cell.origin[0] + cell.du[0] * uLocal + cell.dv[0] * vLocal + cell.duv[0] * uv);
+                v[i] = float(cell.origin[1] + cell.du[1] * uLocal + cell.dv[1] * vLocal + cell.duv[1] * uv);
+            }
+        }
+        else
+        {
+            Point3 latticePoint;
+            for (int i = 0; i < count; i++)
+            {
+                if (weight[i] == 0.0f)
+                    continue;
+                
+                if (m_data.behaviour == kBezier)
+                    findBezierDeformedPoint(latticePoint, lattice, u[i], v[i], &uBasis[0], &vBasis[0]);
+                else
+                    findCubicDeformedPoint(latticePoint, lattice, u[i], v[i], m_data.behaviour);
+                
+                u[i] = float(latticePoint.x);
+                v[i] = float(latticePoint.y);
+            }
+        }
+        
+        //unprojection, the lattice arrays now hold the offset from the input position
+        for (int i = 0; i < count; i++)
+        {
+            float fx = u[i] * hAperture * depth[i];
+            float fy = v[i] * vAperture * depth[i];
+            float fz = cameraZ[i];
+            
+            float ox = fx * ipm[0][0] + fy * ipm[1][0] + fz * ipm[2][0] + ipm[3][0];
+            float oy = fx * ipm[0][1] + fy * ipm[1][1] + fz * ipm[2][1] + ipm[3][1];
+            float oz = fx * ipm[0][2] + fy * ipm[1][2] + fz * ipm[2][2] + ipm[3][2];
+            
+            u[i] = ox - x[i];
+            v[i] = oy - y[i];
+            cameraZ[i] = oz - z[i];
+        }
+        
+        //blending, written back in bulk
+        for (int i = 0; i < count; i++)
+        {
+            if (weight[i] == 0.0f)
+                continue;
+            
+            Point3 initialPosition = m_data.points.get(index[i]);
+            m_data.deformedPoints.set(index[i], Point3(initialPosition.x + u[i] * weight[i],
+                                                       initialPosition.y + v[i] * weight[i],
+                                                       initialPosition.z + cameraZ[i] * weight[i]));
+        }
+    }
+    
+    //the vertices inside the gate which were not deformed had no weight
+    if (timed)
+    {
+        skipped = (r.end() - r.begin()) - processed - culled;
+        m_data.counters->add(processed, culled, skipped);
+        m_data.counters->addTime((tbb::tick_count::now() - rangeStart).seconds(), influenceTime);
+    }
+}
+
+#endif
@@ -0,0 +1,711 @@
+/*
+ *  cameraLatticeCore.cpp
+ *  cameraLattice
+ *
+ *
+ */
+
+#include <string.h>
+
+#include "cameraLatticeCore.h"
+
+/**********************************************************
+ MATRIX
+ **********************************************************/
+
+Matrix4::Matrix4()
+{
+    for (int row = 0; row < 4; row++)
+        for (int column = 0; column < 4; column++)
+            m[row][column] = row == column ? 1.0 : 0.0;
+}
+
+Matrix4::Matrix4(const double values[4][4])
+{
+    memcpy(m, values, sizeof(m));
+}
+
+Matrix4 Matrix4::operator*(const Matrix4 &other) const
+{
+    Matrix4 result;
+    for (int row = 0; row < 4; row++)
+        for (int column = 0; column < 4; column++)
+            result.m[row][column] = m[row][0] * other.m[0][column] + m[row][1] * other.m[1][column] +
+                                    m[row][2] * other.m[2][column] + m[row][3] * other.m[3][column];
+    return result;
+}
+
+bool Matrix4::operator==(const Matrix4 &other) const
+{
+    return memcmp(m, other.m, sizeof(m)) == 0;
+}
+
+Matrix4 Matrix4::inverse() const
+{
+    //gauss jordan elimination with partial pivoting
+    double a[4][8];
+    for (int row = 0; row < 4; row++)
+        for (int column = 0; column < 4; column++)
+        {
+            a[row][column] = m[row][column];
+            a[row][column + 4] = row == column ? 1.0 : 0.0;
+        }
+    
+    for (int column = 0; column < 4; column++)
+    {
+        int pivot = column;
+        for (int row = column + 1; row < 4; row++)
+            if (fabs(a[row][column]) > fabs(a[pivot][column]))
+                pivot = row;
+        
+        if (a[pivot][column] == 0.0)
+            return Matrix4();
+        
+        if (pivot != column)
+        {
+            for (int k = 0; k < 8; k++)
+            {
+                double swap = a[column][k];
+                a[column][k] = a[pivot][k];
+                a[pivot][k] = swap;
+            }
+        }
+        
+        double invPivot = 1.0 / a[column][column];
+        for (int k = 0; k < 8; k++)
+            a[column][k] *= invPivot;
+        
+        for (int row = 0; row < 4; row++)
+        {
+            if (row == column || a[row][column] == 0.0)
+                continue;
+            double factor = a[row][column];
+            for (int k = 0; k < 8; k++)
+                a[row][k] -= factor * a[column][k];
+        }
+    }
+    
+    Matrix4 result;
+    for (int row = 0; row < 4; row++)
+        for (int column = 0; column < 4; column++)
+            result.m[row][column] = a[row][column + 4];
+    return result;
+}
+
+/**********************************************************
+ BERNSTEIN TABLE
+ **********************************************************/
+
+void BernsteinTable::build(int maxDegree)
+{
+    if (maxDegree <= m_maxDegree)
+        return;
+    
+    m_binomials.resize((maxDegree + 1) * (maxDegree + 2) / 2);
+    for (int n = 0; n <= maxDegree; n++)
+    {
+        double *row = &m_binomials[n * (n + 1) / 2];
+        const double *previousRow = n > 0 ? &m_binomials[(n - 1) * n / 2] : NULL;
+        
+        row[0] = 1.0;
+        row[n] = 1.0;
+        for (int i = 1; i < n; i++)
+            row[i] = previousRow[i - 1] + previousRow[i];
+    }
+    
+    m_maxDegree = maxDegree;
+}
+
+void BernsteinTable::evaluate(int n, double s, double *basis) const
+{
+    const double *row = &m_binomials[n * (n + 1) / 2];
+    
+    // forward pass stores s^i, backward pass multiplies by (1-s)^(n-i) and the binomial
+    double power = 1.0;
+    for (int i = 0; i <= n; i++)
+    {
+        basis[i] = power;
+        power *= s;
+    }
+    
+    power = 1.0;
+    double oneMinusS = 1.0 - s;
+    for (int i = n; i >= 0; i--)
+    {
+        basis[i] *= row[i] * power;
+        power *= oneMinusS;
+    }
+}
+
+/**********************************************************
+ COMPILED LATTICE
+ **********************************************************/
+
+const double CompiledLattice::restTolerance = 0.000001;
+
+bool CompiledLattice::compile(const std::vector<Point3> &planePoints, int sD, int tD)
+{
+    //diff against the previous version, used to update only the vertices around the edited points
+    changedPoints.clear();
+    hasChangedPoints = isValid() && sD == this->sD && tD == this->tD && planePoints.size() == points.size();
+    if (hasChangedPoints)
+    {
+        for (size_t i = 0; i < planePoints.size(); i++)
+            if (planePoints[i].x != points[i].x || planePoints[i].y != points[i].y)
+                changedPoints.push_back(int(i));
+    }
+    version++;
+    
+    this->sD = sD;
+    this->tD = tD;
+    points = planePoints;
+    cells.clear();
+    
+    //the bezier windows and the identity mask depend on the subdivisions too
+    maxRecursion = -1;
+    maskBehaviour = -1;
+    numEditedPoints = 0;
+    
+    if (sD < 2 || tD < 2 || planePoints.size() != size_t(sD * tD))
+        return false;
+    
+    //the rest lattice is a unit plane centred on the origin, see _create_camera_lattice
+    editedPointsTable.assign((sD + 1) * (tD + 1), 0);
+    for (int t = 0; t < tD; t++)
+        for (int s = 0; s < sD; s++)
+        {
+            const Point3 &point = planePoints[s + t * sD];
+            bool edited = fabs(point.x - (double(s) / (sD - 1) - 0.5)) > restTolerance ||
+                          fabs(point.y - (double(t) / (tD - 1) - 0.5)) > restTolerance;
+            if (edited)
+                numEditedPoints++;
+            
+            editedPointsTable[(s + 1) + (t + 1) * (sD + 1)] = (edited ? 1 : 0)
+                + editedPointsTable[s + (t + 1) * (sD + 1)]
+                + editedPointsTable[(s + 1) + t * (sD + 1)]
+                - editedPointsTable[s + t * (sD + 1)];
+        }
+    
+    cells.resize((sD - 1) * (tD - 1));
+    for (int t = 0; t < tD - 1; t++)
+        for (int s = 0; s < sD - 1; s++)
+        {
+            const Point3 &p1 = planePoints[s + t * sD];
+            const Point3 &p2 = planePoints[s + (t + 1) * sD];
+            const Point3 &p3 = planePoints[s + 1 + t * sD];
+            const Point3 &p4 = planePoints[s + 1 + (t + 1) * sD];
+            
+            LatticeCell &cell = cells[s + t * (sD - 1)];
+            for (int axis = 0; axis < 2; axis++)
+            {
+                cell.origin[axis] = p1[axis];
+                cell.du[axis] = p3[axis] - p1[axis];
+                cell.dv[axis] = p2[axis] - p1[axis];
+                cell.duv[axis] = p4[axis] - p3[axis] - p2[axis] + p1[axis];
+            }
+        }
+    
+    return true;
+}
+
+void compileWindows(std::vector<BezierWindow> &windows, const int D, const int maxRecursion)
+{
+    windows.resize(D - 1);
+    for (int cell = 0; cell < D - 1; cell++)
+    {
+        BezierWindow &window = windows[cell];
+        window.min = cell - maxRecursion < 0 ? 0 : cell - maxRecursion;
+        window.max = cell + 1 + maxRecursion > D ? D : cell + 1 + maxRecursion;
+        
+        window.minParam = double(window.min) / (D - 1);
+        double maxParam = double(window.max - 1) / (D - 1);
+        window.invRange = maxParam > window.minParam ? 1.0 / (maxParam - window.minParam) : 0.0;
+    }
+}
+
+void CompiledLattice::compileBezierWindows(int maxRecursion)
+{
+    if (maxRecursion == this->maxRecursion || !isValid())
+        return;
+    
+    compileWindows(sWindows, sD, maxRecursion);
+    compileWindows(tWindows, tD, maxRecursion);
+    
+    //a bezier window never spans more than the whole lattice
+    bernsteinTable.build((sD > tD ? sD : tD) - 1);
+    
+    this->maxRecursion = maxRecursion;
+    if (maskBehaviour == kBezier)
+        maskBehaviour = -1;
+}
+
+int CompiledLattice::countEditedPoints(int minS, int maxS, int minT, int maxT) const
+{
+    //inclusive ranges, clamped to the lattice
+    minS = minS < 0 ? 0 : minS;
+    minT = minT < 0 ? 0 : minT;
+    maxS = maxS > sD - 1 ? sD - 1 : maxS;
+    maxT = maxT > tD - 1 ? tD - 1 : maxT;
+    
+    int row = sD + 1;
+    return editedPointsTable[(maxS + 1) + (maxT + 1) * row] - editedPointsTable[minS + (maxT + 1) * row]
+         - editedPointsTable[(maxS + 1) + minT * row] + editedPointsTable[minS + minT * row];
+}
+
+void CompiledLattice::findChangedCells(int behaviour, std::vector<char> &changedCells) const
+{
+    //a cell s is supported by the points from s - ring to s + 1 + ring
+    int ring = 0;
+    if (behaviour == kBezier)
+        ring = maxRecursion;
+    else if (behaviour == kBSpline || behaviour == kCatmullRom)
+        ring = 1;
+    
+    changedCells.assign(cells.size(), 0);
+    for (size_t i = 0; i < changedPoints.size(); i++)
+    {
+        int pointS = changedPoints[i] % sD;
+        int pointT = changedPoints[i] / sD;
+        
+        int minS = pointS - 1 - ring < 0 ? 0 : pointS - 1 - ring;
+        int maxS = pointS + ring > sD - 2 ? sD - 2 : pointS + ring;
+        int minT = pointT - 1 - ring < 0 ? 0 : pointT - 1 - ring;
+        int maxT = pointT + ring > tD - 2 ? tD - 2 : pointT + ring;
+        
+        for (int t = minT; t <= maxT; t++)
+            for (int s = minS; s <= maxS; s++)
+                changedCells[s + t * (sD - 1)] = 1;
+    }
+}
+
+void CompiledLattice::compileIdentityMask(int behaviour)
+{
+    if (behaviour == maskBehaviour || !isValid())
+        return;
+    
+    identityCells.resize(cells.size());
+    for (int t = 0; t < tD - 1; t++)
+        for (int s = 0; s < sD - 1; s++)
+        {
+            //control points supporting the cell for each interpolation
+            int edited;
+            if (behaviour == kBezier)
+                edited = countEditedPoints(sWindows[s].min, sWindows[s].max - 1, tWindows[t].min, tWindows[t].max - 1);
+            else if (behaviour == kBSpline || behaviour == kCatmullRom)
+                edited = countEditedPoints(s - 1, s + 2, t - 1, t + 2);
+            else
+                edited = countEditedPoints(s, s + 1, t, t + 1);
+            
+            identityCells[s + t * (sD - 1)] = edited == 0;
+        }
+    
+    maskBehaviour = behaviour;
+}
+
+/**********************************************************
+ INTERPOLATION
+ **********************************************************/
+
+void findLinearDeformedPoint(Point3 &tempPoint, const CompiledLattice *lattice, const double u, const double v)
+{
+    double uLocal, vLocal;
+    int s = findCell(u, lattice->sD, uLocal);
+    int t = findCell(v, lattice->tD, vLocal);
+    
+    const LatticeCell &cell = lattice->cell(s, t);
+    double uv = uLocal * vLocal;
+    tempPoint.x = cell.origin[0] + cell.du[0] * uLocal + cell.dv[0] * vLocal + cell.duv[0] * uv;
+    tempPoint.y = cell.origin[1] + cell.du[1] * uLocal + cell.dv[1] * vLocal + cell.duv[1] * uv;
+}
+
+void findBezierDeformedPoint(Point3 &tempPoint, const CompiledLattice *lattice, const double u, const double v, double *uBasis, double *vBasis)
+{
+    double uLocal, vLocal;
+    const BezierWindow &sWindow = lattice->sWindows[findCell(u, lattice->sD, uLocal)];
+    const BezierWindow &tWindow = lattice->tWindows[findCell(v, lattice->tD, vLocal)];
+    
+    int finalS = sWindow.max - sWindow.min;
+    int finalT = tWindow.max - tWindow.min;
+    lattice->bernsteinTable.evaluate(finalS - 1, (u - sWindow.minParam) * sWindow.invRange, uBasis);
+    lattice->bernsteinTable.evaluate(finalT - 1, (v - tWindow.minParam) * tWindow.invRange, vBasis);
+    
+    const std::vector<Point3> &planePoints = lattice->points;
+    double x = 0.0, y = 0.0;
+	for (int t = 0; t < finalT; t++)
+    {
+        //summing the row first, so the v basis is applied once per row
+        double rowX = 0.0, rowY = 0.0;
+        int rowStart = sWindow.min + (tWindow.min + t) * lattice->sD;
+        for (int s = 0; s < finalS; s++)
+		{
+            const Point3 &controlPoint = planePoints[rowStart + s];
+            rowX += controlPoint.x * uBasis[s];
+            rowY += controlPoint.y * uBasis[s];
+		}
+        
+        x += rowX * vBasis[t];
+        y += rowY * vBasis[t];
+    }
+	tempPoint.x = x;
+	tempPoint.y = y;
+}
+
+void findCubicTaps(const double w, const int D, const int behaviour, int *taps, double *weights)
+{
+    //points outside the gate extrapolate the border cells
+    double f;
+    int i = findCell(w, D, f);
+    double f2 = f * f;
+    double f3 = f2 * f;
+    
+    if (behaviour == kBSpline)
+    {
+        weights[0] = (1.0 - 3.0 * f + 3.0 * f2 - f3) / 6.0;
+        weights[1] = (4.0 - 6.0 * f2 + 3.0 * f3) / 6.0;
+        weights[2] = (1.0 + 3.0 * f + 3.0 * f2 - 3.0 * f3) / 6.0;
+        weights[3] = f3 / 6.0;
+    }
+    else
+    {
+        weights[0] = 0.5 * (-f + 2.0 * f2 - f3);
+        weights[1] = 0.5 * (2.0 - 5.0 * f2 + 3.0 * f3);
+        weights[2] = 0.5 * (f + 4.0 * f2 - 3.0 * f3);
+        weights[3] = 0.5 * (-f2 + f3);
+    }
+    
+    taps[0] = i - 1;
+    taps[1] = i;
+    taps[2] = i + 1;
+    taps[3] = i + 2;
+    
+    //the missing points past the borders are linearly extrapolated (P[-1] = 2 * P[0] - P[1]),
+    //so a lattice at rest maps every point onto itself
+    if (taps[0] < 0)
+    {
+        weights[1] += 2.0 * weights[0];
+        weights[2] -= weights[0];
+        weights[0] = 0.0;
+        taps[0] = 0;
+    }
+    
+    if (taps[3] > D - 1)
+    {
+        weights[2] += 2.0 * weights[3];
+        weights[1] -= weights[3];
+        weights[3] = 0.0;
+        taps[3] = D - 1;
+    }
+}
+
+void findCubicDeformedPoint(Point3 &tempPoint, const CompiledLattice *lattice, const double u, const double v, const int behaviour)
+{
+    int sTaps[4], tTaps[4];
+    double uWeights[4], vWeights[4];
+    findCubicTaps(u, lattice->sD, behaviour, sTaps, uWeights);
+    findCubicTaps(v, lattice->tD, behaviour, tTaps, vWeights);
+    
+    const std::vector<Point3> &planePoints = lattice->points;
+    double x = 0.0, y = 0.0;
+    for (int t = 0; t < 4; t++)
+    {
+        double rowX = 0.0, rowY = 0.0;
+        int rowStart = tTaps[t] * lattice->sD;
+        for (int s = 0; s < 4; s++)
+        {
+            const Point3 &controlPoint = planePoints[rowStart + sTaps[s]];
+            rowX += controlPoint.x * uWeights[s];
+            rowY += controlPoint.y * uWeights[s];
+        }
+        
+        x += rowX * vWeights[t];
+        y += rowY * vWeights[t];
+    }
+    tempPoint.x = x;
+    tempPoint.y = y;
+}
+
+/**********************************************************
+ INFLUENCE AREAS
+ **********************************************************/
+
+void Influencer::set(const Matrix4 &mat, double falloffValue)
+{
+    falloff = falloffValue;
+    invMat = mat.inverse();
+    
+    pos.x = mat[3][0];
+    pos.y = mat[3][1];
+    pos.z = mat[3][2];
+    
+    Point3 vec(mat[0][0], mat[0][1], mat[0][2]);
+    maxAxisLength = vec.length();
+    
+    vec = Point3(mat[1][0], mat[1][1], mat[1][2]);
+    double thisLength = vec.length();
+    if (thisLength > maxAxisLength)
+        maxAxisLength = thisLength;
+    
+    vec = Point3(mat[2][0], mat[2][1], mat[2][2]);
+    thisLength = vec.length();
+    if (thisLength > maxAxisLength)
+        maxAxisLength = thisLength;
+}
+
+void InfluencerGrid::build(const std::vector<Influencer> &influencers)
+{
+    m_cellStart.clear();
+    m_indices.clear();
+    if (influencers.empty())
+        return;
+    
+    //bounds of all the influencers bounding spheres
+    double minCorner[3], maxCorner[3];
+    for (int axis = 0; axis < 3; axis++)
+    {
+        minCorner[axis] = influencers[0].pos[axis] - influencers[0].maxAxisLength;
+        maxCorner[axis] = influencers[0].pos[axis] + influencers[0].maxAxisLength;
+    }
+    
+    for (size_t i = 1; i < influencers.size(); i++)
+        for (int axis = 0; axis < 3; axis++)
+        {
+            double radius = influencers[i].maxAxisLength;
+            if (influencers[i].pos[axis] - radius < minCorner[axis])
+                minCorner[axis] = influencers[i].pos[axis] - radius;
+            if (influencers[i].pos[axis] + radius > maxCorner[axis])
+                maxCorner[axis] = influencers[i].pos[axis] + radius;
+        }
+    
+    //roughly one influencer per cell when they are evenly spread
+    int resolution = int(ceil(pow(double(influencers.size()), 1.0 / 3.0)));
+    if (resolution > maxResolution)
+        resolution = maxResolution;
+    
+    for (int axis = 0; axis < 3; axis++)
+    {
+        double extent = maxCorner[axis] - minCorner[axis];
+        m_min[axis] = minCorner[axis];
+        m_resolution[axis] = extent > 0.0 ? resolution : 1;
+        m_invCellSize[axis] = extent > 0.0 ? m_resolution[axis] / extent : 0.0;
+    }
+    
+    //two passes, counting the influencers of each cell first and then filling the cells
+    int numCells = m_resolution[0] * m_resolution[1] * m_resolution[2];
+    m_cellStart.assign(numCells + 1, 0);
+    for (int pass = 0; pass < 2; pass++)
+    {
+        std::vector<unsigned int> fill;
+        if (pass == 1)
+        {
+            for (int cell = 0; cell < numCells; cell++)
+                m_cellStart[cell + 1] += m_cellStart[cell];
+            m_indices.resize(m_cellStart[numCells]);
+            fill.assign(m_cellStart.begin(), m_cellStart.end() - 1);
+        }
+        
+        for (size_t i = 0; i < influencers.size(); i++)
+        {
+            int minCell[3], maxCell[3];
+            for (int axis = 0; axis < 3; axis++)
+            {
+                minCell[axis] = cellIndex(influencers[i].pos[axis] - influencers[i].maxAxisLength, axis);
+                maxCell[axis] = cellIndex(influencers[i].pos[axis] + influencers[i].maxAxisLength, axis);
+            }
+            
+            for (int z = minCell[2]; z <= maxCell[2]; z++)
+                for (int y = minCell[1]; y <= maxCell[1]; y++)
+                    for (int x = minCell[0]; x <= maxCell[0]; x++)
+                    {
+                        int cell = x + (y + z * m_resolution[1]) * m_resolution[0];
+                        if (pass == 0)
+                            m_cellStart[cell + 1]++;
+                        else
+                            m_indices[fill[cell]++] = (unsigned int)i;
+                    }
+        }
+    }
+}
+
+int InfluencerGrid::cellIndex(double value, int axis) const
+{
+    int cell = int(floor((value - m_min[axis]) * m_invCellSize[axis]));
+    if (cell < 0)
+        return 0;
+    if (cell >= m_resolution[axis])
+        return m_resolution[axis] - 1;
+    return cell;
+}
+
+const unsigned int *InfluencerGrid::query(const Point3 &pt, unsigned int &count) const
+{
+    count = 0;
+    if (m_cellStart.empty())
+        return NULL;
+    
+    int cell[3];
+    for (int axis = 0; axis < 3; axis++)
+    {
+        double position = (pt[axis] - m_min[axis]) * m_invCellSize[axis];
+        if (position < 0.0 || position > m_resolution[axis])
+            return NULL;
+        
+        cell[axis] = int(position);
+        if (cell[axis] == m_resolution[axis])
+            cell[axis]--;
+    }
+    
+    int index = cell[0] + (cell[1] + cell[2] * m_resolution[1]) * m_resolution[0];
+    count = m_cellStart[index + 1] - m_cellStart[index];
+    return count ? &m_indices[m_cellStart[index]] : NULL;
+}
+
+double get_influencers_weight(const Point3 &pt, const std::vector<Influencer> *influencers, const InfluencerGrid *grid)
+{
+    unsigned int count;
+    const unsigned int *candidates = grid->query(pt, count);
+    
+    double totalWeight = 0.0;
+    for (unsigned int c = 0; c < count; ++c)
+    {
+        const Influencer &influencer = (*influencers)[candidates[c]];
+        double dx = pt.x - influencer.pos.x;
+        double dy = pt.y - influencer.pos.y;
+        double dz = pt.z - influencer.pos.z;
+        if (dx * dx + dy * dy + dz * dz > influencer.maxAxisLength * influencer.maxAxisLength)
+            continue;
+        
+        Point3 vec = pt * influencer.invMat;
+        
+        //the radius of the locator in local space is 1
+        double squaredLength = vec.dot(vec);
+        if (squaredLength < 1)
+        {
+            double length = sqrt(squaredLength);
+            if (length <= 0.0001 || influencer.falloff < 0.0001 || length < 1 - influencer.falloff)
+                totalWeight = 1;
+            else
+                totalWeight += 1 - (length - (1 - influencer.falloff)) / influencer.falloff;
+        }
+        
+        if (totalWeight >= 0.9999)
+            return 1.0;
+    }
+    
+    return totalWeight;
+}
+
+/**********************************************************
+ CAMERA
+ **********************************************************/
+
+void projectPoint(const Point3 &point, const Matrix4 &projectionMatrix, const double filmHAperture, const double filmVAperture, const bool isOrtho,
+                  double &u, double &v, double &cameraZ)
+{
+    Point3 pt = point * projectionMatrix;
+    cameraZ = pt.z;
+    
+    if (!isOrtho)
+    {
+        pt.x = pt.x / -cameraZ;
+        pt.y = pt.y / -cameraZ;
+    }
+    
+    u = pt.x / filmHAperture + 0.5;
+    v = pt.y / filmVAperture + 0.5;
+}
+
+void CompiledCamera::compile(const Matrix4 &cameraMatrix, bool isOrtho, double orthographicWidth,
+                             double horizontalAperture, double verticalAperture, double focalLength)
+{
+    this->isOrtho = isOrtho;
+    if (isOrtho)
+    {
+        filmHAperture = orthographicWidth;
+        filmVAperture = orthographicWidth;
+    }
+    else
+    {
+        // 0.03937 is the factor mm to inches
+        // 57.29578 is the maya conversion factor
+        double hFov = 57.29578 * 2.0 * atan((0.5 * horizontalAperture) / (focalLength * 0.03937));
+        double vFov = 57.29578 * 2.0 * atan((0.5 * verticalAperture) / (focalLength * 0.03937));
+
+        //PLEASE NOTE: while the projected points which needs to be deformed are in a range (-1, 1),
+        //              but we want it to go between 0 and 1 to find the final deformation, that's the multiplication by 2
+        
+        // 3.14159265/180.f is the conversion to radians
+        filmHAperture = tan((hFov*0.5) * 3.14159265 / 180.f) * 2;
+        filmVAperture = tan((vFov*0.5) * 3.14159265 / 180.f) * 2;
+    }
+    
+    matrix = cameraMatrix;
+    inverseMatrix = cameraMatrix.inverse();
+    valid = true;
+}
+
+/**********************************************************
+ STACKED LATTICES
+ **********************************************************/
+
+void LatticeStage::setCamera(const CompiledCamera &camera, const Matrix4 &objMat, const Matrix4 &invObjMat)
+{
+    projectionMatrix = objMat * camera.inverseMatrix;
+    invProjectionMatrix = camera.matrix * invObjMat;
+    filmHAperture = camera.filmHAperture;
+    filmVAperture = camera.filmVAperture;
+    isOrtho = camera.isOrtho;
+}
+
+bool deformStagePoint(const LatticeStage &stage, Point3 &point, double weight, double *uBasis, double *vBasis)
+{
+    double u, v, cameraZ;
+    projectPoint(point, stage.projectionMatrix, stage.filmHAperture, stage.filmVAperture, stage.isOrtho, u, v, cameraZ);
+    
+    if (isOutsideGate(u, v, stage.gateOffsetValue))
+        return false;
+    
+    double uLocal, vLocal;
+    if (stage.lattice->isIdentityCell(findCell(u, stage.lattice->sD, uLocal), findCell(v, stage.lattice->tD, vLocal)))
+        return false;
+    
+    point = deformProjectedPoint(point, u, v, cameraZ, stage.lattice, stage.behaviour, stage.filmHAperture, stage.filmVAperture,
+                                 stage.isOrtho, stage.invProjectionMatrix, weight, uBasis, vBasis);
+    return true;
+}
+
+/**********************************************************
+ LATTICE DEFORMER DATA CLASS FOR TBB
+ **********************************************************/
+
+void LatticeDeformerData::operator()( const tbb::blocked_range<size_t>& r ) const
+{
+    const LatticeStage &stage = *m_stage;
+    std::vector<double> uBasis(stage.lattice->sD), vBasis(stage.lattice->tD);
+    bool hasInfluencers = stage.useInfluencers && !m_influencers->empty();
+    
+    for (size_t i = r.begin(); i != r.end(); ++i)
+    {
+        Point3 initialPosition = m_points[i];
+        
+        double u, v, cameraZ;
+        projectPoint(initialPosition, stage.projectionMatrix, stage.filmHAperture, stage.filmVAperture, stage.isOrtho, u, v, cameraZ);
+        
+        //the gate test is cheaper than the influence areas, so it runs first
+        if (isOutsideGate(u, v, stage.gateOffsetValue))
+            continue;
+        
+        double uLocal, vLocal;
+        if (stage.lattice->isIdentityCell(findCell(u, stage.lattice->sD, uLocal), findCell(v, stage.lattice->tD, vLocal)))
+            continue;
+        
+        double weight = stage.envelopeValue;
+        if (hasInfluencers)
+            weight *= get_influencers_weight(initialPosition * *m_toWorldMatrix, m_influencers, m_influencerGrid);
+        if (weight < 0.00001)
+            continue;
+        
+        m_deformedPoints[i] = deformProjectedPoint(initialPosition, u, v, cameraZ, stage.lattice, stage.behaviour,
+                                                   stage.filmHAperture, stage.filmVAperture, stage.isOrtho,
+                                                   stage.invProjectionMatrix, weight, &uBasis[0], &vBasis[0]);
+    }
+}
@@ -0,0 +1,117 @@
+/*
+ *  cameraLatticeKernel.cpp
+ *  cameraLattice
+ *
+ *
+ */
+
+#include <string.h>
+
+#include "cameraLatticeKernel.h"
+
+/**********************************************************
+ INCREMENTAL EVALUATION
+ **********************************************************/
+
+void buildCellIndex(const ProjectionCache &cache, const CompiledLattice &lattice, const double gateOffsetValue, const float *paintedWeights,
+                    std::vector<unsigned int> &cellStart, std::vector<unsigned int> &cellVertices)
+{
+    size_t numCells = lattice.cells.size();
+    size_t numPoints = cache.u.size();
+    std::vector<int> pointCells(numPoints, -1);
+    
+    cellStart.assign(numCells + 1, 0);
+    for (size_t i = 0; i < numPoints; i++)
+    {
+        //vertices painted out never move, the incremental updates skip them
+        if (paintedWeights && paintedWeights[i] < 0.00001f)
+            continue;
+        
+        double u = cache.u[i];
+        double v = cache.v[i];
+        if (u > 1.0 + gateOffsetValue || v > 1.0 + gateOffsetValue || u < 0.0 - gateOffsetValue || v < 0.0 - gateOffsetValue)
+            continue;
+        
+        double uLocal, vLocal;
+        int cell = findCell(u, lattice.sD, uLocal) + findCell(v, lattice.tD, vLocal) * (lattice.sD - 1);
+        pointCells[i] = cell;
+        cellStart[cell + 1]++;
+    }
+    
+    for (size_t cell = 0; cell < numCells; cell++)
+        cellStart[cell + 1] += cellStart[cell];
+    
+    cellVertices.resize(cellStart[numCells]);
+    std::vector<unsigned int> fill(cellStart.begin(), cellStart.end() - 1);
+    for (size_t i = 0; i < numPoints; i++)
+    {
+        if (pointCells[i] != -1)
+            cellVertices[fill[pointCells[i]]++] = (unsigned int)i;
+    }
+}
+
+/**********************************************************
+ FINGERPRINT
+ **********************************************************/
+
+void Fingerprint::add(const void *data, size_t size)
+{
+    const unsigned char *bytes = static_cast<const unsigned char*>(data);
+    size_t numWords = size / sizeof(unsigned long long);
+    for (size_t i = 0; i < numWords; i++)
+    {
+        unsigned long long word;
+        memcpy(&word, bytes + i * sizeof(unsigned long long), sizeof(unsigned long long));
+        hash = (hash ^ word) * 1099511628211ULL;
+    }
+    
+    for (size_t i = numWords * sizeof(unsigned long long); i < size; i++)
+        hash = (hash ^ bytes[i]) * 1099511628211ULL;
+}
+
+unsigned long long Fingerprint::value() const
+{
+    //final avalanche, so that inputs differing in a few bits spread over the whole hash
+    unsigned long long result = hash;
+    result ^= result >> 33;
+    result *= 0xff51afd7ed558ccdULL;
+    result ^= result >> 33;
+    result *= 0xc4ceb9fe1a85ec53ULL;
+    result ^= result >> 33;
+    return result;
+}
+
+void fingerprintSettings(Fingerprint &fingerprint, const CompiledLattice &lattice, int behaviour, const CompiledCamera &camera,
+                         const Matrix4 &objMat, double envelopeValue, double gateOffsetValue, int precisionValue,
+                         const std::vector<Influencer> &influencers, const float *paintedWeights, size_t numPaintedWeights)
+{
+    fingerprint.add(lattice.sD);
+    fingerprint.add(lattice.tD);
+    for (unsigned int i = 0; i < lattice.points.size(); i++)
+    {
+        fingerprint.add(lattice.points[i].x);
+        fingerprint.add(lattice.points[i].y);
+    }
+    fingerprint.add(behaviour);
+    fingerprint.add(behaviour == kBezier ? lattice.maxRecursion : 0);
+    
+    fingerprint.add(camera.matrix);
+    fingerprint.add(camera.filmHAperture);
+    fingerprint.add(camera.filmVAperture);
+    fingerprint.add(int(camera.isOrtho));
+    
+    fingerprint.add(objMat);
+    fingerprint.add(envelopeValue);
+    fingerprint.add(gateOffsetValue);
+    fingerprint.add(precisionValue);
+    
+    for (size_t i = 0; i < influencers.size(); i++)
+    {
+        fingerprint.add(influencers[i].invMat);
+        fingerprint.add(influencers[i].falloff);
+    }
+    
+    fingerprint.add(int(paintedWeights != NULL));
+    if (paintedWeights)
+        fingerprint.add(paintedWeights, sizeof(float) * numPaintedWeights);
+}
@@ -0,0 +1,224 @@
+/*
+ *  cameraLatticeBatch.cpp
+ *  cameraLattice
+ *
+ *  Applies the camera lattice to a sequence of meshes outside Maya, for the render farm and the pipeline tools.
+ *  The camera, the lattice and the influence areas of each frame come from a sidecar file, see cameraLatticeSidecar.h,
+ *  the meshes are streamed in chunks so their size is not limited by the memory.
+ *
+ *  tcCameraLatticeBatch -sidecar shot.tcl -input mesh.####.obj -output deformed.####.obj
+ *                       [-start n] [-end n] [-threads n] [-chunk n]
+ *
+ *  The # of the paths are replaced by the frame number, padded to their count.
+ *
+ */
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <string>
+#include <vector>
+#include <memory>
+#include <climits>
+#include <algorithm>
+
+#include <tbb/tick_count.h>
+#include <tbb/task_arena.h>
+#include <tbb/parallel_for.h>
+#include <tbb/blocked_range.h>
+
+#include "cameraLatticeCore.h"
+#include "cameraLatticeSidecar.h"
+#include "cameraLatticeMeshStream.h"
+
+struct BatchConfig
+{
+    BatchConfig() : start(INT_MIN), end(INT_MAX), threads(0), chunk(1 << 20) {};
+
+    std::string sidecarPath, inputPattern, outputPattern;
+    int start, end;
+    int threads;
+    size_t chunk;
+};
+
+static std::string expandFramePath(const std::string &pattern, int frame)
+{
+    std::string result;
+    for (size_t i = 0; i < pattern.size(); )
+    {
+        if (pattern[i] != '#')
+        {
+            result += pattern[i++];
+            continue;
+        }
+
+        int padding = 0;
+        while (i < pattern.size() && pattern[i] == '#')
+        {
+            padding++;
+            i++;
+        }
+
+        char number[32];
+        snprintf(number, sizeof(number), "%0*d", padding, frame);
+        result += number;
+    }
+    return result;
+}
+
+/**********************************************************
+ FRAME
+ **********************************************************/
+
+static bool deformFrame(const SidecarFrame &frame, const BatchConfig &config, tbb::task_arena &arena, std::string &error)
+{
+    std::string inputPath = expandFramePath(config.inputPattern, frame.frame);
+    std::string outputPath = expandFramePath(config.outputPattern, frame.frame);
+    if (inputPath == outputPath)
+    {
+        error = "the input and the output of frame " + std::to_string(frame.frame) + " are the same file";
+        return false;
+    }
+
+    std::unique_ptr<MeshStream> stream(MeshStream::create(inputPath));
+    if (!stream.get())
+    {
+        error = "unsupported file format " + inputPath;
+        return false;
+    }
+
+    CompiledCamera camera;
+    camera.compile(frame.cameraMatrix, frame.isOrtho, frame.orthographicWidth,
+                   frame.horizontalAperture, frame.verticalAperture, frame.focalLength);
+
+    CompiledLattice lattice;
+    if (!lattice.compile(frame.latticePoints, frame.sD, frame.tD))
+    {
+        error = "the lattice points of frame " + std::to_string(frame.frame) + " do not match its subdivisions";
+        return false;
+    }
+    if (frame.behaviour == kBezier)
+        lattice.compileBezierWindows(frame.maxRecursion);
+    lattice.compileIdentityMask(frame.behaviour);
+
+    InfluencerGrid influencerGrid;
+    influencerGrid.build(frame.influencers);
+
+    LatticeStage stage;
+    stage.lattice = &lattice;
+    stage.setCamera(camera, frame.objectMatrix, frame.objectMatrix.inverse());
+    stage.behaviour = frame.behaviour;
+    stage.gateOffsetValue = frame.gateOffsetValue;
+    stage.envelopeValue = frame.envelopeValue;
+    stage.useInfluencers = true;
+
+    //same as the deformer, the mesh is only copied when the lattice cannot move it
+    bool deforms = frame.envelopeValue >= 0.01 && !lattice.isAtRest();
+
+    if (!stream->open(inputPath, outputPath, error))
+        return false;
+
+    tbb::tick_count startTime = tbb::tick_count::now();
+    size_t total = 0;
+    std::vector<Point3> points;
+    size_t count;
+    while ((count = stream->read(points, config.chunk, error)) > 0)
+    {
+        if (deforms)
+        {
+            LatticeDeformerData kernel(&stage, &frame.objectMatrix, &frame.influencers, &influencerGrid, &points[0], &points[0]);
+            arena.execute([&] { tbb::parallel_for(tbb::blocked_range<size_t>(0, count), kernel); });
+        }
+
+        if (!stream->write(points, count, error))
+            return false;
+        total += count;
+    }
+
+    if (!error.empty() || !stream->close(error))
+        return false;
+
+    printf("frame %d: %zu vertices %s in %.3fs -> %s\n", frame.frame, total, deforms ? "deformed" : "copied",
+           (tbb::tick_count::now() - startTime).seconds(), outputPath.c_str());
+    return true;
+}
+
+/**********************************************************
+ MAIN
+ **********************************************************/
+
+static void printUsage()
+{
+    fprintf(stderr, "usage: tcCameraLatticeBatch -sidecar file -input mesh.####.obj -output deformed.####.obj\n"
+                    "                            [-start n] [-end n] [-threads n] [-chunk n]\n");
+}
+
+int main(int argc, char **argv)
+{
+    BatchConfig config;
+    for (int i = 1; i < argc; i++)
+    {
+        bool hasValue = i + 1 < argc;
+        if (!strcmp(argv[i], "-sidecar") && hasValue)
+            config.sidecarPath = argv[++i];
+        else if (!strcmp(argv[i], "-input") && hasValue)
+            config.inputPattern = argv[++i];
+        else if (!strcmp(argv[i], "-output") && hasValue)
+            config.outputPattern = argv[++i];
+        else if (!strcmp(argv[i], "-start") && hasValue)
+            config.start = atoi(argv[++i]);
+        else if (!strcmp(argv[i], "-end") && hasValue)
+            config.end = atoi(argv[++i]);
+        else if (!strcmp(argv[i], "-threads") && hasValue)
+            config.threads = atoi(argv[++i]);
+        else if (!strcmp(argv[i], "-chunk") && hasValue)
+            config.chunk = size_t(std::max(1, atoi(argv[++i])));
+        else
+        {
+            printUsage();
+            return 1;
+        }
+    }
+
+    if (config.sidecarPath.empty() || config.inputPattern.empty() || config.outputPattern.empty())
+    {
+        printUsage();
+        return 1;
+    }
+
+    SidecarReader reader;
+    std::string error;
+    if (!reader.open(config.sidecarPath, error))
+    {
+        fprintf(stderr, "tcCameraLatticeBatch: %s\n", error.c_str());
+        return 1;
+    }
+
+    tbb::task_arena arena(config.threads > 0 ? config.threads : tbb::task_arena::automatic);
+
+    //the frame keeps the values of the previous ones, the sidecar only lists what changes
+    SidecarFrame frame;
+    int numFrames = 0;
+    while (reader.next(frame, error))
+    {
+        if (frame.frame < config.start || frame.frame > config.end)
+            continue;
+
+        if (!deformFrame(frame, config, arena, error))
+            break;
+        numFrames++;
+    }
+
+    if (!error.empty())
+    {
+        fprintf(stderr, "tcCameraLatticeBatch: %s\n", error.c_str());
+        return 1;
+    }
+
+    if (numFrames == 0)
+    {
+        fprintf(stderr, "tcCameraLatticeBatch: no frame of %s in the range\n", config.sidecarPath.c_str());
+        return 1;
+    }
+    return 0;
+}
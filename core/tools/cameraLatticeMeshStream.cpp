@@ -0,0 +1,764 @@
+/*
+ *  cameraLatticeMeshStream.cpp
+ *  cameraLattice
+ *
+ */
+
+#include <stdlib.h>
+#include <string.h>
+#include <stdint.h>
+#include <ctype.h>
+#include <sstream>
+#include <algorithm>
+
+#include "cameraLatticeMeshStream.h"
+
+static bool endsWith(const std::string &value, const std::string &suffix)
+{
+    if (value.size() < suffix.size())
+        return false;
+
+    for (size_t i = 0; i < suffix.size(); i++)
+        if (tolower(value[value.size() - suffix.size() + i]) != suffix[i])
+            return false;
+    return true;
+}
+
+static bool isLittleEndian()
+{
+    uint16_t value = 1;
+    return *reinterpret_cast<unsigned char*>(&value) == 1;
+}
+
+static void swapBytes(unsigned char *data, size_t size)
+{
+    for (size_t i = 0; i < size / 2; i++)
+        std::swap(data[i], data[size - 1 - i]);
+}
+
+/**********************************************************
+ MESH STREAM
+ **********************************************************/
+
+MeshStream::~MeshStream()
+{
+    if (m_input)
+        fclose(m_input);
+    if (m_output)
+        fclose(m_output);
+}
+
+bool MeshStream::open(const std::string &inputPath, const std::string &outputPath, std::string &error)
+{
+    m_inputPath = inputPath;
+    m_outputPath = outputPath;
+
+    m_input = fopen(inputPath.c_str(), "rb");
+    if (!m_input)
+    {
+        error = "cannot open " + inputPath;
+        return false;
+    }
+
+    m_output = fopen(outputPath.c_str(), "wb");
+    if (!m_output)
+    {
+        error = "cannot write " + outputPath;
+        return false;
+    }
+
+    return begin(error);
+}
+
+bool MeshStream::close(std::string &error)
+{
+    bool result = end(error);
+
+    fclose(m_input);
+    m_input = NULL;
+
+    if (fclose(m_output) != 0 && result)
+    {
+        error = "cannot write " + m_outputPath;
+        result = false;
+    }
+    m_output = NULL;
+
+    return result;
+}
+
+bool MeshStream::end(std::string &error)
+{
+    return copyRemaining(error);
+}
+
+bool MeshStream::copyRemaining(std::string &error)
+{
+    char buffer[65536];
+    size_t size;
+    while ((size = fread(buffer, 1, sizeof(buffer), m_input)) > 0)
+    {
+        if (fwrite(buffer, 1, size, m_output) != size)
+        {
+            error = "cannot write " + m_outputPath;
+            return false;
+        }
+    }
+    return true;
+}
+
+// the line without its end of line, false at the end of the file
+bool MeshStream::readLine(std::string &line)
+{
+    line.clear();
+
+    int c = fgetc(m_input);
+    if (c == EOF)
+        return false;
+
+    while (c != EOF && c != '\n')
+    {
+        line += char(c);
+        c = fgetc(m_input);
+    }
+
+    if (!line.empty() && line[line.size() - 1] == '\r')
+        line.erase(line.size() - 1);
+    return true;
+}
+
+/**********************************************************
+ OBJ
+ **********************************************************/
+
+class ObjMeshStream : public MeshStream
+{
+public:
+    ObjMeshStream() : m_hasPendingLine(false) {};
+
+    virtual size_t read(std::vector<Point3> &points, size_t maxPoints, std::string &error);
+    virtual bool write(const std::vector<Point3> &points, size_t count, std::string &error);
+
+protected:
+    virtual bool begin(std::string &error) { return true; };
+    virtual bool end(std::string &error);
+
+private:
+    // the "v" lines of the chunk as read, with the position of the text following x y z
+    std::vector<std::string> m_lines;
+    std::vector<size_t> m_tails;
+    std::vector<Point3> m_initialPoints;
+    // the line which ended the chunk, written after its vertices
+    std::string m_pendingLine;
+    bool m_hasPendingLine;
+};
+
+size_t ObjMeshStream::read(std::vector<Point3> &points, size_t maxPoints, std::string &error)
+{
+    if (points.size() < maxPoints)
+        points.resize(maxPoints);
+    m_lines.clear();
+    m_tails.clear();
+    m_initialPoints.clear();
+
+    size_t count = 0;
+    std::string line;
+    while (count < maxPoints && readLine(line))
+    {
+        if (line.size() > 2 && line[0] == 'v' && (line[1] == ' ' || line[1] == '\t'))
+        {
+            const char *start = line.c_str() + 2;
+            char *end = NULL;
+            double values[3];
+            for (int axis = 0; axis < 3; axis++)
+            {
+                values[axis] = strtod(start, &end);
+                if (end == start)
+                {
+                    error = "invalid vertex in " + m_inputPath + ": " + line;
+                    return 0;
+                }
+                start = end;
+            }
+
+            points[count++] = Point3(values[0], values[1], values[2]);
+            m_lines.push_back(line);
+            m_tails.push_back(start - line.c_str());
+            m_initialPoints.push_back(points[count - 1]);
+        }
+        else if (count > 0)
+        {
+            //the vertices of the chunk come first, the faces referencing them are written afterwards
+            m_pendingLine = line;
+            m_hasPendingLine = true;
+            break;
+        }
+        else
+        {
+            fputs(line.c_str(), m_output);
+            fputc('\n', m_output);
+        }
+    }
+
+    return count;
+}
+
+bool ObjMeshStream::write(const std::vector<Point3> &points, size_t count, std::string &error)
+{
+    for (size_t i = 0; i < count; i++)
+    {
+        //the lines of the points which did not move are kept as they were written
+        const Point3 &initial = m_initialPoints[i];
+        if (points[i].x == initial.x && points[i].y == initial.y && points[i].z == initial.z)
+            fprintf(m_output, "%s\n", m_lines[i].c_str());
+        else
+            fprintf(m_output, "v %.9g %.9g %.9g%s\n", points[i].x, points[i].y, points[i].z, m_lines[i].c_str() + m_tails[i]);
+    }
+
+    if (m_hasPendingLine)
+    {
+        fputs(m_pendingLine.c_str(), m_output);
+        fputc('\n', m_output);
+        m_hasPendingLine = false;
+    }
+
+    if (ferror(m_output))
+    {
+        error = "cannot write " + m_outputPath;
+        return false;
+    }
+    return true;
+}
+
+bool ObjMeshStream::end(std::string &error)
+{
+    //a file without vertices is copied line by line by read
+    std::string line;
+    while (readLine(line))
+    {
+        fputs(line.c_str(), m_output);
+        fputc('\n', m_output);
+    }
+    return true;
+}
+
+/**********************************************************
+ PLY
+ **********************************************************/
+
+class PlyMeshStream : public MeshStream
+{
+public:
+    PlyMeshStream() : m_format(kAscii), m_vertexCount(0), m_verticesRead(0), m_vertexSize(0) {};
+
+    virtual size_t read(std::vector<Point3> &points, size_t maxPoints, std::string &error);
+    virtual bool write(const std::vector<Point3> &points, size_t count, std::string &error);
+
+protected:
+    virtual bool begin(std::string &error);
+
+private:
+    enum Format
+    {
+        kAscii = 0,
+        kBinaryLittleEndian = 1,
+        kBinaryBigEndian = 2
+    };
+
+    struct Property
+    {
+        std::string name;
+        int size;
+        bool isFloat, isList;
+    };
+
+    struct Element
+    {
+        std::string name;
+        size_t count;
+        std::vector<Property> properties;
+    };
+
+    static int typeSize(const std::string &type, bool &isFloat);
+
+    double readValue(const unsigned char *data, int axis) const;
+    void writeValue(unsigned char *data, int axis, double value) const;
+
+    Format m_format;
+    size_t m_vertexCount, m_verticesRead;
+
+    // index in the ascii lines and byte offset in the binary records of x, y and z
+    int m_index[3], m_offset[3], m_size[3];
+    size_t m_vertexSize;
+
+    std::vector<std::vector<std::string> > m_asciiVertices;
+    std::vector<Point3> m_initialPoints;
+    std::vector<unsigned char> m_binaryVertices;
+};
+
+int PlyMeshStream::typeSize(const std::string &type, bool &isFloat)
+{
+    isFloat = type == "float" || type == "float32" || type == "double" || type == "float64";
+
+    if (type == "char" || type == "uchar" || type == "int8" || type == "uint8")
+        return 1;
+    if (type == "short" || type == "ushort" || type == "int16" || type == "uint16")
+        return 2;
+    if (type == "int" || type == "uint" || type == "int32" || type == "uint32" || type == "float" || type == "float32")
+        return 4;
+    if (type == "double" || type == "float64")
+        return 8;
+    return 0;
+}
+
+bool PlyMeshStream::begin(std::string &error)
+{
+    std::vector<Element> elements;
+
+    std::string line;
+    if (!readLine(line) || line != "ply")
+    {
+        error = m_inputPath + " is not a ply file";
+        return false;
+    }
+    fprintf(m_output, "%s\n", line.c_str());
+
+    bool hasEnd = false;
+    while (!hasEnd && readLine(line))
+    {
+        fprintf(m_output, "%s\n", line.c_str());
+
+        std::istringstream stream(line);
+        std::string keyword;
+        stream >> keyword;
+
+        if (keyword == "format")
+        {
+            std::string format;
+            stream >> format;
+            if (format == "ascii")
+                m_format = kAscii;
+            else if (format == "binary_little_endian")
+                m_format = kBinaryLittleEndian;
+            else if (format == "binary_big_endian")
+                m_format = kBinaryBigEndian;
+            else
+            {
+                error = "unknown ply format " + format + " in " + m_inputPath;
+                return false;
+            }
+        }
+        else if (keyword == "element")
+        {
+            Element element;
+            stream >> element.name >> element.count;
+            elements.push_back(element);
+        }
+        else if (keyword == "property" && !elements.empty())
+        {
+            Property property;
+            std::string type;
+            stream >> type;
+
+            property.isList = type == "list";
+            if (property.isList)
+            {
+                std::string countType;
+                stream >> countType >> type;
+            }
+            stream >> property.name;
+
+            property.size = typeSize(type, property.isFloat);
+            if (property.size == 0)
+            {
+                error = "unknown ply type " + type + " in " + m_inputPath;
+                return false;
+            }
+            elements.back().properties.push_back(property);
+        }
+        else if (keyword == "end_header")
+            hasEnd = true;
+    }
+
+    if (!hasEnd)
+    {
+        error = "incomplete ply header in " + m_inputPath;
+        return false;
+    }
+
+    size_t vertexElement = elements.size();
+    for (size_t i = 0; i < elements.size() && vertexElement == elements.size(); i++)
+        if (elements[i].name == "vertex")
+            vertexElement = i;
+
+    if (vertexElement == elements.size())
+    {
+        error = "no vertex element in " + m_inputPath;
+        return false;
+    }
+
+    const Element &vertices = elements[vertexElement];
+    const char *axisNames[3] = {"x", "y", "z"};
+    m_vertexSize = 0;
+    for (int axis = 0; axis < 3; axis++)
+        m_index[axis] = -1;
+
+    for (size_t i = 0; i < vertices.properties.size(); i++)
+    {
+        const Property &property = vertices.properties[i];
+        if (property.isList)
+        {
+            error = "list properties on the vertices are not supported in " + m_inputPath;
+            return false;
+        }
+
+        for (int axis = 0; axis < 3; axis++)
+        {
+            if (property.name == axisNames[axis] && property.isFloat)
+            {
+                m_index[axis] = int(i);
+                m_offset[axis] = int(m_vertexSize);
+                m_size[axis] = property.size;
+            }
+        }
+        m_vertexSize += property.size;
+    }
+
+    if (m_index[0] < 0 || m_index[1] < 0 || m_index[2] < 0)
+    {
+        error = "the vertices have no float x, y and z in " + m_inputPath;
+        return false;
+    }
+    m_vertexCount = vertices.count;
+    m_verticesRead = 0;
+
+    //the elements stored before the vertices are copied as they are
+    for (size_t e = 0; e < vertexElement; e++)
+    {
+        const Element &element = elements[e];
+        if (m_format == kAscii)
+        {
+            for (size_t i = 0; i < element.count; i++)
+            {
+                if (!readLine(line))
+                {
+                    error = "truncated ply file " + m_inputPath;
+                    return false;
+                }
+                fprintf(m_output, "%s\n", line.c_str());
+            }
+            continue;
+        }
+
+        size_t size = 0;
+        for (size_t i = 0; i < element.properties.size(); i++)
+        {
+            if (element.properties[i].isList)
+            {
+                error = "list properties before the vertices are not supported in binary ply " + m_inputPath;
+                return false;
+            }
+            size += element.properties[i].size;
+        }
+
+        std::vector<unsigned char> buffer(size * element.count);
+        if (buffer.size() && (fread(&buffer[0], 1, buffer.size(), m_input) != buffer.size() ||
+                              fwrite(&buffer[0], 1, buffer.size(), m_output) != buffer.size()))
+        {
+            error = "truncated ply file " + m_inputPath;
+            return false;
+        }
+    }
+
+    return true;
+}
+
+double PlyMeshStream::readValue(const unsigned char *data, int axis) const
+{
+    unsigned char bytes[8];
+    memcpy(bytes, data + m_offset[axis], m_size[axis]);
+    if ((m_format == kBinaryLittleEndian) != isLittleEndian())
+        swapBytes(bytes, m_size[axis]);
+
+    if (m_size[axis] == 4)
+    {
+        float value;
+        memcpy(&value, bytes, 4);
+        return value;
+    }
+
+    double value;
+    memcpy(&value, bytes, 8);
+    return value;
+}
+
+void PlyMeshStream::writeValue(unsigned char *data, int axis, double value) const
+{
+    unsigned char bytes[8];
+    if (m_size[axis] == 4)
+    {
+        float floatValue = float(value);
+        memcpy(bytes, &floatValue, 4);
+    }
+    else
+        memcpy(bytes, &value, 8);
+
+    if ((m_format == kBinaryLittleEndian) != isLittleEndian())
+        swapBytes(bytes, m_size[axis]);
+    memcpy(data + m_offset[axis], bytes, m_size[axis]);
+}
+
+size_t PlyMeshStream::read(std::vector<Point3> &points, size_t maxPoints, std::string &error)
+{
+    size_t count = std::min(maxPoints, m_vertexCount - m_verticesRead);
+    if (count == 0)
+        return 0;
+
+    if (points.size() < count)
+        points.resize(count);
+
+    if (m_format == kAscii)
+    {
+        m_asciiVertices.resize(count);
+        std::string line;
+        for (size_t i = 0; i < count; i++)
+        {
+            if (!readLine(line))
+            {
+                error = "truncated ply file " + m_inputPath;
+                return 0;
+            }
+
+            std::vector<std::string> &tokens = m_asciiVertices[i];
+            tokens.clear();
+            std::istringstream stream(line);
+            std::string token;
+            while (stream >> token)
+                tokens.push_back(token);
+
+            double values[3];
+            for (int axis = 0; axis < 3; axis++)
+            {
+                if (m_index[axis] >= int(tokens.size()))
+                {
+                    error = "invalid vertex in " + m_inputPath + ": " + line;
+                    return 0;
+                }
+                values[axis] = strtod(tokens[m_index[axis]].c_str(), NULL);
+            }
+            points[i] = Point3(values[0], values[1], values[2]);
+        }
+        m_initialPoints.assign(points.begin(), points.begin() + count);
+    }
+    else
+    {
+        m_binaryVertices.resize(count * m_vertexSize);
+        if (fread(&m_binaryVertices[0], 1, m_binaryVertices.size(), m_input) != m_binaryVertices.size())
+        {
+            error = "truncated ply file " + m_inputPath;
+            return 0;
+        }
+
+        for (size_t i = 0; i < count; i++)
+        {
+            const unsigned char *vertex = &m_binaryVertices[i * m_vertexSize];
+            points[i] = Point3(readValue(vertex, 0), readValue(vertex, 1), readValue(vertex, 2));
+        }
+    }
+
+    m_verticesRead += count;
+    return count;
+}
+
+bool PlyMeshStream::write(const std::vector<Point3> &points, size_t count, std::string &error)
+{
+    if (m_format == kAscii)
+    {
+        char value[32];
+        for (size_t i = 0; i < count; i++)
+        {
+            std::vector<std::string> &tokens = m_asciiVertices[i];
+            for (int axis = 0; axis < 3; axis++)
+            {
+                //the values which did not move are kept as they were written
+                if (points[i][axis] == m_initialPoints[i][axis])
+                    continue;
+                snprintf(value, sizeof(value), "%.9g", points[i][axis]);
+                tokens[m_index[axis]] = value;
+            }
+
+            for (size_t j = 0; j < tokens.size(); j++)
+            {
+                if (j > 0)
+                    fputc(' ', m_output);
+                fputs(tokens[j].c_str(), m_output);
+            }
+            fputc('\n', m_output);
+        }
+    }
+    else
+    {
+        for (size_t i = 0; i < count; i++)
+        {
+            unsigned char *vertex = &m_binaryVertices[i * m_vertexSize];
+            for (int axis = 0; axis < 3; axis++)
+                writeValue(vertex, axis, points[i][axis]);
+        }
+        fwrite(&m_binaryVertices[0], 1, count * m_vertexSize, m_output);
+    }
+
+    if (ferror(m_output))
+    {
+        error = "cannot write " + m_outputPath;
+        return false;
+    }
+    return true;
+}
+
+/**********************************************************
+ RAW POINTS
+ **********************************************************/
+
+class RawMeshStream : public MeshStream
+{
+public:
+    RawMeshStream() : m_valueSize(0), m_count(0), m_pointsRead(0) {};
+
+    virtual size_t read(std::vector<Point3> &points, size_t maxPoints, std::string &error);
+    virtual bool write(const std::vector<Point3> &points, size_t count, std::string &error);
+
+protected:
+    virtual bool begin(std::string &error);
+
+private:
+    uint32_t m_valueSize;
+    uint64_t m_count, m_pointsRead;
+
+    std::vector<unsigned char> m_buffer;
+};
+
+bool RawMeshStream::begin(std::string &error)
+{
+    //magic, version, bytes per value, reserved and count
+    unsigned char header[24];
+    if (fread(header, 1, sizeof(header), m_input) != sizeof(header) || memcmp(header, "TCLP", 4) != 0)
+    {
+        error = m_inputPath + " is not a tclp file";
+        return false;
+    }
+
+    uint32_t version;
+    memcpy(&version, header + 4, 4);
+    memcpy(&m_valueSize, header + 8, 4);
+    memcpy(&m_count, header + 16, 8);
+    if (!isLittleEndian())
+    {
+        swapBytes(reinterpret_cast<unsigned char*>(&version), 4);
+        swapBytes(reinterpret_cast<unsigned char*>(&m_valueSize), 4);
+        swapBytes(reinterpret_cast<unsigned char*>(&m_count), 8);
+    }
+
+    if (version != 1 || (m_valueSize != 4 && m_valueSize != 8))
+    {
+        error = "unsupported tclp file " + m_inputPath;
+        return false;
+    }
+
+    if (fwrite(header, 1, sizeof(header), m_output) != sizeof(header))
+    {
+        error = "cannot write " + m_outputPath;
+        return false;
+    }
+
+    m_pointsRead = 0;
+    return true;
+}
+
+size_t RawMeshStream::read(std::vector<Point3> &points, size_t maxPoints, std::string &error)
+{
+    size_t count = size_t(std::min(uint64_t(maxPoints), m_count - m_pointsRead));
+    if (count == 0)
+        return 0;
+
+    if (points.size() < count)
+        points.resize(count);
+
+    m_buffer.resize(count * 3 * m_valueSize);
+    if (fread(&m_buffer[0], 1, m_buffer.size(), m_input) != m_buffer.size())
+    {
+        error = "truncated tclp file " + m_inputPath;
+        return 0;
+    }
+
+    bool swap = !isLittleEndian();
+    double values[3];
+    for (size_t i = 0; i < count; i++)
+    {
+        for (int axis = 0; axis < 3; axis++)
+        {
+            unsigned char *data = &m_buffer[(i * 3 + axis) * m_valueSize];
+            if (swap)
+                swapBytes(data, m_valueSize);
+
+            if (m_valueSize == 4)
+            {
+                float value;
+                memcpy(&value, data, 4);
+                values[axis] = value;
+            }
+            else
+                memcpy(&values[axis], data, 8);
+        }
+        points[i] = Point3(values[0], values[1], values[2]);
+    }
+
+    m_pointsRead += count;
+    return count;
+}
+
+bool RawMeshStream::write(const std::vector<Point3> &points, size_t count, std::string &error)
+{
+    bool swap = !isLittleEndian();
+    for (size_t i = 0; i < count; i++)
+    {
+        for (int axis = 0; axis < 3; axis++)
+        {
+            unsigned char *data = &m_buffer[(i * 3 + axis) * m_valueSize];
+            if (m_valueSize == 4)
+            {
+                float value = float(points[i][axis]);
+                memcpy(data, &value, 4);
+            }
+            else
+            {
+                double value = points[i][axis];
+                memcpy(data, &value, 8);
+            }
+
+            if (swap)
+                swapBytes(data, m_valueSize);
+        }
+    }
+
+    if (fwrite(&m_buffer[0], 1, count * 3 * m_valueSize, m_output) != count * 3 * m_valueSize)
+    {
+        error = "cannot write " + m_outputPath;
+        return false;
+    }
+    return true;
+}
+
+/**********************************************************
+ FACTORY
+ **********************************************************/
+
+MeshStream *MeshStream::create(const std::string &path)
+{
+    if (endsWith(path, ".obj"))
+        return new ObjMeshStream();
+    if (endsWith(path, ".ply"))
+        return new PlyMeshStream();
+    if (endsWith(path, ".tclp"))
+        return new RawMeshStream();
+    return NULL;
+}
@@ -0,0 +1,54 @@
+/*
+ *  cameraLatticeMeshStream.h
+ *  cameraLattice
+ *
+ *  Reads the vertices of a mesh file in chunks and writes them back, moved, to a new file.
+ *  Everything else in the file is copied as is, so the topology, the uvs and the other data survive the deformation.
+ *
+ *  .obj    the "v" lines, anything after x y z on the line is kept
+ *  .ply    ascii and binary, the x y z properties of the vertex element, float or double
+ *  .tclp   raw points: "TCLP", uint32 version 1, uint32 bytes per value 4 or 8, uint32 0, uint64 count,
+ *          then count x y z values, little endian
+ *
+ */
+
+#ifndef CAMERA_LATTICE_MESH_STREAM_H
+#define CAMERA_LATTICE_MESH_STREAM_H
+
+#include <stdio.h>
+#include <string>
+#include <vector>
+
+#include "cameraLatticeCore.h"
+
+class MeshStream
+{
+public:
+    MeshStream() : m_input(NULL), m_output(NULL) {};
+    virtual ~MeshStream();
+
+    // returns NULL if the extension of the path is not supported
+    static MeshStream *create(const std::string &path);
+
+    bool open(const std::string &inputPath, const std::string &outputPath, std::string &error);
+    // the data left after the last vertex is copied to the output before closing
+    bool close(std::string &error);
+
+    // reads up to maxPoints vertices, returns 0 when all the vertices have been read
+    // every chunk must be written back before reading the next one
+    virtual size_t read(std::vector<Point3> &points, size_t maxPoints, std::string &error) = 0;
+    virtual bool write(const std::vector<Point3> &points, size_t count, std::string &error) = 0;
+
+protected:
+    // called once the files are open, reads and copies the header
+    virtual bool begin(std::string &error) = 0;
+    virtual bool end(std::string &error);
+
+    bool copyRemaining(std::string &error);
+    bool readLine(std::string &line);
+
+    FILE *m_input, *m_output;
+    std::string m_inputPath, m_outputPath;
+};
+
+#endif
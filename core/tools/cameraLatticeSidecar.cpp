@@ -0,0 +1,280 @@
+/*
+ *  cameraLatticeSidecar.cpp
+ *  cameraLattice
+ *
+ */
+
+#include <stdlib.h>
+#include <string.h>
+#include <ctype.h>
+#include <algorithm>
+
+#include "cameraLatticeSidecar.h"
+
+/**********************************************************
+ FRAME
+ **********************************************************/
+
+static void setRestLattice(SidecarFrame &frame)
+{
+    //the same unit plane as _create_camera_lattice
+    frame.latticePoints.resize(frame.sD * frame.tD);
+    for (int t = 0; t < frame.tD; t++)
+        for (int s = 0; s < frame.sD; s++)
+            frame.latticePoints[s + t * frame.sD] = Point3(double(s) / (frame.sD - 1) - 0.5, double(t) / (frame.tD - 1) - 0.5, 0.0);
+}
+
+//the defaults of the deformer and of a new camera
+SidecarFrame::SidecarFrame()
+    : frame(0), isOrtho(false), orthographicWidth(30.0), horizontalAperture(1.417), verticalAperture(0.945), focalLength(35.0),
+      sD(4), tD(4), behaviour(kLinear), maxRecursion(4), gateOffsetValue(0.0), envelopeValue(1.0)
+{
+    setRestLattice(*this);
+}
+
+/**********************************************************
+ READER
+ **********************************************************/
+
+bool SidecarReader::open(const std::string &path, std::string &error)
+{
+    close();
+
+    m_file = fopen(path.c_str(), "r");
+    if (!m_file)
+    {
+        error = "cannot open the sidecar file " + path;
+        return false;
+    }
+
+    m_path = path;
+    m_line = 1;
+    m_hasNextFrame = false;
+    return true;
+}
+
+void SidecarReader::close()
+{
+    if (m_file)
+        fclose(m_file);
+    m_file = NULL;
+}
+
+bool SidecarReader::readToken(std::string &token)
+{
+    token.clear();
+
+    int c = fgetc(m_file);
+    while (c != EOF)
+    {
+        if (c == '#')
+        {
+            while (c != EOF && c != '\n')
+                c = fgetc(m_file);
+        }
+        else if (isspace(c))
+        {
+            if (c == '\n')
+                m_line++;
+            c = fgetc(m_file);
+        }
+        else
+            break;
+    }
+
+    while (c != EOF && !isspace(c) && c != '#')
+    {
+        token += char(c);
+        c = fgetc(m_file);
+    }
+
+    //the character ending the token is read again by the next call
+    if (c != EOF)
+        ungetc(c, m_file);
+
+    return !token.empty();
+}
+
+bool SidecarReader::readNumbers(const std::string &keyword, double *values, int count, std::string &error)
+{
+    std::string token;
+    for (int i = 0; i < count; i++)
+    {
+        char *end = NULL;
+        if (readToken(token))
+            values[i] = strtod(token.c_str(), &end);
+
+        if (token.empty() || *end != '\0')
+        {
+            char message[256];
+            snprintf(message, sizeof(message), "%s:%d: %s expects %d numbers", m_path.c_str(), m_line, keyword.c_str(), count);
+            error = message;
+            return false;
+        }
+    }
+    return true;
+}
+
+bool SidecarReader::next(SidecarFrame &frame, std::string &error)
+{
+    error.clear();
+    if (!m_file)
+        return false;
+
+    bool hasFrame = m_hasNextFrame;
+    if (hasFrame)
+        frame.frame = m_nextFrame;
+    m_hasNextFrame = false;
+
+    bool hasInfluencers = false;
+    std::string keyword;
+    double values[17];
+
+    while (readToken(keyword))
+    {
+        if (keyword == "frame")
+        {
+            if (!readNumbers(keyword, values, 1, error))
+                return false;
+
+            //the entries up to the first frame are the defaults, the next frame ends this one
+            if (hasFrame)
+            {
+                m_hasNextFrame = true;
+                m_nextFrame = int(values[0]);
+                return true;
+            }
+            hasFrame = true;
+            frame.frame = int(values[0]);
+        }
+        else if (keyword == "camera" || keyword == "objectMatrix")
+        {
+            if (!readNumbers(keyword, values, 16, error))
+                return false;
+
+            Matrix4 &matrix = keyword == "camera" ? frame.cameraMatrix : frame.objectMatrix;
+            for (int i = 0; i < 16; i++)
+                matrix[i / 4][i % 4] = values[i];
+        }
+        else if (keyword == "ortho")
+        {
+            if (!readNumbers(keyword, values, 1, error))
+                return false;
+            frame.isOrtho = values[0] != 0.0;
+        }
+        else if (keyword == "orthographicWidth")
+        {
+            if (!readNumbers(keyword, values, 1, error))
+                return false;
+            frame.orthographicWidth = values[0];
+        }
+        else if (keyword == "filmAperture")
+        {
+            if (!readNumbers(keyword, values, 2, error))
+                return false;
+            frame.horizontalAperture = values[0];
+            frame.verticalAperture = values[1];
+        }
+        else if (keyword == "focalLength")
+        {
+            if (!readNumbers(keyword, values, 1, error))
+                return false;
+            frame.focalLength = values[0];
+        }
+        else if (keyword == "lattice")
+        {
+            if (!readNumbers(keyword, values, 2, error))
+                return false;
+            if (values[0] < 2 || values[1] < 2)
+            {
+                char message[256];
+                snprintf(message, sizeof(message), "%s:%d: the lattice needs at least 2 subdivisions", m_path.c_str(), m_line);
+                error = message;
+                return false;
+            }
+            frame.sD = int(values[0]);
+            frame.tD = int(values[1]);
+            setRestLattice(frame);
+        }
+        else if (keyword == "latticePoints")
+        {
+            for (size_t i = 0; i < frame.latticePoints.size(); i++)
+            {
+                if (!readNumbers(keyword, values, 2, error))
+                    return false;
+                frame.latticePoints[i] = Point3(values[0], values[1], 0.0);
+            }
+        }
+        else if (keyword == "interpolation")
+        {
+            std::string name;
+            readToken(name);
+            if (name == "linear")
+                frame.behaviour = kLinear;
+            else if (name == "bezier")
+                frame.behaviour = kBezier;
+            else if (name == "bspline")
+                frame.behaviour = kBSpline;
+            else if (name == "catmullrom")
+                frame.behaviour = kCatmullRom;
+            else
+            {
+                char message[256];
+                snprintf(message, sizeof(message), "%s:%d: unknown interpolation %s", m_path.c_str(), m_line, name.c_str());
+                error = message;
+                return false;
+            }
+        }
+        else if (keyword == "recursion")
+        {
+            if (!readNumbers(keyword, values, 1, error))
+                return false;
+            //same range as the maxRecursion attribute
+            frame.maxRecursion = std::max(1, int(values[0]));
+        }
+        else if (keyword == "gateOffset")
+        {
+            if (!readNumbers(keyword, values, 1, error))
+                return false;
+            frame.gateOffsetValue = values[0];
+        }
+        else if (keyword == "envelope")
+        {
+            if (!readNumbers(keyword, values, 1, error))
+                return false;
+            frame.envelopeValue = values[0];
+        }
+        else if (keyword == "influencer")
+        {
+            if (!readNumbers(keyword, values, 17, error))
+                return false;
+
+            //the areas listed by a frame replace the ones of the previous frames
+            if (!hasInfluencers)
+                frame.influencers.clear();
+            hasInfluencers = true;
+
+            Matrix4 matrix;
+            for (int i = 0; i < 16; i++)
+                matrix[i / 4][i % 4] = values[i + 1];
+
+            Influencer influencer;
+            influencer.set(matrix, values[0]);
+            frame.influencers.push_back(influencer);
+        }
+        else if (keyword == "noInfluencers")
+        {
+            frame.influencers.clear();
+            hasInfluencers = true;
+        }
+        else
+        {
+            char message[256];
+            snprintf(message, sizeof(message), "%s:%d: unknown keyword %s", m_path.c_str(), m_line, keyword.c_str());
+            error = message;
+            return false;
+        }
+    }
+
+    return hasFrame;
+}
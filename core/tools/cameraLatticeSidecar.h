@@ -0,0 +1,84 @@
+/*
+ *  cameraLatticeSidecar.h
+ *  cameraLattice
+ *
+ *  Per frame camera, lattice and influence areas of tcCameraLatticeBatch, read one frame at a time.
+ *
+ *  The file is a list of keywords followed by their numbers, # starts a comment:
+ *
+ *      frame 1001
+ *      camera m00 m01 ... m33              world matrix of the camera, 16 values row after row
+ *      ortho 0                             1 for an orthographic camera
+ *      orthographicWidth 30
+ *      filmAperture 1.417 0.945            horizontal and vertical, in inches
+ *      focalLength 35                      in millimetres
+ *      objectMatrix m00 ... m33            world matrix of the geometry, identity by default
+ *      lattice 4 4                         s and t subdivisions, the points are reset to the rest lattice
+ *      latticePoints x y x y ...           s * t positions of the lattice plane, s first, the rest lattice spans -0.5, 0.5
+ *      interpolation bezier                linear, bezier, bspline or catmullrom
+ *      recursion 4                         bezier recursion
+ *      gateOffset 0.05
+ *      envelope 1
+ *      influencer falloff m00 ... m33      falloff and world matrix of an influence area
+ *      noInfluencers
+ *
+ *  Every value holds until it is changed, the values before the first frame are the defaults of all the frames.
+ *  The influencer entries of a frame replace all the areas of the previous frames.
+ *
+ */
+
+#ifndef CAMERA_LATTICE_SIDECAR_H
+#define CAMERA_LATTICE_SIDECAR_H
+
+#include <stdio.h>
+#include <string>
+#include <vector>
+
+#include "cameraLatticeCore.h"
+
+struct SidecarFrame
+{
+    SidecarFrame();
+
+    int frame;
+
+    Matrix4 cameraMatrix;
+    bool isOrtho;
+    double orthographicWidth, horizontalAperture, verticalAperture, focalLength;
+
+    Matrix4 objectMatrix;
+
+    int sD, tD;
+    std::vector<Point3> latticePoints;
+    int behaviour, maxRecursion;
+    double gateOffsetValue, envelopeValue;
+
+    std::vector<Influencer> influencers;
+};
+
+class SidecarReader
+{
+public:
+    SidecarReader() : m_file(NULL), m_line(0), m_hasNextFrame(false), m_nextFrame(0) {};
+    ~SidecarReader() { close(); };
+
+    bool open(const std::string &path, std::string &error);
+    void close();
+
+    // moves to the next frame of the file, its values are added to the ones of the previous frames
+    // returns false at the end of the file, or with a message in error
+    bool next(SidecarFrame &frame, std::string &error);
+
+private:
+    bool readToken(std::string &token);
+    bool readNumbers(const std::string &keyword, double *values, int count, std::string &error);
+
+    FILE *m_file;
+    std::string m_path;
+    int m_line;
+
+    bool m_hasNextFrame;
+    int m_nextFrame;
+};
+
+#endif
@@ -16,84 +16,317 @@
 #include <maya/MMatrix.h>
 #include <maya/MPxDeformerNode.h>
 #include <maya/MItGeometry.h>
+#include <maya/MFnMesh.h>
 
 #include <maya/MVectorArray.h>
 #include <maya/MPointArray.h>
+#include <maya/MPlugArray.h>
+#include <maya/MString.h>
+#include <maya/MTimeArray.h>
+#include <maya/MObjectArray.h>
+#include <maya/MDGContext.h>
+#include <maya/MEvaluationNode.h>
+#include <maya/MNodeCacheSetupInfo.h>
+#include <maya/MNodeCacheDisablingInfo.h>
+#include <maya/MProfiler.h>
 
 #include <vector>
+#include <map>
+#include <set>
+#include <list>
+#include <memory>
+#include <atomic>
+#include <string>
+#include <algorithm>
+#include <math.h>
 
-struct Influencer
+#include "cameraLatticeCore.h"
+#include "cameraLatticeKernel.h"
+
+enum PrecisionType
+{
+    kDoublePrecision = 0,
+    kFloatPrecision = 1
+};
+
+enum CacheMode
+{
+    kCacheOff = 0,
+    kCachePlayback = 1
+};
+
+// conversions between the Maya types and the types of the core library
+inline Matrix4 toMatrix4(const MMatrix &matrix) { return Matrix4(matrix.matrix); }
+inline Point3 toPoint3(const MPoint &point) { return Point3(point.x, point.y, point.z); }
+void toPoint3Array(const MPointArray &points, std::vector<Point3> &result);
+
+// painted deformer weights of a geometry, in the order its vertices are deformed
+struct PaintedWeights
+{
+    PaintedWeights() : valid(false), painted(false) {};
+    
+    // componentWeights is indexed by component, the components missing from it have a weight of 1
+    void compile(const std::vector<float> &componentWeights, const std::vector<int> &componentIndices);
+    const float *values() const { return painted ? &weights[0] : NULL; };
+    
+    std::vector<float> weights;
+    // sparse index of the vertices with a weight, the kernels only visit these when some vertices are painted out
+    std::vector<unsigned int> activeVertices;
+    bool valid;
+    // false when every weight is 1, the kernels then run over all the vertices without reading the weights
+    bool painted;
+};
+
+// positions of a geometry, either an MPointArray or the raw float buffer of a mesh read and written in place
+struct PointBuffer
+{
+    PointBuffer() : array(NULL), raw(NULL), count(0) {};
+    PointBuffer(MPointArray *array) : array(array), raw(NULL), count(array->length()) {};
+    PointBuffer(float *raw, unsigned int count) : array(NULL), raw(raw), count(count) {};
+    
+    Point3 get(size_t i) const
+    {
+        if (raw)
+            return Point3(raw[3 * i], raw[3 * i + 1], raw[3 * i + 2]);
+        const MPoint &point = (*array)[i];
+        return Point3(point.x, point.y, point.z);
+    };
+    
+    void set(size_t i, const Point3 &point) const
+    {
+        if (raw)
+        {
+            raw[3 * i] = float(point.x);
+            raw[3 * i + 1] = float(point.y);
+            raw[3 * i + 2] = float(point.z);
+        }
+        else
+            (*array)[i] = MPoint(point.x, point.y, point.z);
+    };
+    
+    unsigned int length() const { return count; };
+    
+    MPointArray *array;
+    float *raw;
+    unsigned int count;
+};
+
+struct IncrementalState
+{
+    IncrementalState() : valid(false) {};
+    
+    // settings of the last evaluation, any change requires a full evaluation
+    bool matches(unsigned int latticeVersion, double envelopeValue, double gateOffsetValue, int behaviour, int maxRecursion, int precision) const
+    {
+        return valid && this->latticeVersion + 1 == latticeVersion && this->envelopeValue == envelopeValue &&
+               this->gateOffsetValue == gateOffsetValue && this->behaviour == behaviour && this->maxRecursion == maxRecursion &&
+               this->precision == precision;
+    };
+    
+    // result of the last evaluation, updated in place when only some lattice points change.
+    // meshes keep it as raw floats, other geometries as points
+    MPointArray deformedPoints;
+    std::vector<float> rawDeformedPoints;
+    // scratch buffer for the positions of geometries read through the iterator
+    MPointArray inputPoints;
+    // vertices inside the gate bucketed by lattice cell
+    std::vector<unsigned int> cellStart, cellVertices;
+    
+    unsigned int latticeVersion;
+    double envelopeValue, gateOffsetValue;
+    int behaviour, maxRecursion, precision;
+    bool valid;
+};
+
+// timings in seconds and vertex counts of the evaluation of a geometry, or the sum of several
+struct EvaluationStats
+{
+    EvaluationStats() { clear(); };
+    
+    void clear();
+    void add(const EvaluationStats &other);
+    
+    unsigned long long evaluations;
+    double totalTime;
+    // lattice, camera and painted weights, read or compiled again
+    double compileTime;
+    // influence areas read and sorted into their grid, and the influence weights of the vertices evaluated by the kernels
+    double influenceTime;
+    // projections and lattice interpolation of the vertices
+    double kernelTime;
+    // results written to the geometry and to the result cache
+    double outputTime;
+    
+    // vertices moved by the lattice
+    unsigned long long processed;
+    // outside the gate, or in cells of control points at rest
+    unsigned long long culled;
+    // with no weight left after the envelope, the painted weights and the influence areas
+    unsigned long long skipped;
+};
+
+// the kernels of cameraLatticeKernel.h on the Maya points, the precision attribute picks one of them
+typedef CameraLatticeKernel<PointBuffer> CameraLatticeData;
+typedef CameraLatticeFloatKernel<PointBuffer> CameraLatticeFloatData;
+
+struct CachedResult
+{
+    unsigned long long key;
+    // meshes store their raw float buffer, other geometries their points
+    std::vector<float> raw;
+    MPointArray points;
+    // the input points, compared on a hit so that two geometries with the same fingerprint never share a result
+    std::vector<float> inputRaw;
+    MPointArray inputPoints;
+    size_t bytes;
+    
+    bool matches(const PointBuffer &input) const;
+};
+
+// deformation results of a node by input fingerprint, the least recently used go first when over budget
+// the input points are compared on a hit, only the settings rely on the 64 bit hash alone
+class ResultCache
+{
+public:
+    ResultCache() : budget(0), memory(0), hits(0), misses(0) {};
+    
+    // budget in bytes, 0 disables the cache and frees it
+    void setBudget(size_t budget);
+    // NULL when missing or when the input points differ, otherwise the result becomes the most recently used
+    const CachedResult *find(unsigned long long key, const PointBuffer &input);
+    // replaces a result of the same fingerprint, which had different input points
+    void insert(unsigned long long key, const PointBuffer &input, const PointBuffer &points);
+    void clear();
+    
+    size_t budget, memory;
+    unsigned long long hits, misses;
+    
+private:
+    void evict(size_t target);
+    void erase(std::list<CachedResult>::iterator entry);
+    
+    std::list<CachedResult> entries;
+    std::map<unsigned long long, std::list<CachedResult>::iterator> index;
+};
+
+// applies every lattice of a stack to a vertex before moving to the next one,
+// so the intermediate positions never go back to memory
+class StackedLatticeData
+{
+public:
+    StackedLatticeData(const std::vector<LatticeStage> *stages,
+                       const PointBuffer &points,
+                       const PointBuffer &deformedPoints,
+                       InfluenceWeightCache *weightCache,
+                       Matrix4 *toWorldMatrix,
+                       std::vector<Influencer> *influencers, const InfluencerGrid *influencerGrid) :
+        m_stages(stages), m_points(points), m_deformedPoints(deformedPoints), m_weightCache(weightCache),
+        m_toWorldMatrix(toWorldMatrix), m_influencers(influencers), m_influencerGrid(influencerGrid),
+        m_vertexIndices(NULL), m_paintedWeights(NULL), m_counters(NULL)
+    {
+    }
+    
+    void setVertexIndices(const unsigned int *vertexIndices) { m_vertexIndices = vertexIndices; };
+    void setPaintedWeights(const float *paintedWeights) { m_paintedWeights = paintedWeights; };
+    void setCounters(KernelCounters *counters) { m_counters = counters; };
+    
+	void operator()( const tbb::blocked_range<size_t>& r ) const;
+    
+private:
+    const std::vector<LatticeStage> *m_stages;
+    PointBuffer m_points;
+    PointBuffer m_deformedPoints;
+    InfluenceWeightCache *m_weightCache;
+    Matrix4 *m_toWorldMatrix;
+    std::vector<Influencer> *m_influencers;
+    const InfluencerGrid *m_influencerGrid;
+    const unsigned int *m_vertexIndices;
+    const float *m_paintedWeights;
+    KernelCounters *m_counters;
+};
+
+// everything the deformer reads for one geometry at one time sample
+struct SubframeSample
 {
-    MMatrix invMat;
-    MVector pos;
-    double falloff;
-    double maxAxisLength;
+    SubframeSample() : inputIndex(0), weightSource(-1) {};
+    
+    std::vector<LatticeStage> stages;
+    Matrix4 toWorldMatrix;
+    std::vector<Influencer> influencers;
+    InfluencerGrid influencerGrid;
+    
+    // input positions are read once for all the samples where the geometry does not move
+    unsigned int inputIndex;
+    // earlier sample with the same input, object matrix and influence areas, its weights are reused
+    int weightSource;
+    
+    // lattice and camera compiled for this time when the lattice evaluator is not connected
+    CompiledLattice localLattice;
+    CompiledCamera localCamera;
+    // keeps the data of the lattice evaluators alive while the stages point into it
+    std::vector<MObject> dataObjects;
+};
+
+// positions of one geometry at several times
+struct SubframeResult
+{
+    std::vector<MPointArray> inputPoints;
+    // index of the input positions of each sample
+    std::vector<unsigned int> inputIndex;
+    std::vector<MPointArray> deformedPoints;
 };
 
-class CameraLatticeData
+// deforms a vertex for every time sample before moving to the next one
+class SubframeLatticeData
 {
 public:
+    SubframeLatticeData(const std::vector<SubframeSample> *samples, const std::vector<PointBuffer> *inputs, const std::vector<PointBuffer> *outputs) :
+        m_samples(samples), m_inputs(inputs), m_outputs(outputs), m_paintedWeights(NULL)
+    {
+    }
     
-	struct ThreadData
-	{
-        MMatrix *projectionMatrix;
-        MMatrix *invProjectionMatrix;
-        MMatrix *toWorldMatrix;
-		MPointArray *points;
-		MPointArray *deformedPoints;
-
-        MPointArray *planePoints;
-        
-        double filmHAperture, filmVAperture;
-        int sD, tD;
-        int maxRecursion, behaviour;
-        double gateOffsetValue;
-        
-        std::vector<Influencer> *influencers;
-        
-        double envelopeValue;
-        
-        bool isOrtho;
-        
-	};
-    
-    ~CameraLatticeData(){};
-    
-	CameraLatticeData(MMatrix *projectionMatrix,
-                      MMatrix *invProjectionMatrix,
-                      MMatrix *toWorldMatrix,
-                      MPointArray *points,
-                      MPointArray *deformedPoints,
-                      MPointArray* planePoints,
-                      double filmHAperture, double filmVAperture,
-                      int sD, int tD, bool isOrtho, int maxRecursion, int behaviour,
-                      std::vector<Influencer> *influencers, double gateOffsetValue, double envelopeValue)
-	{
-		m_data.projectionMatrix = projectionMatrix;
-		m_data.invProjectionMatrix = invProjectionMatrix;
-		m_data.points = points;
-		m_data.deformedPoints = deformedPoints;
-        m_data.planePoints = planePoints;
-        m_data.filmHAperture = filmHAperture;
-        m_data.filmVAperture = filmVAperture;
-        m_data.sD = sD;
-        m_data.tD = tD;
-        m_data.isOrtho = isOrtho;
-        m_data.maxRecursion = maxRecursion;
-        m_data.behaviour = behaviour;
-        m_data.influencers = influencers;
-        m_data.toWorldMatrix = toWorldMatrix;
-        m_data.gateOffsetValue = gateOffsetValue;
-        m_data.envelopeValue = envelopeValue;
-	}
+    // painted weights do not depend on time, all the samples share them
+    void setPaintedWeights(const float *paintedWeights) { m_paintedWeights = paintedWeights; };
     
 	void operator()( const tbb::blocked_range<size_t>& r ) const;
     
-    private:
+private:
+    const std::vector<SubframeSample> *m_samples;
+    const std::vector<PointBuffer> *m_inputs;
+    const std::vector<PointBuffer> *m_outputs;
+    const float *m_paintedWeights;
+};
+
+// work sizes for the kernels, smaller geometries run serially to avoid the scheduling overhead
+// and the grain is finer for the interpolations which cost more per vertex
+static const size_t serialThreshold = 4096;
+
+inline size_t kernelGrainSize(int behaviour)
+{
+    if (behaviour == kBezier)
+        return 256;
+    if (behaviour == kBSpline || behaviour == kCatmullRom)
+        return 1024;
+    return 2048;
+}
+
+// runs a kernel over a range from inside a task arena
+template <typename Body>
+struct ArenaParallelFor
+{
+    ArenaParallelFor(const Body &body, size_t count, size_t grainSize) : body(body), count(count), grainSize(grainSize) {};
+    
+    void operator()() const
+    {
+        tbb::parallel_for(tbb::blocked_range<size_t>(0, count, grainSize), body);
+    };
     
-        struct ThreadData m_data;
+    const Body &body;
+    size_t count, grainSize;
 };
 
+class CacheReader;
+
 class CameraLattice : public MPxDeformerNode
 {
 public:
@@ -110,9 +343,26 @@ public:
 									   const MMatrix& 	mat,
 									   unsigned int		multiIndex);
     
+    virtual MStatus setDependentsDirty(const MPlug &plug, MPlugArray &plugArray);
+    virtual MStatus preEvaluation(const MDGContext &context, const MEvaluationNode &evaluationNode);
+    virtual SchedulingType schedulingType() const;
+    virtual void getCacheSetup(const MEvaluationNode &evaluationNode, MNodeCacheDisablingInfo &disablingInfo,
+                               MNodeCacheSetupInfo &cacheSetupInfo, MObjectArray &monitoredAttributes) const;
+    virtual bool getInternalValue(const MPlug &plug, MDataHandle &dataHandle);
     virtual MStatus connectionMade (const MPlug &plug, const MPlug &otherPlug, bool asSrc);
     virtual MStatus connectionBroken (const MPlug &plug, const MPlug &otherPlug, bool asSrc);
     
+    // evaluates a geometry at several times in one pass, used to export motion blur samples.
+    // the whole input geometry is deformed, membership sets are ignored
+    MStatus evaluateSubframes(const MTimeArray &times, unsigned int geometryIndex, SubframeResult &result);
+    
+    // statistics of all the evaluations since the last reset, and of the geometries of the last evaluation of the node
+    void getStats(EvaluationStats &total, EvaluationStats &last);
+    void resetStats();
+    
+    // profiler category of all the camera lattice nodes, added when the plugin loads
+    static int profilerCategory;
+    
     
 public:
 	// local node attributes
@@ -124,6 +374,17 @@ public:
     static  MObject     sSubidivision;
     static  MObject     tSubidivision;
     static  MObject     objectMatrix;
+    static  MObject     objectMatrices;
+    static  MObject     geometryMessage;
+    static  MObject     inCompiledLattice;
+    static  MObject     stackedLattice;
+    static  MObject     resultCacheBudget;
+    static  MObject     resultCacheHits;
+    static  MObject     resultCacheMisses;
+    static  MObject     resultCacheMemory;
+    static  MObject     stackedCompiledLattice;
+    static  MObject     stackedEnvelope;
+    static  MObject     stackedGateOffset;
     static  MObject     cameraMatrix;
     static  MObject     inOrtho;
     static  MObject     inOrthographicWidth;
@@ -134,12 +395,100 @@ public:
 	static  MObject     influenceFalloff;
     static  MObject     influenceMatrix;
     static  MObject     gateOffset;
+    static  MObject     precision;
+    static  MObject     maxThreads;
+    static  MObject     cacheMode;
+    static  MObject     cacheFile;
+    static  MObject     cacheTime;
     
 	static  MTypeId		id;
 
 private:
-    bool refreshLogicalIndex;
-    MIntArray cachedLogicalIndex;
+    // geometries of a node can be deformed concurrently, the state they share is only changed under this lock
+    tbb::spin_mutex stateMutex;
+    void markDirty(const MPlug &plug);
+    
+    // logical indices of the connected influence areas
+    std::set<unsigned int> connectedInfluences;
+    
+    bool refreshCompiledLattice;
+    CompiledLattice compiledLattice;
+    
+    void compileCamera(MDataBlock& block, CompiledCamera &camera);
+    void compileLattice(MDataBlock& block, CompiledLattice &lattice);
+    void compileLatticeMode(MDataBlock& block, CompiledLattice &lattice, int behaviour);
+    bool refreshCamera;
+    CompiledCamera compiledCamera;
+    unsigned int sharedCameraVersion;
+    
+    void invalidateProjectionCaches();
+    void invalidateGeometryCaches(unsigned int index);
+    std::map<unsigned int, ProjectionCache> projectionCaches;
+    
+    void invalidateIncrementalStates();
+    std::map<unsigned int, IncrementalState> incrementalStates;
+    
+    void findGeometryCaches(unsigned int index, ProjectionCache *&projectionCache, IncrementalState *&state,
+                            InfluenceWeightCache *&weightCache, PaintedWeights *&paintedWeights);
+    
+    tbb::spin_mutex resultCacheMutex;
+    ResultCache resultCache;
+    
+    // deform times the evaluation of deformGeometry and adds it to the statistics
+    MStatus deformGeometry(MDataBlock& block, MItGeometry& iter, unsigned int multiIndex, EvaluationStats &stats);
+    void addStats(const EvaluationStats &stats, unsigned int multiIndex, unsigned int numGeometries, bool isNormal);
+    tbb::spin_mutex statsMutex;
+    EvaluationStats totalStats;
+    // the geometries evaluated since the inputs were last dirtied are summed in pendingStats,
+    // lastStats gets them once all the output geometries are done, or when the next evaluation starts
+    EvaluationStats lastStats;
+    EvaluationStats pendingStats;
+    std::set<unsigned int> pendingGeometries;
+    unsigned long long pendingGeneration;
+    // bumped by markDirty
+    std::atomic<unsigned long long> evaluationGeneration;
+    
+    // playback of a baked cache, the file stays mapped until its name changes
+    // played is false when the cache has no frame for the geometry at that time, the lattice deforms it instead
+    MStatus deformFromCache(MDataBlock& block, MItGeometry& iter, unsigned int multiIndex, bool &played);
+    // swapped under stateMutex when the file name changes, an evaluation keeps its own reference until it is done with it
+    std::shared_ptr<CacheReader> cacheReader;
+    MString cacheReaderFile;
+    
+    // every node runs its kernels in its own arena, so concurrent deformers do not steal each other's work
+    template <typename Body>
+    void runKernel(const Body &body, size_t numVertices, size_t grainSize, int maxThreadsValue);
+    tbb::task_arena arena;
+    int arenaThreads;
+    tbb::spin_rw_mutex arenaMutex;
+    
+    void readInfluencers(MDataBlock& block, std::vector<Influencer> &result);
+    
+    // warnings of the evaluation, printed once per key when maya is idle since the graph may be evaluated in parallel
+    void warnOnce(const std::string &key, const MString &message);
+    void resetWarnings();
+    tbb::spin_mutex warningMutex;
+    std::set<std::string> reportedWarnings;
+    void invalidateWeightCaches();
+    void prepareWeightCache(InfluenceWeightCache &weightCache, const std::vector<Influencer> &activeInfluencers, unsigned int numPoints);
+    
+    MStatus readSubframeSample(unsigned int geometryIndex, SubframeSample &sample);
+    
+    MStatus deformStacked(MDataBlock& block, MItGeometry& iter, const std::vector<LatticeStage> &stages,
+                          Matrix4 &objMat, MFnMesh *outputMesh, const PointBuffer &points,
+                          IncrementalState &state, ProjectionCache &projectionCache, InfluenceWeightCache &weightCache,
+                          const PaintedWeights &paintedWeights,
+                          std::vector<Influencer> *activeInfluencers, const InfluencerGrid *activeInfluencerGrid,
+                          EvaluationStats &stats);
+    bool refreshInfluencers;
+    std::vector<Influencer> influencers;
+    InfluencerGrid influencerGrid;
+    std::map<unsigned int, InfluenceWeightCache> weightCaches;
+    
+    // weight list of a geometry, read again only when it is painted or the number of vertices changes
+    void readPaintedWeights(MDataBlock& block, unsigned int multiIndex, MItGeometry& iter, PaintedWeights &paintedWeights);
+    void invalidatePaintedWeights(unsigned int index);
+    std::map<unsigned int, PaintedWeights> paintedWeights;
 
 };
 
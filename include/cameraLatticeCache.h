@@ -0,0 +1,119 @@
+/*
+ *  cameraLatticeCache.h
+ *  cameraLattice
+ *
+ *  On disk cache of the deformation of a tcCameraLatticeDeformer.
+ *
+ *  Layout, little endian:
+ *      CacheHeader
+ *      one block per baked frame and geometry, 8 bytes aligned:
+ *          unsigned int indices[numChanged]
+ *          float deltas[3 * numChanged], or short deltas[3 * numChanged] * scale when quantised
+ *      CacheFrame index[numFrames], at header.indexOffset
+ *
+ *  Only the vertices moved by the lattice are stored, as offsets from the input position, indexed over the whole geometry.
+ *  Playback maps them onto the members of the deformer and blends the two frames around a subframe time.
+ *
+ */
+
+#ifndef CAMERA_LATTICE_CACHE_H
+#define CAMERA_LATTICE_CACHE_H
+
+#include <maya/MPointArray.h>
+#include <maya/MString.h>
+#include <maya/MPxCommand.h>
+#include <maya/MSyntax.h>
+#include <maya/MArgList.h>
+
+#include <stdio.h>
+#include <vector>
+
+#include "cameraLattice.h"
+
+struct CacheHeader
+{
+    char magic[4];
+    unsigned int version;
+    unsigned int numFrames;
+    unsigned int reserved;
+    unsigned long long indexOffset;
+};
+
+struct CacheFrame
+{
+    // in seconds, independent from the scene time unit
+    double time;
+    unsigned int geometryIndex;
+    unsigned int numVertices;
+    unsigned int numChanged;
+    unsigned int quantised;
+    float scale;
+    unsigned int reserved;
+    unsigned long long offset;
+};
+
+class CacheWriter
+{
+public:
+    CacheWriter() : m_file(NULL) {};
+    ~CacheWriter() { close(); };
+
+    bool open(const MString &path);
+    // stores the offsets of the points moved further than the tolerance
+    bool addFrame(double time, unsigned int geometryIndex, const MPointArray &inputPoints, const MPointArray &outputPoints,
+                  bool quantise, double tolerance);
+    // writes the frame index, the file is not readable before
+    bool close();
+
+private:
+    FILE *m_file;
+    std::vector<CacheFrame> m_frames;
+};
+
+// read only memory mapping of a cache file, the deltas are applied straight from the mapped pages
+class CacheReader
+{
+public:
+    CacheReader();
+    ~CacheReader() { close(); };
+
+    bool open(const MString &path);
+    void close();
+    bool isOpen() const { return m_data != NULL; };
+
+    // the baked frames around the time for a geometry, their offsets are blended as previous * (1 - blend) + next * blend.
+    // next is NULL at the ends of the baked range, false when the geometry was not baked or the time is outside that range
+    bool findFrames(double time, unsigned int geometryIndex, const CacheFrame *&previous, const CacheFrame *&next, double &blend) const;
+    // adds the offsets of a frame times the weight to the points, false when the vertex count differs from the baked one.
+    // vertexPositions maps the vertices of the baked geometry to the points, -1 for the ones missing from them,
+    // NULL when the points are the whole geometry in order
+    bool apply(const CacheFrame &frame, const PointBuffer &points, const std::vector<int> *vertexPositions, float weight) const;
+
+private:
+    const unsigned char *m_data;
+    size_t m_size;
+    std::vector<CacheFrame> m_frames;
+
+#ifdef _WIN32
+    void *m_fileHandle;
+    void *m_mappingHandle;
+#endif
+};
+
+// tcCameraLatticeBake -file path -startTime 1 -endTime 100 -step 1 -quantise -tolerance 0.0001 deformerName
+class CameraLatticeBakeCommand : public MPxCommand
+{
+public:
+    CameraLatticeBakeCommand() {};
+    virtual ~CameraLatticeBakeCommand() {};
+
+    static void *creator();
+    static MSyntax newSyntax();
+
+    virtual MStatus doIt(const MArgList &args);
+    virtual bool isUndoable() const { return false; };
+
+    static const MString commandName;
+};
+
+#endif
@@ -0,0 +1,91 @@
+/*
+ *  cameraLatticeEvaluator.h
+ *  cameraLattice
+ *
+ *  Compiles a camera lattice once per change and feeds it to all the deformers of the lattice
+ *
+ */
+
+#ifndef CAMERA_LATTICE_EVALUATOR_H
+#define CAMERA_LATTICE_EVALUATOR_H
+
+#include <maya/MTypeId.h>
+#include <maya/MPxNode.h>
+#include <maya/MPxData.h>
+#include <maya/MDataBlock.h>
+#include <maya/MDataHandle.h>
+#include <maya/MPlugArray.h>
+
+#include <memory>
+
+#include "cameraLattice.h"
+
+// lattice, camera and interpolation compiled by the evaluator, read directly by the deformers
+class CompiledLatticeData : public MPxData
+{
+public:
+    CompiledLatticeData() : lattice(new CompiledLattice()), behaviour(kLinear), cameraVersion(0) {};
+    virtual ~CompiledLatticeData() {};
+
+    static void *creator();
+
+    virtual void copy(const MPxData &other);
+    virtual MTypeId typeId() const { return id; };
+    virtual MString name() const { return typeName; };
+
+    static const MTypeId id;
+    static const MString typeName;
+
+    // shared with the evaluator and the previous data, which never modify it
+    std::shared_ptr<const CompiledLattice> lattice;
+    CompiledCamera camera;
+    int behaviour;
+
+    // incremented when the camera changes, so the deformers know when their projections are stale
+    unsigned int cameraVersion;
+};
+
+class CameraLatticeEvaluator : public MPxNode
+{
+public:
+    CameraLatticeEvaluator();
+    virtual ~CameraLatticeEvaluator() {};
+
+    static void *creator();
+    static MStatus initialize();
+
+    virtual MStatus compute(const MPlug &plug, MDataBlock &data);
+    virtual MStatus setDependentsDirty(const MPlug &plug, MPlugArray &plugArray);
+    virtual MStatus preEvaluation(const MDGContext &context, const MEvaluationNode &evaluationNode);
+    virtual SchedulingType schedulingType() const;
+
+    static MTypeId id;
+
+    static MObject inputLattice;
+    static MObject sSubdivision;
+    static MObject tSubdivision;
+    static MObject interpolation;
+    static MObject maxBezierRecursion;
+    static MObject cameraMatrix;
+    static MObject inOrtho;
+    static MObject inOrthographicWidth;
+    static MObject inHorizontalFilmAperture;
+    static MObject inVerticalFilmAperture;
+    static MObject inFocalLength;
+    static MObject outCompiledLattice;
+
+private:
+    void markDirty(const MPlug &plug);
+    void compileLattice(MDataBlock &data, int behaviour, CompiledLattice &lattice);
+
+    // only compiled again when the lattice, its subdivisions or its interpolation change,
+    // a camera change hands the same lattice to the deformers
+    bool refreshLattice;
+    std::shared_ptr<CompiledLattice> compiledLattice;
+
+    bool refreshCamera;
+    CompiledCamera compiledCamera;
+    unsigned int cameraVersion;
+};
+
+#endif
@@ -0,0 +1,36 @@
+/*
+ *  cameraLatticeStats.h
+ *  cameraLattice
+ *
+ *  Timings and vertex counts of the tcCameraLatticeDeformer nodes, to log the cost of the lattices of a shot.
+ *
+ */
+
+#ifndef CAMERA_LATTICE_STATS_H
+#define CAMERA_LATTICE_STATS_H
+
+#include <maya/MPxCommand.h>
+#include <maya/MSyntax.h>
+#include <maya/MArgList.h>
+#include <maya/MString.h>
+
+// tcCameraLatticeStats -json -reset deformerName
+// returns one line per deformer, all the deformers of the scene when none is given.
+// -json returns a single JSON object by deformer name instead, times are in seconds.
+// -reset clears the statistics once they are returned
+class CameraLatticeStatsCommand : public MPxCommand
+{
+public:
+    CameraLatticeStatsCommand() {};
+    virtual ~CameraLatticeStatsCommand() {};
+
+    static void *creator();
+    static MSyntax newSyntax();
+
+    virtual MStatus doIt(const MArgList &args);
+    virtual bool isUndoable() const { return false; };
+
+    static const MString commandName;
+};
+
+#endif
@@ -0,0 +1,36 @@
+/*
+ *  cameraLatticeSubframes.h
+ *  cameraLattice
+ *
+ *  Evaluates a tcCameraLatticeDeformer at several time samples in a single pass over the vertices,
+ *  for the motion blur samples of a render export.
+ *
+ */
+
+#ifndef CAMERA_LATTICE_SUBFRAMES_H
+#define CAMERA_LATTICE_SUBFRAMES_H
+
+#include <maya/MPxCommand.h>
+#include <maya/MSyntax.h>
+#include <maya/MArgList.h>
+#include <maya/MString.h>
+
+// tcCameraLatticeSubframes -sample 10 -sample 10.25 -sample 10.5 -geometryIndex 0 deformerName
+// returns the deformed positions of every sample as a flat list of x, y, z values.
+// with -file the samples of all the geometries are written to a cache instead, see tcCameraLatticeBake
+class CameraLatticeSubframesCommand : public MPxCommand
+{
+public:
+    CameraLatticeSubframesCommand() {};
+    virtual ~CameraLatticeSubframesCommand() {};
+
+    static void *creator();
+    static MSyntax newSyntax();
+
+    virtual MStatus doIt(const MArgList &args);
+    virtual bool isUndoable() const { return false; };
+
+    static const MString commandName;
+};
+
+#endif
@@ -0,0 +1,333 @@
+#                 Toolchefs ltd - Software Disclaimer
+#
+# Copyright 2014 Toolchefs Limited
+#
+# The software, information, code, data and other materials (Software)
+# contained in, or related to, these files is the confidential and proprietary
+# information of Toolchefs ltd.
+# The software is protected by copyright. The Software must not be disclosed,
+# distributed or provided to any third party without the prior written
+# authorisation of Toolchefs ltd.
+
+# The camera lattice deformation on NumPy arrays, for the tools running without Maya.
+# It follows core/source/cameraLatticeCore.cpp step by step: every function works on whole
+# arrays of points, the only python loops are over the lattice cells and the influence areas.
+#
+# Matrices are 4x4 arrays, or the 16 values returned by cmds.getAttr(node + '.worldMatrix[0]'),
+# and multiply row vectors on their left, like in Maya.
+# Lattice points are the sDivisions * tDivisions vertices of the lattice plane, s first, in its object space.
+
+from __future__ import division
+
+import numpy
+
+INTERPOLATION_LINEAR = 0
+INTERPOLATION_BEZIER = 1
+INTERPOLATION_BSPLINE = 2
+INTERPOLATION_CATMULL_ROM = 3
+
+# distance from the rest position under which a control point is considered untouched
+REST_TOLERANCE = 0.000001
+
+# the points are interpolated in blocks, so the bezier basis of a block stays small
+_BLOCK_SIZE = 65536
+
+def _as_matrix(matrix):
+    if matrix is None:
+        return numpy.identity(4)
+    return numpy.asarray(matrix, dtype=numpy.float64).reshape(4, 4)
+
+def _transform(points, matrix):
+    # affine, the last column of the matrix is ignored
+    return numpy.dot(points, matrix[:3, :3]) + matrix[3, :3]
+
+def film_apertures(orthographic=False, orthographic_width=30.0, horizontal_aperture=1.417, vertical_aperture=0.945, focal_length=35.0):
+    # film apertures at unit depth, the apertures are in inches and the focal length in millimetres
+    if orthographic:
+        return orthographic_width, orthographic_width
+
+    # same constants as CompiledCamera::compile
+    h_fov = 57.29578 * 2.0 * numpy.arctan((0.5 * horizontal_aperture) / (focal_length * 0.03937))
+    v_fov = 57.29578 * 2.0 * numpy.arctan((0.5 * vertical_aperture) / (focal_length * 0.03937))
+    return numpy.tan((h_fov * 0.5) * 3.14159265 / 180.0) * 2, numpy.tan((v_fov * 0.5) * 3.14159265 / 180.0) * 2
+
+def project_points(points, projection_matrix, film_h_aperture, film_v_aperture, orthographic=False):
+    # lattice parameters u, v in the (0, 1) range inside the gate, and the depth in camera space
+    projected = _transform(points, _as_matrix(projection_matrix))
+    camera_z = projected[:, 2]
+
+    x = projected[:, 0]
+    y = projected[:, 1]
+    if not orthographic:
+        x = x / -camera_z
+        y = y / -camera_z
+
+    return x / film_h_aperture + 0.5, y / film_v_aperture + 0.5, camera_z
+
+def find_cells(w, divisions):
+    # cell index and local parameter, points outside the lattice extrapolate the border cells
+    x = w * (divisions - 1)
+    cells = numpy.clip(numpy.floor(x), 0, divisions - 2)
+    return cells.astype(numpy.intp), x - cells
+
+def _plane(lattice_points, s_divisions, t_divisions):
+    lattice_points = numpy.asarray(lattice_points, dtype=numpy.float64)
+    if lattice_points.shape[0] != s_divisions * t_divisions or s_divisions < 2 or t_divisions < 2:
+        raise ValueError('Camera Lattice: %d lattice points do not match %d x %d divisions.' %
+                         (lattice_points.shape[0], s_divisions, t_divisions))
+
+    # x and y indexed by [t, s]
+    return (lattice_points[:, 0].reshape(t_divisions, s_divisions),
+            lattice_points[:, 1].reshape(t_divisions, s_divisions))
+
+def _bezier_windows(divisions, max_recursion):
+    # control points used by the cells of a row or column, max is excluded
+    cells = numpy.arange(divisions - 1)
+    window_min = numpy.maximum(cells - max_recursion, 0)
+    window_max = numpy.minimum(cells + 1 + max_recursion, divisions)
+    return window_min, window_max
+
+def _edited_points(plane_x, plane_y):
+    t_divisions, s_divisions = plane_x.shape
+    rest_x = numpy.arange(s_divisions) / (s_divisions - 1) - 0.5
+    rest_y = numpy.arange(t_divisions) / (t_divisions - 1) - 0.5
+    return (numpy.abs(plane_x - rest_x[numpy.newaxis, :]) > REST_TOLERANCE) | \
+           (numpy.abs(plane_y - rest_y[:, numpy.newaxis]) > REST_TOLERANCE)
+
+def identity_cells(lattice_points, s_divisions, t_divisions, interpolation=INTERPOLATION_LINEAR, max_recursion=4):
+    # the cells whose control points, for the given interpolation, are all at rest, indexed by [t, s]
+    # the deformer leaves the points of these cells where they are
+    plane_x, plane_y = _plane(lattice_points, s_divisions, t_divisions)
+    edited = _edited_points(plane_x, plane_y)
+
+    # summed area table, table[t, s] counts the edited points before t and s
+    table = numpy.zeros((t_divisions + 1, s_divisions + 1), dtype=numpy.intp)
+    table[1:, 1:] = edited.cumsum(0).cumsum(1)
+
+    if interpolation == INTERPOLATION_BEZIER:
+        s_min, s_max = _bezier_windows(s_divisions, max_recursion)
+        t_min, t_max = _bezier_windows(t_divisions, max_recursion)
+    elif interpolation in (INTERPOLATION_BSPLINE, INTERPOLATION_CATMULL_ROM):
+        s_min, s_max = numpy.arange(s_divisions - 1) - 1, numpy.arange(s_divisions - 1) + 3
+        t_min, t_max = numpy.arange(t_divisions - 1) - 1, numpy.arange(t_divisions - 1) + 3
+    else:
+        s_min, s_max = numpy.arange(s_divisions - 1), numpy.arange(s_divisions - 1) + 2
+        t_min, t_max = numpy.arange(t_divisions - 1), numpy.arange(t_divisions - 1) + 2
+
+    s_min, s_max = numpy.clip(s_min, 0, s_divisions), numpy.clip(s_max, 0, s_divisions)
+    t_min, t_max = numpy.clip(t_min, 0, t_divisions), numpy.clip(t_max, 0, t_divisions)
+
+    count = table[t_max[:, None], s_max[None, :]] - table[t_min[:, None], s_max[None, :]] \
+          - table[t_max[:, None], s_min[None, :]] + table[t_min[:, None], s_min[None, :]]
+    return count == 0
+
+def linear_lattice_points(plane_x, plane_y, u, v):
+    # bilinear interpolation of the cell containing each point, returns the deformed x and y on the lattice plane
+    t_divisions, s_divisions = plane_x.shape
+    s, u_local = find_cells(u, s_divisions)
+    t, v_local = find_cells(v, t_divisions)
+
+    result = []
+    for plane in (plane_x, plane_y):
+        p1 = plane[t, s]
+        p2 = plane[t + 1, s]
+        p3 = plane[t, s + 1]
+        p4 = plane[t + 1, s + 1]
+        result.append(p1 + (p3 - p1) * u_local + (p2 - p1) * v_local + (p4 - p3 - p2 + p1) * (u_local * v_local))
+    return result
+
+def _bernstein(n, s):
+    # the n + 1 bernstein polynomials of degree n at s, one row per polynomial
+    binomials = numpy.ones(n + 1)
+    for k in range(1, n + 1):
+        binomials[k] = binomials[k - 1] * (n - k + 1) / k
+
+    # forward pass stores s^i, backward pass multiplies by (1-s)^(n-i) and the binomial
+    basis = numpy.empty((n + 1, s.shape[0]))
+    power = numpy.ones(s.shape[0])
+    for i in range(n + 1):
+        basis[i] = power
+        power *= s
+
+    power = numpy.ones(s.shape[0])
+    one_minus_s = 1.0 - s
+    for i in range(n, -1, -1):
+        basis[i] *= binomials[i] * power
+        power *= one_minus_s
+    return basis
+
+def _bezier_basis(w, divisions, max_recursion):
+    # dense basis of all the control points of a row or column, zero outside the window of the cell of each point
+    cells, _ = find_cells(w, divisions)
+    window_min, window_max = _bezier_windows(divisions, max_recursion)
+
+    # remaps the lattice parameter to the (0, 1) range of the window
+    min_param = window_min / (divisions - 1)
+    max_param = (window_max - 1) / (divisions - 1)
+    inv_range = numpy.where(max_param > min_param, 1.0 / numpy.maximum(max_param - min_param, 1e-300), 0.0)
+    s = (w - min_param[cells]) * inv_range[cells]
+
+    first = window_min[cells]
+    degrees = window_max - window_min - 1
+    basis = numpy.zeros((w.shape[0], divisions))
+
+    # the windows only shrink near the borders, so there are few degrees to evaluate
+    for n in numpy.unique(degrees):
+        selected = numpy.nonzero(degrees[cells] == n)[0]
+        if not selected.shape[0]:
+            continue
+
+        columns = first[selected, numpy.newaxis] + numpy.arange(n + 1)
+        basis[selected[:, numpy.newaxis], columns] = _bernstein(n, s[selected]).T
+    return basis
+
+def bezier_lattice_points(plane_x, plane_y, u, v, max_recursion):
+    # bezier patch over the window of max_recursion control points around the cell of each point
+    t_divisions, s_divisions = plane_x.shape
+    u_basis = _bezier_basis(u, s_divisions, max_recursion)
+    v_basis = _bezier_basis(v, t_divisions, max_recursion)
+
+    # the rows are summed first, then weighted by the v basis
+    rows = numpy.dot(u_basis, numpy.concatenate((plane_x.T, plane_y.T), axis=1))
+    return numpy.einsum('ij,ij->i', rows[:, :t_divisions], v_basis), numpy.einsum('ij,ij->i', rows[:, t_divisions:], v_basis)
+
+def _cubic_taps(w, divisions, interpolation):
+    i, f = find_cells(w, divisions)
+    f2 = f * f
+    f3 = f2 * f
+
+    if interpolation == INTERPOLATION_BSPLINE:
+        weights = [(1.0 - 3.0 * f + 3.0 * f2 - f3) / 6.0,
+                   (4.0 - 6.0 * f2 + 3.0 * f3) / 6.0,
+                   (1.0 + 3.0 * f + 3.0 * f2 - 3.0 * f3) / 6.0,
+                   f3 / 6.0]
+    else:
+        weights = [0.5 * (-f + 2.0 * f2 - f3),
+                   0.5 * (2.0 - 5.0 * f2 + 3.0 * f3),
+                   0.5 * (f + 4.0 * f2 - 3.0 * f3),
+                   0.5 * (-f2 + f3)]
+    taps = [i - 1, i, i + 1, i + 2]
+
+    # the missing points past the borders are linearly extrapolated (P[-1] = 2 * P[0] - P[1])
+    first = taps[0] < 0
+    weights[1] = numpy.where(first, weights[1] + 2.0 * weights[0], weights[1])
+    weights[2] = numpy.where(first, weights[2] - weights[0], weights[2])
+    weights[0] = numpy.where(first, 0.0, weights[0])
+    taps[0] = numpy.maximum(taps[0], 0)
+
+    last = taps[3] > divisions - 1
+    weights[2] = numpy.where(last, weights[2] + 2.0 * weights[3], weights[2])
+    weights[1] = numpy.where(last, weights[1] - weights[3], weights[1])
+    weights[3] = numpy.where(last, 0.0, weights[3])
+    taps[3] = numpy.minimum(taps[3], divisions - 1)
+
+    return taps, weights
+
+def cubic_lattice_points(plane_x, plane_y, u, v, interpolation):
+    # uniform b-spline or catmull-rom over the 4 x 4 control points around the cell of each point
+    t_divisions, s_divisions = plane_x.shape
+    s_taps, u_weights = _cubic_taps(u, s_divisions, interpolation)
+    t_taps, v_weights = _cubic_taps(v, t_divisions, interpolation)
+
+    result = []
+    for plane in (plane_x, plane_y):
+        value = numpy.zeros(u.shape[0])
+        for t in range(4):
+            row = numpy.zeros(u.shape[0])
+            for s in range(4):
+                row += plane[t_taps[t], s_taps[s]] * u_weights[s]
+            value += row * v_weights[t]
+        result.append(value)
+    return result
+
+def influencers_weight(points, influencer_matrices, influencer_falloffs):
+    # weight of the influence areas at points in world space, 1 inside an area and fading over its falloff
+    weight = numpy.zeros(points.shape[0])
+    full = numpy.zeros(points.shape[0], dtype=bool)
+
+    for matrix, falloff in zip(influencer_matrices, influencer_falloffs):
+        matrix = _as_matrix(matrix)
+        max_axis_length = numpy.sqrt((matrix[:3, :3] ** 2).sum(1)).max()
+
+        # bounding sphere first, the points already at full weight are done
+        offset = points - matrix[3, :3]
+        candidates = numpy.nonzero(~full & ((offset ** 2).sum(1) <= max_axis_length * max_axis_length))[0]
+        if not candidates.shape[0]:
+            continue
+
+        # the radius of the locator in local space is 1
+        local = _transform(points[candidates], numpy.linalg.inv(matrix))
+        length = numpy.sqrt((local ** 2).sum(1))
+        inside = length < 1
+
+        if falloff < 0.0001:
+            core = inside
+        else:
+            core = inside & ((length <= 0.0001) | (length < 1 - falloff))
+            ramp = inside & ~core
+            weight[candidates[ramp]] += 1 - (length[ramp] - (1 - falloff)) / falloff
+        weight[candidates[core]] = 1
+
+        full[candidates] |= weight[candidates] >= 0.9999
+
+    weight[full] = 1.0
+    return weight
+
+def deform(points, lattice_points, s_divisions, t_divisions, camera_matrix, object_matrix=None,
+           orthographic=False, orthographic_width=30.0, horizontal_aperture=1.417, vertical_aperture=0.945, focal_length=35.0,
+           interpolation=INTERPOLATION_LINEAR, max_recursion=4, gate_offset=0.0, envelope=1.0,
+           influencer_matrices=None, influencer_falloffs=None):
+    # the object space points moved by the lattice, as a new (n, 3) array
+    # the camera attributes are the ones of the maya camera shape, object_matrix is the world matrix of the geometry
+    points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 3)
+    result = points.copy()
+
+    plane_x, plane_y = _plane(lattice_points, s_divisions, t_divisions)
+    if envelope < 0.01 or not _edited_points(plane_x, plane_y).any():
+        return result
+
+    camera_matrix = _as_matrix(camera_matrix)
+    object_matrix = _as_matrix(object_matrix)
+    projection_matrix = numpy.dot(object_matrix, numpy.linalg.inv(camera_matrix))
+    inv_projection_matrix = numpy.dot(camera_matrix, numpy.linalg.inv(object_matrix))
+    film_h_aperture, film_v_aperture = film_apertures(orthographic, orthographic_width, horizontal_aperture,
+                                                      vertical_aperture, focal_length)
+
+    identity = identity_cells(lattice_points, s_divisions, t_divisions, interpolation, max_recursion)
+    use_influencers = influencer_matrices is not None and len(influencer_matrices) > 0
+
+    for start in range(0, points.shape[0], _BLOCK_SIZE):
+        block = points[start:start + _BLOCK_SIZE]
+        u, v, camera_z = project_points(block, projection_matrix, film_h_aperture, film_v_aperture, orthographic)
+
+        # the gate test is cheaper than the influence areas, so it runs first
+        selected = (u <= 1.0 + gate_offset) & (v <= 1.0 + gate_offset) & (u >= 0.0 - gate_offset) & (v >= 0.0 - gate_offset)
+        selected = numpy.nonzero(selected)[0]
+        selected = selected[~identity[find_cells(v[selected], t_divisions)[0], find_cells(u[selected], s_divisions)[0]]]
+
+        weight = numpy.full(selected.shape[0], float(envelope))
+        if use_influencers:
+            weight *= influencers_weight(_transform(block[selected], object_matrix), influencer_matrices, influencer_falloffs)
+        moved = weight >= 0.00001
+        selected, weight = selected[moved], weight[moved]
+        if not selected.shape[0]:
+            continue
+
+        u, v, camera_z = u[selected], v[selected], camera_z[selected]
+        if interpolation == INTERPOLATION_BEZIER:
+            x, y = bezier_lattice_points(plane_x, plane_y, u, v, max_recursion)
+        elif interpolation in (INTERPOLATION_BSPLINE, INTERPOLATION_CATMULL_ROM):
+            x, y = cubic_lattice_points(plane_x, plane_y, u, v, interpolation)
+        else:
+            x, y = linear_lattice_points(plane_x, plane_y, u, v)
+
+        # back from the lattice plane to camera space, then to object space
+        z_depth = 1.0 if orthographic else -camera_z
+        deformed = _transform(numpy.column_stack((x * film_h_aperture * z_depth, y * film_v_aperture * z_depth, camera_z)),
+                              inv_projection_matrix)
+
+        initial = block[selected]
+        weight = numpy.where(weight > 0.9999, 1.0, weight)[:, numpy.newaxis]
+        result[start + selected] = numpy.where(weight == 1.0, deformed, initial + (deformed - initial) * weight)
+
+    return result
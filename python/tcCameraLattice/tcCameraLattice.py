@@ -31,11 +31,14 @@ LATTICE_MAYA_TYPE = 'mesh'
 CAMERA_MAYA_TYPE = 'camera'
 LATTICE_MESSAGE_ATTRIBUTE = 'camera'
 DEFORMER_MESSAGE_ATTRIBUTE = 'deformerMessage'
+GEOMETRY_MESSAGE_ATTRIBUTE = 'geometryMessage'
+OBJECT_MATRICES_ATTRIBUTE = 'objectMatrices'
 LATTICE_TO_DEFORMER_MESSAGE_ATTRIBUTE = 'ldMessage'
 INFLUENCE_MESSAGE_ATTRIBUTE = 'locatorMessage'
 CAMERA_LATTICE_BASE_NAME = 'cameraLattice'
 CAMERA_LATTICE_DEFORMER = 'tcCameraLatticeDeformer'
 CAMERA_LATTICE_INFLUENCER = 'tcCameraLatticeInfluenceAreaLocator'
+CAMERA_LATTICE_EVALUATOR = 'tcCameraLatticeEvaluator'
 
 CAMERA_LATTICE_PARENT_ATTR = 'cameraLatticeParentAttr'
 LATTICE_ACTIVE_ATTR = 'lActive'
@@ -44,6 +47,8 @@ SDIVISIONS_ATTR = 'sDivisions'
 TDIVISIONS_ATTR = 'tDivisions'
 MAX_BEZIER_RECURSION_ATTR = 'maxRecursion'
 GATE_OFFSET_ATTR = 'gateOffset'
+INTERPOLATION_ENUM_NAME = 'linear:bezier:bspline:catmullRom'
+INTERPOLATION_BEZIER = 1
 
 def _is_deformable(obj):
     if cmds.nodeType(obj) == "transform":
@@ -144,6 +149,7 @@ def _get_lattices_from_camera(camera):
          
 def _delete_lattice_deformers(lattice):
     deformers = _get_connected_items(lattice + '.message', destination=True, types=[CAMERA_LATTICE_DEFORMER])
+    deformers += _get_connected_items(lattice + '.outMesh', destination=True, types=[CAMERA_LATTICE_EVALUATOR])
     if deformers:
         cmds.delete(deformers)
         
@@ -263,6 +269,12 @@ def _disconnect_influencers(lattice, influencers):
             cmds.disconnectAttr(fi + ".falloff", d + ".influenceFalloff[%d]" % index)
             cmds.disconnectAttr(fi + ".worldMatrix[0]", d + ".influenceMatrix[%d]" % index)
 
+def _update_interpolation_enum(lattice):
+    # lattices created before the cubic modes existed only list linear and bezier
+    attr = lattice + '.' + INTERPOLATION_ATTR
+    if cmds.attributeQuery(INTERPOLATION_ATTR, node=lattice, listEnum=True)[0] != INTERPOLATION_ENUM_NAME:
+        cmds.addAttr(attr, e=True, enumName=INTERPOLATION_ENUM_NAME)
+
 def _finalise_attribute(attribute):
     cmds.setAttr(attribute, l=True)
     cmds.setAttr(attribute, k=False)
@@ -304,7 +316,7 @@ def _create_camera_lattice(camera, x_div, y_div):
     cmds.addAttr(lattice, ln=CAMERA_LATTICE_PARENT_ATTR, numberOfChildren=7, attributeType='compound')
     cmds.addAttr(lattice, ln=LATTICE_ACTIVE_ATTR, at="double", parent=CAMERA_LATTICE_PARENT_ATTR, maxValue=1, minValue=0, defaultValue=1)
     cmds.addAttr(lattice, ln=LATTICE_MESSAGE_ATTRIBUTE, at="message", parent=CAMERA_LATTICE_PARENT_ATTR)
-    cmds.addAttr(lattice, ln=INTERPOLATION_ATTR, at='enum', enumName='linear:bezier', parent=CAMERA_LATTICE_PARENT_ATTR)
+    cmds.addAttr(lattice, ln=INTERPOLATION_ATTR, at='enum', enumName=INTERPOLATION_ENUM_NAME, parent=CAMERA_LATTICE_PARENT_ATTR)
     cmds.addAttr(lattice, ln=SDIVISIONS_ATTR, at="long", parent=CAMERA_LATTICE_PARENT_ATTR, minValue=3)
     cmds.addAttr(lattice, ln=TDIVISIONS_ATTR, at="long", parent=CAMERA_LATTICE_PARENT_ATTR, minValue=3)
     cmds.addAttr(lattice, ln=MAX_BEZIER_RECURSION_ATTR, at="long", parent=CAMERA_LATTICE_PARENT_ATTR, maxValue=max_div - 2, minValue=1, keyable=True)
@@ -345,49 +357,225 @@ def _create_camera_lattice(camera, x_div, y_div):
     
     return cmds.ls(lattice, l=True)[0]
     
+def _is_shared_deformer(deformer):
+    # deformers created before a lattice shared one node for all its objects drive a single object
+    return not _get_connected_items(deformer + '.' + DEFORMER_MESSAGE_ATTRIBUTE, destination=False)
+
+def _get_shared_deformer(lattice):
+    deformers = _get_connected_items(lattice + '.message', destination=True, types=[CAMERA_LATTICE_DEFORMER])
+    for d in deformers:
+        if _is_shared_deformer(d):
+            return d
+
 def _get_all_affected_objects(lattice):
     cameraLatticeDeformers = _get_connected_items(lattice + '.message', destination=True, types=[CAMERA_LATTICE_DEFORMER])
-    #get all objects connected
-    objects = {}
+    #get all objects connected, as (deformer, object) pairs
+    objects = []
     for cld in cameraLatticeDeformers:
-        obj = _get_connected_items(cld + '.' + DEFORMER_MESSAGE_ATTRIBUTE, destination=False)
-        if obj:
-            objects[cld] = obj[0]
+        if _is_shared_deformer(cld):
+            for obj in _get_connected_items(cld + '.' + GEOMETRY_MESSAGE_ATTRIBUTE, destination=False):
+                objects.append((cld, obj))
+        else:
+            obj = _get_connected_items(cld + '.' + DEFORMER_MESSAGE_ATTRIBUTE, destination=False)
+            objects.append((cld, obj[0]))
     return objects
 
+def _get_geometry_index(deformer, object):
+    index = get_connected_index_attr(object + '.message', deformer + '.' + GEOMETRY_MESSAGE_ATTRIBUTE)
+    if index == -1:
+        raise RuntimeError('Camera Lattice: %s is not deformed by %s.' % (object, deformer))
+    return index
+
+def _add_object_to_deformer(deformer, object):
+    indices = cmds.deformer(deformer, q=True, geometryIndices=True) or []
+    cmds.deformer(deformer, e=True, geometry=object)
+    new_indices = [i for i in cmds.deformer(deformer, q=True, geometryIndices=True) if i not in indices]
+    if not new_indices:
+        raise RuntimeError('Camera Lattice: could not add %s to %s.' % (object, deformer))
+    
+    return new_indices[0]
+
+def _remove_camera_lattice(deformer, object):
+    if not _is_shared_deformer(deformer):
+        cmds.delete(deformer)
+        return
+    
+    index = _get_geometry_index(deformer, object)
+    cmds.removeMultiInstance(deformer + '.%s[%d]' % (OBJECT_MATRICES_ATTRIBUTE, index), b=True)
+    cmds.removeMultiInstance(deformer + '.%s[%d]' % (GEOMETRY_MESSAGE_ATTRIBUTE, index), b=True)
+    
+    if len(cmds.deformer(deformer, q=True, geometry=True) or []) > 1:
+        cmds.deformer(deformer, e=True, remove=True, geometry=object)
+    else:
+        cmds.delete(deformer)
+
+def _get_lattice_evaluator(lattice, camera):
+    # the lattice and its camera are compiled once by the evaluator and read by all the deformers
+    evaluators = _get_connected_items(lattice + '.outMesh', destination=True, types=[CAMERA_LATTICE_EVALUATOR])
+    if evaluators:
+        return evaluators[0]
+    
+    evaluator = cmds.createNode(CAMERA_LATTICE_EVALUATOR)
+    cmds.connectAttr(lattice + '.outMesh', evaluator + '.il')
+    cmds.connectAttr(lattice + '.' + INTERPOLATION_ATTR, evaluator + '.i')
+    cmds.connectAttr(lattice + '.' + SDIVISIONS_ATTR, evaluator + '.ss')
+    cmds.connectAttr(lattice + '.' + TDIVISIONS_ATTR, evaluator + '.ts')
+    cmds.connectAttr(lattice + '.' + MAX_BEZIER_RECURSION_ATTR, evaluator + '.mbr')
+    
+    cmds.connectAttr(camera + ".worldMatrix[0]", evaluator + '.cm')
+    cmds.connectAttr(camera + ".focalLength", evaluator + '.iFL')
+    cmds.connectAttr(camera + ".horizontalFilmAperture", evaluator + '.iHF')
+    cmds.connectAttr(camera + ".verticalFilmAperture", evaluator + '.iVF')
+    cmds.connectAttr(camera + ".orthographicWidth", evaluator + '.iOW')
+    cmds.connectAttr(camera + ".orthographic", evaluator + '.iO')
+    return evaluator
+
 def _apply_camera_lattice(object, lattice):
     messages = _get_connected_items(lattice + '.' + LATTICE_MESSAGE_ATTRIBUTE, with_plug=False, destination=False)
     if not messages or len(messages) > 1:
         raise RuntimeError('Camera Lattice: could not find camera shape from lattice.')
     
+    # every object of a lattice is driven by the same deformer, so the lattice and the camera are read once
+    deformer = _get_shared_deformer(lattice)
+    if deformer:
+        index = _add_object_to_deformer(deformer, object)
+        cmds.connectAttr(object + ".worldMatrix[0]", deformer + '.%s[%d]' % (OBJECT_MATRICES_ATTRIBUTE, index))
+        cmds.connectAttr(object + ".message", deformer + '.%s[%d]' % (GEOMETRY_MESSAGE_ATTRIBUTE, index))
+        return deformer
+    
     deformer = str(cmds.deformer(object, type=CAMERA_LATTICE_DEFORMER)[0])
     if not deformer:
         raise RuntimeError('Camera Lattice: could not create ' + CAMERA_LATTICE_DEFORMER + '.')
 
-    cmds.connectAttr(lattice + '.outMesh', deformer + '.il')
+    evaluator = _get_lattice_evaluator(lattice, str(messages[0]))
+    cmds.connectAttr(evaluator + '.outCompiledLattice', deformer + '.inCompiledLattice')
+    # the deformer reads them from the evaluator, its own ones follow the lattice and its camera ones are locked
     cmds.connectAttr(lattice + '.' + INTERPOLATION_ATTR, deformer + '.i')
-    cmds.connectAttr(lattice + '.' + SDIVISIONS_ATTR, deformer + '.ss')
-    cmds.connectAttr(lattice + '.' + TDIVISIONS_ATTR, deformer + '.ts')
     cmds.connectAttr(lattice + '.' + MAX_BEZIER_RECURSION_ATTR, deformer + '.mbr')
+    for attr in ['cm', 'iO', 'iOW', 'iHF', 'iVF', 'iFL']:
+        cmds.setAttr(deformer + '.' + attr, lock=True)
     cmds.connectAttr(lattice + '.message', deformer + "." + LATTICE_TO_DEFORMER_MESSAGE_ATTRIBUTE)
     cmds.connectAttr(lattice + '.' + LATTICE_ACTIVE_ATTR, deformer + '.envelope')
     cmds.connectAttr(lattice + '.' + GATE_OFFSET_ATTR, deformer + '.gateOffset')
+    # picks the baked frames around the time when the deformer plays back a cache
+    cmds.connectAttr('time1.outTime', deformer + '.cacheTime')
 
-    cmds.connectAttr(object + ".worldMatrix[0]", deformer + '.om')
-    cmds.connectAttr(str(messages[0]) + ".worldMatrix[0]", deformer + '.cm')
-    cmds.connectAttr(str(messages[0]) + ".focalLength", deformer + '.iFL')
-    cmds.connectAttr(str(messages[0]) + ".horizontalFilmAperture", deformer + '.iHF')
-    cmds.connectAttr(str(messages[0]) + ".verticalFilmAperture", deformer + '.iVF')
-    cmds.connectAttr(str(messages[0]) + ".orthographicWidth", deformer + '.iOW')
-    cmds.connectAttr(str(messages[0]) + ".orthographic", deformer + '.iO')
+    index = cmds.deformer(deformer, q=True, geometryIndices=True)[0]
+    cmds.connectAttr(object + ".worldMatrix[0]", deformer + '.%s[%d]' % (OBJECT_MATRICES_ATTRIBUTE, index))
     
-    cmds.connectAttr(object + ".message", deformer + "." + DEFORMER_MESSAGE_ATTRIBUTE)
+    cmds.connectAttr(object + ".message", deformer + '.%s[%d]' % (GEOMETRY_MESSAGE_ATTRIBUTE, index))
     
     for influencer in _get_all_influencers(lattice):
         _apply_influence_area_to_deformer(deformer, influencer)
 
     return deformer
+
+def _get_stacked_index(deformer, evaluator):
+    indices = cmds.getAttr(deformer + '.stackedLattice', mi=True) or []
+    for index in indices:
+        if cmds.isConnected(evaluator + '.outCompiledLattice', deformer + '.stackedLattice[%d].stackedCompiledLattice' % index):
+            return index
+    return -1
+
+def stack_camera_lattice(base_lattice, lattice):
+    # the objects of base_lattice are deformed by lattice as well, in the same pass over their vertices
+    deformer = _get_shared_deformer(base_lattice)
+    if not deformer:
+        raise RuntimeError('Camera Lattice: %s does not deform any object.' % base_lattice)
+    
+    messages = _get_connected_items(lattice + '.' + LATTICE_MESSAGE_ATTRIBUTE, with_plug=False, destination=False)
+    if not messages or len(messages) > 1:
+        raise RuntimeError('Camera Lattice: could not find camera shape from lattice.')
+    
+    evaluator = _get_lattice_evaluator(lattice, str(messages[0]))
+    if _get_stacked_index(deformer, evaluator) != -1:
+        cmds.warning('Camera Lattice: %s is already stacked on %s.' % (lattice, base_lattice))
+        return deformer
+    
+    index = _get_next_index_for_attribute_array(deformer + '.stackedLattice')
+    cmds.connectAttr(evaluator + '.outCompiledLattice', deformer + '.stackedLattice[%d].stackedCompiledLattice' % index)
+    cmds.connectAttr(lattice + '.' + LATTICE_ACTIVE_ATTR, deformer + '.stackedLattice[%d].stackedEnvelope' % index)
+    cmds.connectAttr(lattice + '.' + GATE_OFFSET_ATTR, deformer + '.stackedLattice[%d].stackedGateOffset' % index)
+    return deformer
+
+def unstack_camera_lattice(base_lattice, lattice):
+    deformer = _get_shared_deformer(base_lattice)
+    evaluators = _get_connected_items(lattice + '.outMesh', destination=True, types=[CAMERA_LATTICE_EVALUATOR])
+    if not deformer or not evaluators:
+        return
     
+    index = _get_stacked_index(deformer, evaluators[0])
+    if index != -1:
+        cmds.removeMultiInstance(deformer + '.stackedLattice[%d]' % index, b=True)
+
+def get_stacked_lattices(base_lattice):
+    # lattices applied after base_lattice by its deformer, in order
+    deformer = _get_shared_deformer(base_lattice)
+    if not deformer:
+        return []
+    
+    lattices = []
+    for index in cmds.getAttr(deformer + '.stackedLattice', mi=True) or []:
+        plug = deformer + '.stackedLattice[%d].stackedCompiledLattice' % index
+        evaluators = _get_connected_items(plug, destination=False, types=[CAMERA_LATTICE_EVALUATOR])
+        if not evaluators:
+            continue
+        
+        shapes = _get_connected_items(evaluators[0] + '.il', destination=False, types=[LATTICE_MAYA_TYPE])
+        if shapes:
+            lattices.append(cmds.listRelatives(shapes[0], fullPath=True, parent=True)[0])
+    return lattices
+
+def _format_values(values):
+    return ' '.join('%.17g' % v for v in values)
+
+def export_batch_sidecar(lattice, object, path, start, end):
+    # writes the camera, the lattice and the influence areas of each frame for tcCameraLatticeBatch
+    messages = _get_connected_items(lattice + '.' + LATTICE_MESSAGE_ATTRIBUTE, with_plug=False, destination=False)
+    if not messages or len(messages) > 1:
+        raise RuntimeError('Camera Lattice: could not find camera shape from lattice.')
+    camera = str(messages[0])
+
+    interpolations = ['linear', 'bezier', 'bspline', 'catmullrom']
+    current_time = cmds.currentTime(q=True)
+    try:
+        with open(path, 'w') as f:
+            f.write('# %s deforming %s through %s\n' % (lattice, object, camera))
+            for frame in range(int(start), int(end) + 1):
+                cmds.currentTime(frame)
+
+                f.write('frame %d\n' % frame)
+                f.write('camera %s\n' % _format_values(cmds.getAttr(camera + '.worldMatrix[0]')))
+                f.write('ortho %d\n' % int(cmds.getAttr(camera + '.orthographic')))
+                f.write('orthographicWidth %.17g\n' % cmds.getAttr(camera + '.orthographicWidth'))
+                f.write('filmAperture %.17g %.17g\n' % (cmds.getAttr(camera + '.horizontalFilmAperture'),
+                                                       cmds.getAttr(camera + '.verticalFilmAperture')))
+                f.write('focalLength %.17g\n' % cmds.getAttr(camera + '.focalLength'))
+                f.write('objectMatrix %s\n' % _format_values(cmds.getAttr(object + '.worldMatrix[0]')))
+
+                sD = cmds.getAttr(lattice + '.' + SDIVISIONS_ATTR)
+                tD = cmds.getAttr(lattice + '.' + TDIVISIONS_ATTR)
+                points = cmds.xform(lattice + '.vtx[*]', q=True, os=True, t=True)
+                plane_points = []
+                for i in range(sD * tD):
+                    plane_points.extend(points[i * 3:i * 3 + 2])
+                f.write('lattice %d %d\n' % (sD, tD))
+                f.write('latticePoints %s\n' % _format_values(plane_points))
+
+                f.write('interpolation %s\n' % interpolations[cmds.getAttr(lattice + '.' + INTERPOLATION_ATTR)])
+                f.write('recursion %d\n' % cmds.getAttr(lattice + '.' + MAX_BEZIER_RECURSION_ATTR))
+                f.write('gateOffset %.17g\n' % cmds.getAttr(lattice + '.' + GATE_OFFSET_ATTR))
+                f.write('envelope %.17g\n' % float(cmds.getAttr(lattice + '.' + LATTICE_ACTIVE_ATTR)))
+
+                influencers = _get_all_influencers(lattice)
+                if not influencers:
+                    f.write('noInfluencers\n')
+                for influencer in influencers:
+                    f.write('influencer %.17g %s\n' % (cmds.getAttr(influencer + '.falloff'),
+                                                       _format_values(cmds.getAttr(influencer + '.worldMatrix[0]'))))
+    finally:
+        cmds.currentTime(current_time)
+
 
 ##########################
 ######GUI#################
@@ -565,6 +753,37 @@ class CameraLatticeControlsWidget(QtWidgets.QWidget):
         
         return container
     
+    def _build_stacked_lattices_widget(self):
+        container = QtWidgets.QWidget()
+        h_layout = _build_layout(True)
+        container.setLayout(h_layout)
+        
+        self._stacked_tree = QtWidgets.QTreeWidget()
+        self._stacked_tree.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
+        self._stacked_tree.header().close()
+        h_layout.addWidget(self._stacked_tree)
+        
+        v_layout = _build_layout(False)
+        h_layout.addLayout(v_layout)
+        
+        self._stack_lattice_button = QtWidgets.QPushButton()
+        self._stack_lattice_button.setFixedSize(40, 40)
+        self._stack_lattice_button.setIcon(QtGui.QIcon(_get_icons_path() + 'addLattice.png'))
+        self._stack_lattice_button.setIconSize(QtCore.QSize(40, 40))
+        self._stack_lattice_button.setToolTip('Add selected camera lattice to the stack of this lattice')
+        
+        self._unstack_lattice_button = QtWidgets.QPushButton()
+        self._unstack_lattice_button.setFixedSize(40, 40)
+        self._unstack_lattice_button.setIcon(QtGui.QIcon(_get_icons_path() + 'deleteLattice.png'))
+        self._unstack_lattice_button.setIconSize(QtCore.QSize(40, 40))
+        self._unstack_lattice_button.setToolTip('Remove camera lattice from the stack of this lattice')
+        
+        v_layout.addWidget(self._stack_lattice_button)
+        v_layout.addWidget(self._unstack_lattice_button)
+        v_layout.addWidget(QtWidgets.QWidget(), stretch=1)
+        
+        return container
+    
     
     def _create_widgets(self):
         _active_parent = QtWidgets.QWidget()
@@ -585,6 +804,8 @@ class CameraLatticeControlsWidget(QtWidgets.QWidget):
         self._interpolation = QtWidgets.QComboBox()
         self._interpolation.addItem("Linear")
         self._interpolation.addItem("Bezier")
+        self._interpolation.addItem("BSpline")
+        self._interpolation.addItem("Catmull-Rom")
         self._main_layout.addWidget(LineWidget("Interpolation:", self._interpolation))
         
         self._max_bezier_recursion = QtWidgets.QSpinBox()
@@ -594,6 +815,7 @@ class CameraLatticeControlsWidget(QtWidgets.QWidget):
         tab_widget = QtWidgets.QTabWidget()
         tab_widget.addTab(self._build_affected_object_widget(), "Affected Objects")
         tab_widget.addTab(self._build_influece_areas_widget(), "Influence Areas")
+        tab_widget.addTab(self._build_stacked_lattices_widget(), "Stacked Lattices")
         
         self._main_layout.addWidget(tab_widget)
         
@@ -647,6 +869,7 @@ class CameraLatticeControlsWidget(QtWidgets.QWidget):
         
         self._objects_tree.itemClicked.connect(self._objects_selection_changed)
         self._influences_tree.itemClicked.connect(self._influences_selection_changed)
+        self._stacked_tree.itemClicked.connect(self._stacked_selection_changed)
         self._interpolation.currentIndexChanged.connect(self._interpolation_changed)
         
         self._max_bezier_recursion.valueChanged.connect(self._max_bezier_recursion_changed)
@@ -659,6 +882,9 @@ class CameraLatticeControlsWidget(QtWidgets.QWidget):
         self._add_influencer_button.clicked.connect(self._add_influencer_button_clicked)
         self._remove_influencer_button.clicked.connect(self._remove_influencer_button_clicked)
         
+        self._stack_lattice_button.clicked.connect(self._stack_lattice_button_clicked)
+        self._unstack_lattice_button.clicked.connect(self._unstack_lattice_button_clicked)
+        
         self._select_all_points_button.clicked.connect(self._select_all_points_button_clicked)
         self._select_all_edited_points_button.clicked.connect(self._select_all_edited_points_button_clicked)
         self._select_all_animated_points_button.clicked.connect(self._select_all_animated_points_button_clicked)
@@ -770,13 +996,14 @@ class CameraLatticeControlsWidget(QtWidgets.QWidget):
         nodes = []
         for item in items:
             index = self._objects_tree.indexFromItem(item)
-            nodes.append(item.camera_lattice_deformer_node)
+            nodes.append((item.camera_lattice_deformer_node, item.object_full_path))
             self._objects_tree.takeTopLevelItem(index.row())
         
         if nodes:
             cmds.undoInfo(openChunk=True, chunkName='tcRemoveObjectFromCameraLattice')
             try:
-                cmds.delete(nodes)
+                for deformer, object in nodes:
+                    _remove_camera_lattice(deformer, object)
             except:
                 traceback.print_exc(file=sys.stdout)
                 
@@ -784,6 +1011,48 @@ class CameraLatticeControlsWidget(QtWidgets.QWidget):
         
         self._remove_object_button.setEnabled(bool(self._objects_tree.selectedItems()))
     
+    def _stack_lattice_button_clicked(self):
+        selection = [s for s in cmds.ls(sl=True, l=True, type="transform") if _is_lattice(s)]
+        if not selection:
+            cmds.warning("Camera Lattice: Please select the camera lattices to stack on this lattice.")
+            return
+        
+        if not _get_shared_deformer(self._lattice):
+            cmds.warning("Camera Lattice: Add objects to this lattice before stacking other lattices on it.")
+            return
+        
+        stacked = get_stacked_lattices(self._lattice)
+        cmds.undoInfo(openChunk=True, chunkName='tcStackCameraLattice')
+        try:
+            for s in selection:
+                if s == self._lattice or s in stacked:
+                    continue
+                
+                stack_camera_lattice(self._lattice, s)
+                self._stacked_tree.addTopLevelItem(self._create_stacked_tree_item(s))
+        except:
+            traceback.print_exc(file=sys.stdout)
+        cmds.undoInfo(closeChunk=True)
+    
+    def _unstack_lattice_button_clicked(self):
+        items = self._stacked_tree.selectedItems()
+        lattices = []
+        for item in items:
+            index = self._stacked_tree.indexFromItem(item)
+            lattices.append(item.lattice)
+            self._stacked_tree.takeTopLevelItem(index.row())
+        
+        if lattices:
+            cmds.undoInfo(openChunk=True, chunkName='tcUnstackCameraLattice')
+            try:
+                for lattice in lattices:
+                    unstack_camera_lattice(self._lattice, lattice)
+            except:
+                traceback.print_exc(file=sys.stdout)
+            cmds.undoInfo(closeChunk=True)
+        
+        self._unstack_lattice_button.setEnabled(bool(self._stacked_tree.selectedItems()))
+    
     def _select_all_points_button_clicked(self):
         sD, tD = self._get_lattice_divisions()
         
@@ -993,6 +1262,9 @@ class CameraLatticeControlsWidget(QtWidgets.QWidget):
     
     def clear_influence_tree(self):
         self._influences_tree.clear()
+    
+    def clear_stacked_tree(self):
+        self._stacked_tree.clear()
         
     def _objects_selection_changed(self):
         items = self._objects_tree.selectedItems()
@@ -1007,11 +1279,15 @@ class CameraLatticeControlsWidget(QtWidgets.QWidget):
         
         objs = [i.influencer for i in items] 
         cmds.select(objs, r=True)
+    
+    def _stacked_selection_changed(self):
+        items = self._stacked_tree.selectedItems()
+        self._unstack_lattice_button.setEnabled(bool(items))
         
     def _interpolation_changed(self):
         self._interpolation_changed_from_GUI = True
         cmds.setAttr(self._lattice + '.' + INTERPOLATION_ATTR, self._interpolation.currentIndex())
-        self._max_bezier_recursion_lined_widget.setVisible(self._interpolation.currentIndex() == 1)
+        self._max_bezier_recursion_lined_widget.setVisible(self._interpolation.currentIndex() == INTERPOLATION_BEZIER)
         
     def _max_bezier_recursion_changed(self):
         self._max_bezier_recursion_changed_from_GUI = True
@@ -1033,6 +1309,14 @@ class CameraLatticeControlsWidget(QtWidgets.QWidget):
         item.setToolTip(0, influencer)
         item.influencer = influencer
         return item
+    
+    def _create_stacked_tree_item(self, lattice):
+        item = CameraLatticeTreeWidgetItem()
+        item.setFlags(QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable)
+        item.setText(0, lattice.split('|')[-1])
+        item.setToolTip(0, lattice)
+        item.lattice = lattice
+        return item
         
     def set_lattice(self, lattice):
         self._lattice = lattice
@@ -1045,6 +1329,7 @@ class CameraLatticeControlsWidget(QtWidgets.QWidget):
         self._off_button.setChecked(not active)
         
         #set interpolation value
+        _update_interpolation_enum(lattice)
         interpolation = cmds.getAttr(lattice + '.' + INTERPOLATION_ATTR)
         self._interpolation.setCurrentIndex(interpolation)
         
@@ -1056,17 +1341,18 @@ class CameraLatticeControlsWidget(QtWidgets.QWidget):
         self._max_bezier_recursion.setMaximum(int(max[0]))
         self._max_bezier_recursion.setMinimum(int(min[0]))
         
-        self._max_bezier_recursion_lined_widget.setVisible(interpolation == 1)
+        self._max_bezier_recursion_lined_widget.setVisible(interpolation == INTERPOLATION_BEZIER)
         
         self._refresh_object_tree()
         self._refresh_influence_tree()
+        self._refresh_stacked_tree()
         
     def _refresh_object_tree(self):
         self.clear_object_tree()
         #populate tree
         objects = _get_all_affected_objects(self._lattice)
-        for key, value in objects.iteritems():
-            item = self._create_object_tree_item(key, value)
+        for deformer, object in objects:
+            item = self._create_object_tree_item(deformer, object)
             self._objects_tree.addTopLevelItem(item)
             
         self._remove_object_button.setEnabled(False)
@@ -1080,12 +1366,20 @@ class CameraLatticeControlsWidget(QtWidgets.QWidget):
             self._influences_tree.addTopLevelItem(item)
             
         self._remove_influencer_button.setEnabled(False)
+    
+    def _refresh_stacked_tree(self):
+        self.clear_stacked_tree()
+        
+        for lattice in get_stacked_lattices(self._lattice):
+            self._stacked_tree.addTopLevelItem(self._create_stacked_tree_item(lattice))
+        
+        self._unstack_lattice_button.setEnabled(False)
         
     def _interpolation_changed_from_maya(self):
         if not self._interpolation_changed_from_GUI:
             interpolation = cmds.getAttr(self._lattice + '.' + INTERPOLATION_ATTR)
             self._interpolation.setCurrentIndex(interpolation)
-            self._max_bezier_recursion_lined_widget.setVisible(interpolation == 1)
+            self._max_bezier_recursion_lined_widget.setVisible(interpolation == INTERPOLATION_BEZIER)
         self._interpolation_changed_from_GUI = False
         
     def _max_bezier_recursion_changed_from_maya(self):
@@ -1112,6 +1406,9 @@ class CameraLatticeControlsWidget(QtWidgets.QWidget):
         if str(name) in ['tcDeleteCameraLattice', 'tcAddInfluenceAreaToCameraLattice', 'tcRemoveInfluenceAreaFromCameraLattice',
                          'tcCreateInfluenceAreaToCameraLattice']:
             self._refresh_influence_tree()
+        if str(name) in ['tcDeleteCameraLattice', 'tcAddObjectToCameraLattice', 'tcRemoveObjectFromCameraLattice',
+                         'tcStackCameraLattice', 'tcUnstackCameraLattice']:
+            self._refresh_stacked_tree()
         
     def redo_triggered(self):
         if not self._lattice:
@@ -1122,6 +1419,9 @@ class CameraLatticeControlsWidget(QtWidgets.QWidget):
         if str(name) in ['tcDeleteCameraLattice', 'tcAddInfluenceAreaToCameraLattice', 'tcRemoveInfluenceAreaFromCameraLattice',
                          'tcCreateInfluenceAreaToCameraLattice']:
             self._refresh_influence_tree()
+        if str(name) in ['tcDeleteCameraLattice', 'tcAddObjectToCameraLattice', 'tcRemoveObjectFromCameraLattice',
+                         'tcStackCameraLattice', 'tcUnstackCameraLattice']:
+            self._refresh_stacked_tree()
         
     def kill_script_jobs(self):
         for id in self._script_jobs:
@@ -11,6 +11,10 @@
 #include "cameraLattice.h"
 #include "cameraLatticeTranslator.h"
 #include "cameraLatticeInfluenceLocator.h"
+#include "cameraLatticeEvaluator.h"
+#include "cameraLatticeCache.h"
+#include "cameraLatticeSubframes.h"
+#include "cameraLatticeStats.h"
 
 extern "C" { FILE __iob_func[3] = { *stdin,*stdout,*stderr }; }
 
@@ -27,6 +31,15 @@ MStatus initializePlugin( MObject obj )
 	int count = 1;
 	const char *ver = "1.0";  
 
+    CameraLattice::profilerCategory = MProfiler::addCategory("tcCameraLattice", "Camera lattice deformation");
+    
+	status = plugin.registerData( CompiledLatticeData::typeName, CompiledLatticeData::id, CompiledLatticeData::creator );
+    if(!status)
+	{
+		MGlobal::displayError("tcCompiledLatticeData failed registration");
+		return status;
+	}
+    
 	status = plugin.registerNode( "tcCameraLatticeDeformer", CameraLattice::id, CameraLattice::creator, CameraLattice::initialize, MPxNode::kDeformerNode );
     if(!status)
 	{
@@ -34,6 +47,17 @@ MStatus initializePlugin( MObject obj )
 		return status;
 	}
     
+    //the deformer weights can be painted with the paint attributes tool
+    MGlobal::executeCommand("makePaintable -attrType multiFloat -sm deformer tcCameraLatticeDeformer weights;");
+    
+    status = plugin.registerNode( "tcCameraLatticeEvaluator", CameraLatticeEvaluator::id, CameraLatticeEvaluator::creator,
+                                 CameraLatticeEvaluator::initialize);
+    if(!status)
+	{
+		MGlobal::displayError("tcCameraLatticeEvaluator failed registration");
+		return status;
+	}
+    
     status = plugin.registerNode( "tcCameraLatticeTranslator", CameraLatticeTranslator::id, CameraLatticeTranslator::creator,
                                  CameraLatticeTranslator::initialize);
     if(!status)
@@ -53,6 +77,30 @@ MStatus initializePlugin( MObject obj )
 		return status;
 	}
     
+    status = plugin.registerCommand( CameraLatticeBakeCommand::commandName, CameraLatticeBakeCommand::creator,
+                                    CameraLatticeBakeCommand::newSyntax );
+    if(!status)
+	{
+		MGlobal::displayError("tcCameraLatticeBake failed registration");
+		return status;
+	}
+    
+    status = plugin.registerCommand( CameraLatticeSubframesCommand::commandName, CameraLatticeSubframesCommand::creator,
+                                    CameraLatticeSubframesCommand::newSyntax );
+    if(!status)
+	{
+		MGlobal::displayError("tcCameraLatticeSubframes failed registration");
+		return status;
+	}
+    
+    status = plugin.registerCommand( CameraLatticeStatsCommand::commandName, CameraLatticeStatsCommand::creator,
+                                    CameraLatticeStatsCommand::newSyntax );
+    if(!status)
+	{
+		MGlobal::displayError("tcCameraLatticeStats failed registration");
+		return status;
+	}
+    
     status = MHWRender::MDrawRegistry::registerDrawOverrideCreator(
                                                                    CameraLatticeInfluenceLocator::drawDbClassification,
                                                                    CameraLatticeInfluenceLocator::drawRegistrantId,
@@ -175,6 +223,29 @@ MStatus uninitializePlugin( MObject obj)
 {
 	MStatus status = MStatus::kSuccess;
 	MFnPlugin plugin( obj );
+    MGlobal::executeCommand("makePaintable -remove tcCameraLatticeDeformer weights;");
+    
+	status = plugin.deregisterCommand( CameraLatticeBakeCommand::commandName );
+    if (!status)
+	{
+		MGlobal::displayError("Error deregistering command tcCameraLatticeBake");
+		return status;
+	}
+    
+	status = plugin.deregisterCommand( CameraLatticeSubframesCommand::commandName );
+    if (!status)
+	{
+		MGlobal::displayError("Error deregistering command tcCameraLatticeSubframes");
+		return status;
+	}
+    
+	status = plugin.deregisterCommand( CameraLatticeStatsCommand::commandName );
+    if (!status)
+	{
+		MGlobal::displayError("Error deregistering command tcCameraLatticeStats");
+		return status;
+	}
+    
 	status = plugin.deregisterNode( CameraLattice::id );
     if (!status)
 	{
@@ -182,6 +253,13 @@ MStatus uninitializePlugin( MObject obj)
 		return status;
 	}
     
+    status = plugin.deregisterNode( CameraLatticeEvaluator::id );
+    if (!status)
+	{
+		MGlobal::displayError("Error deregistering node tcCameraLatticeEvaluator");
+		return status;
+	}
+    
     status = plugin.deregisterNode( CameraLatticeTranslator::id );
     if (!status)
 	{
@@ -203,6 +281,14 @@ MStatus uninitializePlugin( MObject obj)
 		return status;
 	}
     
+    status = plugin.deregisterData( CompiledLatticeData::id );
+    if (!status)
+	{
+		MGlobal::displayError("Error deregistering data tcCompiledLatticeData");
+		return status;
+	}
+    
+    MProfiler::removeCategory("tcCameraLattice");
     
 	return status;
 }
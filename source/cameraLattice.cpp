@@ -11,6 +11,13 @@
 #include <maya/MFnMatrixAttribute.h>
 #include <maya/MFnTypedAttribute.h>
 #include <maya/MFnEnumAttribute.h>
+#include <maya/MFnCompoundAttribute.h>
+#include <maya/MFnUnitAttribute.h>
+#include <maya/MFnStringData.h>
+#include <maya/MFnPluginData.h>
+#include <maya/MDGContext.h>
+#include <maya/MDGContextGuard.h>
+#include <maya/MIntArray.h>
 #include <maya/MFnMeshData.h>
 #include <maya/MFnData.h>
 #include <maya/MFnMatrixData.h>
@@ -37,211 +44,374 @@
 #include <maya/MDagModifier.h>
 
 #include "cameraLattice.h"
+#include "cameraLatticeEvaluator.h"
+#include "cameraLatticeCache.h"
 
+void toPoint3Array(const MPointArray &points, std::vector<Point3> &result)
+{
+    result.resize(points.length());
+    for (unsigned int i = 0; i < points.length(); i++)
+        result[i] = toPoint3(points[i]);
+}
 
-double fac(int n)
+void PaintedWeights::compile(const std::vector<float> &componentWeights, const std::vector<int> &componentIndices)
 {
-	if (n == 0 || n == 1)
-		return 1;
-	else
-		return n * fac(n-1) ;
+    size_t numPoints = componentIndices.size();
+    weights.resize(numPoints);
+    activeVertices.clear();
+    painted = false;
+    
+    for (size_t i = 0; i < numPoints; i++)
+    {
+        size_t component = size_t(componentIndices[i]);
+        float weight = component < componentWeights.size() ? componentWeights[component] : 1.0f;
+        weights[i] = weight;
+        painted = painted || weight != 1.0f;
+        if (weight >= 0.00001f)
+            activeVertices.push_back((unsigned int)i);
+    }
+    
+    //unpainted geometries run the kernels as if there were no weights
+    if (!painted)
+    {
+        std::vector<float>().swap(weights);
+        std::vector<unsigned int>().swap(activeVertices);
+    }
+    valid = true;
 }
 
-double C(int i, int l)
+/**********************************************************
+ RESULT CACHE
+ **********************************************************/
+
+void ResultCache::setBudget(size_t budget)
 {
-	return fac(l) / (fac(i) * fac(l - i));
+    this->budget = budget;
+    if (budget == 0)
+        clear();
+    else
+        evict(budget);
 }
 
-double B(int i, int l, double s)
+bool CachedResult::matches(const PointBuffer &input) const
 {
-	return C(i, l) * pow(s,i) * pow(1-s,l-i);
+    if (input.raw)
+        return inputRaw.size() == 3 * size_t(input.length()) &&
+               (inputRaw.empty() || memcmp(&inputRaw[0], input.raw, sizeof(float) * inputRaw.size()) == 0);
+    
+    if (!inputRaw.empty() || inputPoints.length() != input.length())
+        return false;
+    for (unsigned int i = 0; i < input.length(); i++)
+    {
+        const MPoint &a = inputPoints[i], &b = (*input.array)[i];
+        if (a.x != b.x || a.y != b.y || a.z != b.z)
+            return false;
+    }
+    return true;
 }
 
-void findBoundaryCells(const double w, const int D, int &min, int &max)
+const CachedResult *ResultCache::find(unsigned long long key, const PointBuffer &input)
 {
-	double step = 1.0/(D - 1);
-	
-	for (int i = 0; i < D - 1; i++)
-	{
-		double thisStep = step * i;
-		if ((w < thisStep + step) && (w >= thisStep))
-		{
-			min = i;
-			max = i+1;
-			return;
-		}
-	}
-    
-    //in case we are outside the case (LEFT)
-    if (w < 0)
-    {
-        min = 0;
-        max = 1;
-        return;
+    std::map<unsigned long long, std::list<CachedResult>::iterator>::iterator it = index.find(key);
+    //a fingerprint collision, the result belongs to other points
+    if (it == index.end() || !it->second->matches(input))
+    {
+        misses++;
+        return NULL;
     }
     
-    //in case we are outside the case (RIGHT)
-	if (D > 2)
-		min = D - 2;
-	else
-		min = D - 1;
-	
-	max = D - 1;
+    hits++;
+    entries.splice(entries.begin(), entries, it->second);
+    return &(*it->second);
 }
 
-void findLinearDeformedPoint(MPoint &tempPoint, const MPointArray *planePoints, const float u, const float v, const int sD, const int tD)
+void ResultCache::insert(unsigned long long key, const PointBuffer &input, const PointBuffer &points)
 {
-    int minX, maxX, minY, maxY;
-	findBoundaryCells(u, sD, minX, maxX);
-	findBoundaryCells(v, tD, minY, maxY);
+    //the input points are stored along with the result
+    size_t bytes = 2 * (points.raw ? 3 * sizeof(float) * points.length() : sizeof(MPoint) * points.length());
+    if (bytes > budget)
+        return;
     
-    //Finding projection factor on delimiting edges
-	int factorX = sD - 1;
-	int factorY = tD - 1;
-	float uLocal = (u - float(minX) / factorX) / (float(maxX) / factorX - float(minX) / factorX);
-	float vLocal = (v - float(minY) / factorY) / (float(maxY) / factorY - float(minY) / factorY);
-	
-	//find the edges --- aligned on the Y
-	MPoint p1 = (*planePoints)[minX + minY * sD];
-	MPoint p2 = (*planePoints)[minX + maxY * sD];
-	MPoint p3 = (*planePoints)[maxX + minY * sD];
-	MPoint p4 = (*planePoints)[maxX + maxY * sD];
-	
-	MPoint p21 = (p2 - p1) * vLocal + p1;
-	MPoint p43 = (p4 - p3) * vLocal + p3;
-	
-	//finding the point between the edges -- this is on the X
-	tempPoint = (p43 - p21) * uLocal + p21;
+    std::map<unsigned long long, std::list<CachedResult>::iterator>::iterator it = index.find(key);
+    if (it != index.end())
+    {
+        if (it->second->matches(input))
+            return;
+        erase(it->second);
+    }
+    
+    evict(budget - bytes);
+    
+    entries.push_front(CachedResult());
+    CachedResult &result = entries.front();
+    result.key = key;
+    result.bytes = bytes;
+    if (points.raw)
+    {
+        result.raw.assign(points.raw, points.raw + 3 * size_t(points.length()));
+        result.inputRaw.assign(input.raw, input.raw + 3 * size_t(input.length()));
+    }
+    else
+    {
+        result.points.copy(*points.array);
+        result.inputPoints.copy(*input.array);
+    }
+    
+    index[key] = entries.begin();
+    memory += bytes;
+}
+
+void ResultCache::evict(size_t target)
+{
+    while (memory > target && !entries.empty())
+        erase(--entries.end());
+}
+
+void ResultCache::erase(std::list<CachedResult>::iterator entry)
+{
+    memory -= entry->bytes;
+    index.erase(entry->key);
+    entries.erase(entry);
+}
+
+/**********************************************************
+ STATISTICS
+ **********************************************************/
+
+void EvaluationStats::clear()
+{
+    evaluations = 0;
+    totalTime = 0.0;
+    compileTime = 0.0;
+    influenceTime = 0.0;
+    kernelTime = 0.0;
+    outputTime = 0.0;
+    processed = 0;
+    culled = 0;
+    skipped = 0;
+}
+
+void EvaluationStats::add(const EvaluationStats &other)
+{
+    evaluations += other.evaluations;
+    totalTime += other.totalTime;
+    compileTime += other.compileTime;
+    influenceTime += other.influenceTime;
+    kernelTime += other.kernelTime;
+    outputTime += other.outputTime;
+    processed += other.processed;
+    culled += other.culled;
+    skipped += other.skipped;
 }
 
-void findBezierDeformedPoint(MPoint &tempPoint, const MPointArray *planePoints, const float u, const float v, const int offsetS, const int offsetT, const int finalS, const int finalT, const int sD)
+// the influence weights are evaluated lazily inside the kernels, their share of the kernel time goes to the influence areas
+static void moveInfluenceTime(const KernelCounters &counters, double kernelTime, EvaluationStats &stats)
 {
-	MVector result, temp;
+    double influenceTime = kernelTime * counters.influenceShare();
+    stats.kernelTime -= influenceTime;
+    stats.influenceTime += influenceTime;
+}
+
+// a stage of the deformation, shown in the Maya profiler and timed for tcCameraLatticeStats
+class StageScope
+{
+public:
+    StageScope(const char *name, double &time) :
+        m_scope(CameraLattice::profilerCategory, MProfiler::kColorE_L1, name), m_time(time), m_start(tbb::tick_count::now())
+    {
+    }
+    
+    ~StageScope() { m_time += (tbb::tick_count::now() - m_start).seconds(); };
     
-	for ( unsigned s = 0; s < finalS; s++)
-		for ( unsigned t = 0; t < finalT; t++)
-		{
-            int index = offsetS + s + (offsetT + t) * sD;
-			result += (*planePoints)[index] * B(s, finalS - 1, u) * B(t, finalT - 1, v);
-		}
-	tempPoint = result;
+private:
+    MProfilingScope m_scope;
+    double &m_time;
+    tbb::tick_count m_start;
+};
+
+void ResultCache::clear()
+{
+    entries.clear();
+    index.clear();
+    memory = 0;
 }
 
-double get_influencers_weight(const MPoint &pt, const std::vector<Influencer> *influencers)
+unsigned long long fingerprintEvaluation(unsigned int multiIndex, const CompiledLattice &lattice, int behaviour, const CompiledCamera &camera,
+                                         const Matrix4 &objMat, double envelopeValue, double gateOffsetValue, int precisionValue,
+                                         const std::vector<Influencer> &influencers, const PaintedWeights &paintedWeights,
+                                         const PointBuffer &points)
 {
-    MVector vec;
+    Fingerprint fingerprint;
+    fingerprint.add(int(multiIndex));
+    
+    fingerprintSettings(fingerprint, lattice, behaviour, camera, objMat, envelopeValue, gateOffsetValue, precisionValue,
+                        influencers, paintedWeights.values(), paintedWeights.weights.size());
     
-    double totalWeight = 0.0;
-    for (unsigned int i = 0; i < influencers->size(); ++i)
+    fingerprint.add(int(points.length()));
+    if (points.raw)
+        fingerprint.add(points.raw, 3 * sizeof(float) * points.length());
+    else
     {
-        const Influencer &influencer = (*influencers)[i];
-        vec = pt - influencer.pos;
-        if (vec.length() > influencer.maxAxisLength)
-            continue;
-        
-        vec = pt * (*influencers)[i].invMat;
-
-        double length = vec.length();
-        //the radius of the locator in local space is 1
-        if (length < 1)
+        for (unsigned int i = 0; i < points.length(); i++)
         {
-            if (length <= 0.0001 || influencer.falloff < 0.0001 || length < 1 - influencer.falloff)
-                totalWeight = 1;
-            else
-                totalWeight += 1 - (length - (1 - influencer.falloff)) / influencer.falloff;
+            const MPoint &point = (*points.array)[i];
+            fingerprint.add(point.x);
+            fingerprint.add(point.y);
+            fingerprint.add(point.z);
         }
-        
-        if (totalWeight >= 0.9999)
-            return 1.0;
     }
     
-    return totalWeight;
+    return fingerprint.value();
 }
 
 /**********************************************************
- CAMERA LATTICE DATA CLASS FOR TBB
+ STACKED LATTICES
  **********************************************************/
 
-void CameraLatticeData::operator()( const tbb::blocked_range<size_t>& r ) const
+void StackedLatticeData::operator()( const tbb::blocked_range<size_t>& r ) const
 {
-    for( size_t i=r.begin(); i!=r.end(); ++i )
+    //scratch space for the bezier basis, sized for the largest lattice of the stack
+    int maxD = 0;
+    for (size_t k = 0; k < m_stages->size(); k++)
     {
-        MPoint intialPosition = (*m_data.points)[i];
-        
-        double weight = m_data.envelopeValue;
-        if ((*m_data.influencers).size() != 0)
-            weight = m_data.envelopeValue * get_influencers_weight(intialPosition * (*m_data.toWorldMatrix), m_data.influencers);
-        
-        if (weight < 0.00001)
-            continue;
-        
-        MPoint pt = intialPosition * *m_data.projectionMatrix;
-        
-        double zDepth = -pt[2];
-        
-        if (!m_data.isOrtho)
-            pt = pt / zDepth;
+        const CompiledLattice *lattice = (*m_stages)[k].lattice;
+        maxD = std::max(maxD, std::max(lattice->sD, lattice->tD));
+    }
+    std::vector<double> uBasis(maxD), vBasis(maxD);
+    
+    bool hasInfluencers = !m_influencers->empty();
+    size_t processed = 0, culled = 0, skipped = 0;
+    
+    bool timed = m_counters != NULL;
+    tbb::tick_count rangeStart = timed ? tbb::tick_count::now() : tbb::tick_count();
+    double influenceTime = 0.0;
+    
+    for( size_t n=r.begin(); n!=r.end(); ++n )
+    {
+        size_t i = m_vertexIndices ? m_vertexIndices[n] : n;
+        Point3 initialPosition = m_points.get(i);
+        Point3 point = initialPosition;
+        bool moved = false;
+        bool weighted = false;
         
-        double u = pt.x / m_data.filmHAperture + 0.5;
-        double v = pt.y / m_data.filmVAperture + 0.5;
-
-        double gov = m_data.gateOffsetValue;
-        if (u > 1.0 + gov || v > 1.0 + gov || u < 0.0 - gov || v < 0.0 - gov)
-            continue;
+        //the painted weights scale every lattice of the stack
+        double paintedWeight = m_paintedWeights ? m_paintedWeights[i] : 1.0;
         
-        MPoint finalPoint;
-        if (m_data.behaviour == 1)
+        for (size_t k = 0; k < m_stages->size(); k++)
         {
-            // remapping the u and v
-            int minX, maxX, minY, maxY;
-            findBoundaryCells(u, m_data.sD, minX, maxX);
-            findBoundaryCells(v, m_data.tD, minY, maxY);
+            const LatticeStage &stage = (*m_stages)[k];
             
-            minX = minX - m_data.maxRecursion < 0 ? 0 : minX - m_data.maxRecursion;
-            maxX = maxX + m_data.maxRecursion > m_data.sD ? m_data.sD: maxX + m_data.maxRecursion;
-            minY = minY - m_data.maxRecursion < 0 ? 0 : minY - m_data.maxRecursion;
-            maxY = maxY + m_data.maxRecursion > m_data.tD ? m_data.tD: maxY + m_data.maxRecursion;
-            
-            float minSU = float(minX) / (m_data.sD - 1); float maxSU = float(maxX - 1) / (m_data.sD - 1);
-            u = (u - minSU) / (maxSU - minSU);
+            double weight = stage.envelopeValue * paintedWeight;
+            if (stage.useInfluencers && hasInfluencers && weight >= 0.00001)
+            {
+                bool timeWeight = timed && m_weightCache->weights[i] < 0.0f;
+                tbb::tick_count weightStart = timeWeight ? tbb::tick_count::now() : tbb::tick_count();
+                weight *= cachedInfluenceWeight(initialPosition, i, m_weightCache, *m_toWorldMatrix, m_influencers, m_influencerGrid);
+                if (timeWeight)
+                    influenceTime += (tbb::tick_count::now() - weightStart).seconds();
+            }
             
-            double minTU = double(minY) / (m_data.tD - 1); double maxTU = double(maxY - 1) / (m_data.tD - 1);
-            v = (v - minTU) / (maxTU - minTU);
+            if (weight < 0.00001)
+                continue;
             
-            findBezierDeformedPoint(finalPoint, m_data.planePoints, u, v, minX, minY, maxX - minX, maxY - minY, m_data.sD);
+            weighted = true;
+            moved = deformStagePoint(stage, point, weight, &uBasis[0], &vBasis[0]) || moved;
         }
-        else
-            findLinearDeformedPoint(finalPoint, m_data.planePoints, u, v, m_data.sD, m_data.tD);
-        
-        //we map it back to the (-1,1) range
-        finalPoint.x *= m_data.filmHAperture;
-        finalPoint.y *= m_data.filmVAperture;
-        finalPoint.z = pt.z;
-        
-        if (!m_data.isOrtho)
-            finalPoint = finalPoint * zDepth;
         
-        finalPoint *= *m_data.invProjectionMatrix;
-        if (weight > 0.9999)
-            (*m_data.deformedPoints)[i] = finalPoint;
+        if (moved)
+        {
+            m_deformedPoints.set(i, point);
+            processed++;
+        }
+        else if (weighted)
+            culled++;
         else
-            (*m_data.deformedPoints)[i] = intialPosition + (finalPoint - intialPosition) * weight;
-
+            skipped++;
     }
-};
+    
+    if (timed)
+    {
+        m_counters->add(processed, culled, skipped);
+        m_counters->addTime((tbb::tick_count::now() - rangeStart).seconds(), influenceTime);
+    }
+}
 
+/**********************************************************
+ SUBFRAMES
+ **********************************************************/
+
+void SubframeLatticeData::operator()( const tbb::blocked_range<size_t>& r ) const
+{
+    int maxD = 0;
+    for (size_t s = 0; s < m_samples->size(); s++)
+    {
+        const std::vector<LatticeStage> &stages = (*m_samples)[s].stages;
+        for (size_t k = 0; k < stages.size(); k++)
+            maxD = std::max(maxD, std::max(stages[k].lattice->sD, stages[k].lattice->tD));
+    }
+    std::vector<double> uBasis(std::max(maxD, 1)), vBasis(std::max(maxD, 1));
+    
+    //influence weights of the current vertex, for the samples sharing them
+    std::vector<double> weights(m_samples->size(), 1.0);
+    
+    for( size_t i=r.begin(); i!=r.end(); ++i )
+    {
+        for (size_t s = 0; s < m_samples->size(); s++)
+        {
+            const SubframeSample &sample = (*m_samples)[s];
+            Point3 initialPosition = (*m_inputs)[sample.inputIndex].get(i);
+            Point3 point = initialPosition;
+            double paintedWeight = m_paintedWeights ? m_paintedWeights[i] : 1.0;
+            
+            if (sample.influencers.empty() || paintedWeight < 0.00001)
+                weights[s] = 1.0;
+            else if (sample.weightSource >= 0)
+                weights[s] = weights[sample.weightSource];
+            else
+                weights[s] = get_influencers_weight(initialPosition * sample.toWorldMatrix, &sample.influencers, &sample.influencerGrid);
+            
+            for (size_t k = 0; k < sample.stages.size(); k++)
+            {
+                const LatticeStage &stage = sample.stages[k];
+                
+                double weight = stage.envelopeValue * paintedWeight;
+                if (stage.useInfluencers)
+                    weight *= weights[s];
+                
+                if (weight < 0.00001)
+                    continue;
+                
+                deformStagePoint(stage, point, weight, &uBasis[0], &vBasis[0]);
+            }
+            
+            (*m_outputs)[s].set(i, point);
+        }
+    }
+}
 
 /**********************************************************
  CAMERA LATTICE DEFORMER
  **********************************************************/
 
 MTypeId     CameraLattice::id( 0x00122C01 );
+int         CameraLattice::profilerCategory = 0;
 
 // local attributes
 //
 MObject 	CameraLattice::inputLattice;
 MObject		CameraLattice::interpolation;
 MObject     CameraLattice::objectMatrix;
+MObject     CameraLattice::objectMatrices;
+MObject     CameraLattice::geometryMessage;
+MObject     CameraLattice::inCompiledLattice;
+MObject     CameraLattice::stackedLattice;
+MObject     CameraLattice::resultCacheBudget;
+MObject     CameraLattice::resultCacheHits;
+MObject     CameraLattice::resultCacheMisses;
+MObject     CameraLattice::resultCacheMemory;
+MObject     CameraLattice::stackedCompiledLattice;
+MObject     CameraLattice::stackedEnvelope;
+MObject     CameraLattice::stackedGateOffset;
 MObject     CameraLattice::deformerMessage;
 MObject     CameraLattice::latticeToDeformerMessage;
 MObject     CameraLattice::sSubidivision;
@@ -256,15 +426,29 @@ MObject     CameraLattice::maxBezierRecursion;
 MObject     CameraLattice::influenceFalloff;
 MObject     CameraLattice::influenceMatrix;
 MObject     CameraLattice::gateOffset;
+MObject     CameraLattice::precision;
+MObject     CameraLattice::maxThreads;
+MObject     CameraLattice::cacheMode;
+MObject     CameraLattice::cacheFile;
+MObject     CameraLattice::cacheTime;
 
 
 CameraLattice::CameraLattice()
 {
-    refreshLogicalIndex = true;
-    cachedLogicalIndex.clear();
+    refreshCompiledLattice = true;
+    refreshInfluencers = true;
+    refreshCamera = true;
+    sharedCameraVersion = 0;
+    
+    arenaThreads = -1;
+    
+    pendingGeneration = 0;
+    evaluationGeneration = 0;
 }
 
-CameraLattice::~CameraLattice() {}
+CameraLattice::~CameraLattice()
+{
+}
 
 void* CameraLattice::creator()
 {
@@ -277,6 +461,10 @@ MStatus CameraLattice::initialize()
     deformerMessage = msgAttr.create("deformerMessage", "dm");
     latticeToDeformerMessage = msgAttr.create("ldMessage", "ldm");
     
+    //one element per geometry when a single deformer drives all the objects of a lattice
+    geometryMessage = msgAttr.create("geometryMessage", "gm");
+    msgAttr.setArray(true);
+    
 	MFnTypedAttribute tAttr;
 	inputLattice = tAttr.create( "inputLattice", "il", MFnMeshData::kMesh );
 	tAttr.setStorable( false );
@@ -286,6 +474,11 @@ MStatus CameraLattice::initialize()
 	objectMatrix = mAttr.create( "objectMatrix", "om");
 	mAttr.setHidden( true );
     
+    //indexed by the geometry index, the single object matrix is used for the geometries without an element
+    objectMatrices = mAttr.create( "objectMatrices", "oms");
+	mAttr.setHidden( true );
+    mAttr.setArray( true );
+    
 	cameraMatrix = mAttr.create( "cameraMatrix", "cm");
 	mAttr.setHidden( true );
     
@@ -310,6 +503,77 @@ MStatus CameraLattice::initialize()
 	interpolation = enumAttr.create("interpolation", "i", 0);
 	enumAttr.addField("Linear", 0);
 	enumAttr.addField("Bezier", 1);
+	enumAttr.addField("BSpline", 2);
+	enumAttr.addField("CatmullRom", 3);
+    
+    precision = enumAttr.create("precision", "prc", kDoublePrecision);
+    enumAttr.addField("Double", kDoublePrecision);
+    enumAttr.addField("Float", kFloatPrecision);
+    
+    //0 uses all the available threads
+    maxThreads = nAttr.create( "maxThreads", "mxt", MFnNumericData::kLong);
+    nAttr.setWritable(true);
+	nAttr.setDefault(0);
+    nAttr.setMin(0);
+    
+    //lattice and camera compiled by the lattice evaluator, when connected the attributes above are ignored
+    inCompiledLattice = tAttr.create("inCompiledLattice", "icl", CompiledLatticeData::id);
+	tAttr.setStorable( false );
+	tAttr.setHidden( true );
+    
+    //further lattices applied after this one in the same pass over the vertices
+    stackedCompiledLattice = tAttr.create("stackedCompiledLattice", "stcl", CompiledLatticeData::id);
+	tAttr.setStorable( false );
+	tAttr.setHidden( true );
+    
+    stackedEnvelope = nAttr.create( "stackedEnvelope", "ste", MFnNumericData::kFloat);
+	nAttr.setDefault(1.0);
+    
+    stackedGateOffset = nAttr.create( "stackedGateOffset", "stgo", MFnNumericData::kDouble);
+  	nAttr.setDefault(0.05);
+    nAttr.setMin(0);
+    nAttr.setMax(1);
+    
+    MFnCompoundAttribute cAttr;
+    stackedLattice = cAttr.create("stackedLattice", "stl");
+    cAttr.addChild(stackedCompiledLattice);
+    cAttr.addChild(stackedEnvelope);
+    cAttr.addChild(stackedGateOffset);
+    cAttr.setArray(true);
+    
+    //memory in MB for the results of previous evaluations, 0 disables the cache
+    resultCacheBudget = nAttr.create( "resultCacheBudget", "rcb", MFnNumericData::kDouble);
+	nAttr.setDefault(0.0);
+    nAttr.setMin(0);
+    
+    //cache statistics, read through getInternalValue
+    //doubles, the counts outgrow an int over a long session
+    resultCacheHits = nAttr.create( "resultCacheHits", "rch", MFnNumericData::kDouble);
+    nAttr.setWritable(false);
+    nAttr.setStorable(false);
+    nAttr.setInternal(true);
+    
+    resultCacheMisses = nAttr.create( "resultCacheMisses", "rcm", MFnNumericData::kDouble);
+    nAttr.setWritable(false);
+    nAttr.setStorable(false);
+    nAttr.setInternal(true);
+    
+    resultCacheMemory = nAttr.create( "resultCacheMemory", "rcmm", MFnNumericData::kDouble);
+    nAttr.setWritable(false);
+    nAttr.setStorable(false);
+    nAttr.setInternal(true);
+    
+    //in playback the deformation is read from a file baked by tcCameraLatticeBake and the lattice is not evaluated
+    cacheMode = enumAttr.create("cacheMode", "cmo", kCacheOff);
+    enumAttr.addField("Off", kCacheOff);
+    enumAttr.addField("Playback", kCachePlayback);
+    
+    MFnStringData stringData;
+    cacheFile = tAttr.create("cacheFile", "cf", MFnData::kString, stringData.create(""));
+    tAttr.setUsedAsFilename(true);
+    
+    MFnUnitAttribute uAttr;
+    cacheTime = uAttr.create("cacheTime", "ctm", MFnUnitAttribute::kTime, 0.0);
     
     gateOffset = nAttr.create( "gateOffset", "go", MFnNumericData::kDouble);
   	nAttr.setDefault(0.05);
@@ -338,9 +602,11 @@ MStatus CameraLattice::initialize()
 
 	//  deformation attributes
     addAttribute(deformerMessage);
+    addAttribute(geometryMessage);
     addAttribute(latticeToDeformerMessage);
 	addAttribute(inputLattice);
 	addAttribute(objectMatrix);
+    addAttribute(objectMatrices);
     addAttribute(cameraMatrix);
     addAttribute(sSubidivision);
     addAttribute(tSubidivision);
@@ -354,9 +620,21 @@ MStatus CameraLattice::initialize()
     addAttribute(influenceMatrix);
     addAttribute(influenceFalloff);
     addAttribute(gateOffset);
+    addAttribute(precision);
+    addAttribute(maxThreads);
+    addAttribute(inCompiledLattice);
+    addAttribute(stackedLattice);
+    addAttribute(resultCacheBudget);
+    addAttribute(resultCacheHits);
+    addAttribute(resultCacheMisses);
+    addAttribute(resultCacheMemory);
+    addAttribute(cacheMode);
+    addAttribute(cacheFile);
+    addAttribute(cacheTime);
 	
 	attributeAffects(inputLattice, CameraLattice::outputGeom);
     attributeAffects(objectMatrix, CameraLattice::outputGeom);
+    attributeAffects(objectMatrices, CameraLattice::outputGeom);
     attributeAffects(cameraMatrix, CameraLattice::outputGeom);
 	attributeAffects(interpolation, CameraLattice::outputGeom);
     attributeAffects(inOrtho, CameraLattice::outputGeom);
@@ -368,10 +646,93 @@ MStatus CameraLattice::initialize()
     attributeAffects(CameraLattice::influenceMatrix, CameraLattice::outputGeom);
     attributeAffects(CameraLattice::influenceFalloff, CameraLattice::outputGeom);
     attributeAffects(CameraLattice::gateOffset, CameraLattice::outputGeom);
+    attributeAffects(CameraLattice::precision, CameraLattice::outputGeom);
+    attributeAffects(CameraLattice::inCompiledLattice, CameraLattice::outputGeom);
+    attributeAffects(CameraLattice::stackedLattice, CameraLattice::outputGeom);
+    attributeAffects(CameraLattice::cacheMode, CameraLattice::outputGeom);
+    attributeAffects(CameraLattice::cacheFile, CameraLattice::outputGeom);
+    attributeAffects(CameraLattice::cacheTime, CameraLattice::outputGeom);
 
 	return MStatus::kSuccess;
 }
 
+void CameraLattice::readInfluencers(MDataBlock& block, std::vector<Influencer> &result)
+{
+    result.clear();
+    MArrayDataHandle iFalloffArrayHandle = block.inputArrayValue(influenceFalloff);
+    MArrayDataHandle iMatrixArrayHandle = block.inputArrayValue(influenceMatrix);
+    int count = iFalloffArrayHandle.elementCount();
+    if (count != iMatrixArrayHandle.elementCount())
+    {
+        warnOnce("influences", "tcCameraLatticeDeformer: something is wrong with your influence area connection. Ignoring influence areas.");
+        return;
+    }
+    
+    //only the connected elements, kept up to date by connectionMade and connectionBroken
+    result.reserve(connectedInfluences.size());
+    std::set<unsigned int>::const_iterator it;
+    for (it = connectedInfluences.begin(); it != connectedInfluences.end(); ++it)
+    {
+        if (iFalloffArrayHandle.jumpToElement(*it) != MS::kSuccess || iMatrixArrayHandle.jumpToElement(*it) != MS::kSuccess)
+            continue;
+        
+        Influencer influencer;
+        influencer.set(toMatrix4(iMatrixArrayHandle.inputValue().asMatrix()), iFalloffArrayHandle.inputValue().asDouble());
+        result.push_back(influencer);
+    }
+}
+
+void CameraLattice::warnOnce(const std::string &key, const MString &message)
+{
+    {
+        tbb::spin_mutex::scoped_lock lock(warningMutex);
+        if (!reportedWarnings.insert(key).second)
+            return;
+    }
+    
+    //displayWarning is not safe from the evaluation threads, the command is queued for the main thread instead
+    std::string text;
+    for (const char *c = message.asChar(); *c; c++)
+    {
+        if (*c == '"' || *c == '\\')
+            text += '\\';
+        text += *c;
+    }
+    MGlobal::executeCommandOnIdle(MString("warning \"") + text.c_str() + "\"", false);
+}
+
+void CameraLattice::addStats(const EvaluationStats &stats, unsigned int multiIndex, unsigned int numGeometries, bool isNormal)
+{
+    tbb::spin_mutex::scoped_lock lock(statsMutex);
+    totalStats.add(stats);
+    
+    //evaluations in the background are not the last one of the scene
+    if (!isNormal)
+        return;
+    
+    //the geometries of an evaluation are summed and published once, a geometry evaluated again starts a new one too
+    unsigned long long generation = evaluationGeneration;
+    if (generation != pendingGeneration || pendingGeometries.count(multiIndex))
+    {
+        if (!pendingGeometries.empty())
+            lastStats = pendingStats;
+        pendingStats.clear();
+        pendingGeometries.clear();
+        pendingGeneration = generation;
+    }
+    
+    pendingStats.add(stats);
+    pendingGeometries.insert(multiIndex);
+    if (pendingGeometries.size() >= numGeometries)
+        lastStats = pendingStats;
+}
+
+void CameraLattice::resetWarnings()
+{
+    tbb::spin_mutex::scoped_lock lock(warningMutex);
+    reportedWarnings.clear();
+}
+
 MStatus
 CameraLattice::deform( MDataBlock& block,
 				MItGeometry& iter,
@@ -389,158 +750,1198 @@ CameraLattice::deform( MDataBlock& block,
 //	 multiIndex : the index of the geometry that we are deforming
 //
 //
+{
+    MProfilingScope scope(profilerCategory, MProfiler::kColorE_L1, "deform", name().asChar());
+    
+    EvaluationStats stats;
+    tbb::tick_count start = tbb::tick_count::now();
+    MStatus status = deformGeometry(block, iter, multiIndex, stats);
+    stats.totalTime = (tbb::tick_count::now() - start).seconds();
+    stats.evaluations = 1;
+    
+    MArrayDataHandle outputArray = block.outputArrayValue(outputGeom);
+    addStats(stats, multiIndex, outputArray.elementCount(), block.context().isNormal());
+    
+    return status;
+}
+
+MStatus CameraLattice::deformGeometry(MDataBlock& block, MItGeometry& iter, unsigned int multiIndex, EvaluationStats &stats)
 {
 	MStatus returnStatus;
 	
+    //the baked result already includes the envelope and the stacked lattices
+    if (block.inputValue(cacheMode).asShort() == kCachePlayback)
+    {
+        bool played = false;
+        MStatus status = deformFromCache(block, iter, multiIndex, played);
+        if (played || status != MS::kSuccess)
+            return status;
+    }
+    
+    //the node's caches follow the normal context, evaluations at other times, like the background fill
+    //of cached playback, compile their own data and keep nothing between evaluations
+    bool normalContext = block.context().isNormal();
+    
 	// Envelope data from the base class.
 	// The envelope is simply a scale factor.
 	//
 	MDataHandle envData = block.inputValue(envelope, &returnStatus);
 	if (MS::kSuccess != returnStatus) return returnStatus;
 	float envelopeValue = envData.asFloat();
-	if (envelopeValue < 0.01)	 return returnStatus;
     
-    bool isOrtho = block.inputValue(inOrtho).asBool();
-    double ortographicWidth = block.inputValue(inOrthographicWidth).asDouble();
+    MArrayDataHandle stackedHandle = block.inputArrayValue(stackedLattice);
+    bool hasStackedLattices = stackedHandle.elementCount() > 0;
+	if (envelopeValue < 0.01 && !hasStackedLattices)	 return returnStatus;
     
-    double horizontalAperture = block.inputValue(inHorizontalFilmAperture).asDouble();
-    double verticalAperture = block.inputValue(inVerticalFilmAperture).asDouble();
-    double focalLength = block.inputValue(inFocalLength).asDouble();
     double gateOffsetValue =block.inputValue(gateOffset).asDouble();
     
-    double filmHAperture, filmVAperture;
-    if (isOrtho)
-    {
-        filmHAperture = ortographicWidth;
-        filmVAperture = ortographicWidth;
-    }
-    else
-    {
-        // 0.03937 is the factor mm to inches
-        // 57.29578 is the maya conversion factor
-        double hFov = 57.29578 * 2.0 * atan((0.5 * horizontalAperture) / (focalLength * 0.03937));
-        double vFov = 57.29578 * 2.0 * atan((0.5 * verticalAperture) / (focalLength * 0.03937));
-
-        //PLEASE NOTE: while the projected points which needs to be deformed are in a range (-1, 1),
-        //              but we want it to go between 0 and 1 to find the final deformation, that's the multiplication by 2
-        
-        // 3.14159265/180.f is the conversion to radians
-        filmHAperture = tan((hFov*0.5) * 3.14159265 / 180.f) * 2;
-        filmVAperture = tan((vFov*0.5) * 3.14159265 / 180.f) * 2;
-    }
+    //the lattice and the camera come precompiled from the lattice evaluator when it is connected,
+    //otherwise they are shared by all the geometries of this node and only read again when they change
+    const CompiledLattice *lattice = &compiledLattice;
+    const CompiledCamera *camera = &compiledCamera;
+    CompiledLattice contextLattice;
+    CompiledCamera contextCamera;
+    int behaviour;
     
-    std::vector<Influencer> influencers;
-    MArrayDataHandle iFalloffArrayHandle = block.inputArrayValue(influenceFalloff);
-    MArrayDataHandle iMatrixArrayHandle = block.inputArrayValue(influenceMatrix);
-    int count = iFalloffArrayHandle.elementCount();
-    if (count != iMatrixArrayHandle.elementCount())
-    {
-        MGlobal::displayWarning("tcCameraLatticeDeformer: something is wrong with your influence area connection. Ignoring influence areas.");
-    }
-    else
     {
-
-        if (refreshLogicalIndex)
+        StageScope stageScope("Compile", stats.compileTime);
+        
+        MDataHandle sharedHandle = block.inputValue(inCompiledLattice);
+        const CompiledLatticeData *sharedData = static_cast<const CompiledLatticeData*>(sharedHandle.asPluginData());
+        if (sharedData)
         {
-            //we need to do this here as connectionMade and connectionBroken are called before the connections are made
-            MPlug falloffPlug(thisMObject(), influenceFalloff);
-            unsigned int numConnectedElements = falloffPlug.numConnectedElements();
-            cachedLogicalIndex.clear();
-            for (unsigned int i = 0; i < numConnectedElements; i++)
+            if (normalContext)
             {
-                MPlug tempPlug = falloffPlug.connectionByPhysicalIndex(i);
-                if (tempPlug.isSource()) continue;
-                cachedLogicalIndex.append(tempPlug.logicalIndex());
+                bool cameraChanged = false;
+                {
+                    tbb::spin_mutex::scoped_lock lock(stateMutex);
+                    if (sharedData->cameraVersion != sharedCameraVersion)
+                    {
+                        invalidateProjectionCaches();
+                        sharedCameraVersion = sharedData->cameraVersion;
+                        cameraChanged = true;
+                    }
+                }
+                
+                //the interpolation, the recursion and the camera of the evaluator win over the ones of the deformer
+                int recursionValue = sharedData->lattice->maxRecursion;
+                if (block.inputValue(interpolation).asShort() != sharedData->behaviour ||
+                    (sharedData->behaviour == kBezier && recursionValue >= 0 && block.inputValue(maxBezierRecursion).asInt() != recursionValue))
+                    warnOnce("sharedInterpolation", "tcCameraLatticeDeformer: " + name() + " uses the interpolation and the bezier recursion of its lattice "
+                             "evaluator, its own interpolation and maxBezierRecursion are ignored.");
+                
+                if (cameraChanged)
+                {
+                    MObject node = thisMObject();
+                    if (MPlug(node, cameraMatrix).isConnected() || MPlug(node, inOrtho).isConnected() ||
+                        MPlug(node, inOrthographicWidth).isConnected() || MPlug(node, inFocalLength).isConnected() ||
+                        MPlug(node, inHorizontalFilmAperture).isConnected() || MPlug(node, inVerticalFilmAperture).isConnected())
+                        warnOnce("sharedCamera", "tcCameraLatticeDeformer: " + name() + " uses the camera of its lattice evaluator, "
+                                 "the camera connected to the deformer is ignored.");
+                }
             }
-            
-            refreshLogicalIndex = false;
+        
+            lattice = sharedData->lattice.get();
+            camera = &sharedData->camera;
+            behaviour = sharedData->behaviour;
         }
-
-        if (cachedLogicalIndex.length() > 0)
+        else if (normalContext)
         {
-            influencers.reserve(cachedLogicalIndex.length());
-            MVector vec;
-            for (unsigned int i = 0; i < cachedLogicalIndex.length(); i++)
+            //the first geometry evaluated refreshes the shared data for the others
+            tbb::spin_mutex::scoped_lock lock(stateMutex);
+            if (refreshCamera)
             {
-                iFalloffArrayHandle.jumpToArrayElement(cachedLogicalIndex[i]);
-                iMatrixArrayHandle.jumpToArrayElement(cachedLogicalIndex[i]);
-                
-                Influencer influencer;
-                influencer.falloff = iFalloffArrayHandle.inputValue().asDouble();
-                MMatrix mat = iMatrixArrayHandle.inputValue().asMatrix();
-                influencer.invMat = mat.inverse();
-                
-                influencer.pos.x = mat[3][0];
-                influencer.pos.y = mat[3][1];
-                influencer.pos.z = mat[3][2];
-                
-                vec.x = mat[0][0];
-                vec.y = mat[0][1];
-                vec.z = mat[0][2];
-                influencer.maxAxisLength = vec.length();
-                
-                vec.x = mat[1][0];
-                vec.y = mat[1][1];
-                vec.z = mat[1][2];
-                double thisLength = vec.length();
-                if (thisLength > influencer.maxAxisLength)
-                    influencer.maxAxisLength = thisLength;
-                
-                vec.x = mat[2][0];
-                vec.y = mat[2][1];
-                vec.z = mat[2][2];
-                thisLength = vec.length();
-                if (thisLength > influencer.maxAxisLength)
-                    influencer.maxAxisLength = thisLength;
-                    
-                influencers.push_back(influencer);
+                compileCamera(block, compiledCamera);
+                refreshCamera = false;
+            }
+        
+            if (refreshCompiledLattice)
+            {
+                compileLattice(block, compiledLattice);
+                refreshCompiledLattice = false;
             }
+        
+            behaviour = block.inputValue(interpolation).asShort();
+            compileLatticeMode(block, compiledLattice, behaviour);
+        }
+        else
+        {
+            compileCamera(block, contextCamera);
+            compileLattice(block, contextLattice);
+            behaviour = block.inputValue(interpolation).asShort();
+            compileLatticeMode(block, contextLattice, behaviour);
+        
+            lattice = &contextLattice;
+            camera = &contextCamera;
         }
     }
     
-    
-	int sD = block.inputValue(sSubidivision).asInt();
-    int tD = block.inputValue(tSubidivision).asInt();
-    
-    int maxRecursion = block.inputValue(maxBezierRecursion).asInt();
-    
-    MDataHandle inputLatticeHnd = block.inputValue(inputLattice);
-    MFnMesh planeMesh(inputLatticeHnd.asMesh());
-    MPointArray planePoints;
-    planeMesh.getPoints(planePoints);
-    
-    if (planePoints.length() == 0 || planePoints.length() != sD * tD)
+    if (!camera->valid || !lattice->isValid())
         return MStatus::kFailure;
     
-	int behaviour = block.inputValue(interpolation).asShort();
+    //every interpolation maps a lattice at rest onto the identity
+    if (lattice->isAtRest() && !hasStackedLattices)
+        return MS::kSuccess;
+    
+    bool isOrtho = camera->isOrtho;
+    double filmHAperture = camera->filmHAperture;
+    double filmVAperture = camera->filmVAperture;
     
-    MDataHandle matData = block.inputValue(objectMatrix);
-	MMatrix objMat = matData.asMatrix();
+    std::vector<Influencer> *activeInfluencers = &influencers;
+    InfluencerGrid *activeInfluencerGrid = &influencerGrid;
+    std::vector<Influencer> contextInfluencers;
+    InfluencerGrid contextInfluencerGrid;
+    {
+        StageScope stageScope("Influence areas", stats.influenceTime);
+        
+        if (normalContext)
+        {
+            tbb::spin_mutex::scoped_lock lock(stateMutex);
+            if (refreshInfluencers)
+            {
+                readInfluencers(block, influencers);
+                influencerGrid.build(influencers);
+                refreshInfluencers = false;
+                invalidateWeightCaches();
+            }
+        }
+        else
+        {
+            {
+                tbb::spin_mutex::scoped_lock lock(stateMutex);
+                readInfluencers(block, contextInfluencers);
+            }
+            contextInfluencerGrid.build(contextInfluencers);
+            activeInfluencers = &contextInfluencers;
+            activeInfluencerGrid = &contextInfluencerGrid;
+        }
+    }
     
-    matData = block.inputValue(cameraMatrix);
-	MMatrix camMat = matData.asMatrix();
+    Matrix4 objMat;
+    MArrayDataHandle objectMatricesHandle = block.inputArrayValue(objectMatrices);
+    if (objectMatricesHandle.jumpToElement(multiIndex) == MS::kSuccess)
+        objMat = toMatrix4(objectMatricesHandle.inputValue().asMatrix());
+    else
+        objMat = toMatrix4(block.inputValue(objectMatrix).asMatrix());
     
-    MMatrix projectionMatrix = objMat * camMat.inverse();
-    MMatrix invProjectionMatrix = camMat * objMat.inverse();
-
-    MPointArray points, deformedPoints;
-    iter.allPositions(points);
+    Matrix4 projectionMatrix = objMat * camera->inverseMatrix;
+    Matrix4 invProjectionMatrix = camera->matrix * objMat.inverse();
     
-    deformedPoints.copy(points);
+    ProjectionCache contextProjectionCache;
+    IncrementalState contextState;
+    InfluenceWeightCache contextWeightCache;
+    PaintedWeights contextPaintedWeights;
+    ProjectionCache *projectionCachePtr = &contextProjectionCache;
+    IncrementalState *statePtr = &contextState;
+    InfluenceWeightCache *weightCachePtr = &contextWeightCache;
+    PaintedWeights *paintedWeightsPtr = &contextPaintedWeights;
+    if (normalContext)
+        findGeometryCaches(multiIndex, projectionCachePtr, statePtr, weightCachePtr, paintedWeightsPtr);
+    ProjectionCache &projectionCache = *projectionCachePtr;
+    IncrementalState &state = *statePtr;
+    PaintedWeights &painted = *paintedWeightsPtr;
     
-    CameraLatticeData dataObj(&projectionMatrix, &invProjectionMatrix, &objMat, &points, &deformedPoints, &planePoints, filmHAperture, filmVAperture, sD, tD, isOrtho, maxRecursion, behaviour, &influencers, gateOffsetValue, envelopeValue);
-    tbb::parallel_for(tbb::blocked_range<size_t>(0, points.length()), dataObj);
+    //the whole geometry is outside the gate, the output already holds the input points
+    if (!hasStackedLattices && projectionCache.boundsValid && projectionCache.isOutsideGate(gateOffsetValue))
+    {
+        stats.culled += iter.exactCount();
+        return MS::kSuccess;
+    }
 
-    iter.setAllPositions(deformedPoints);
+    //meshes deformed as a whole are read and written in place through their raw float buffer,
+    //other geometries and partial memberships go through the iterator
     
-	return MS::kSuccess;
-}
-
-MStatus CameraLattice::connectionMade (const MPlug &plug, const MPlug &otherPlug, bool asSrc)
-{
-    if (plug == influenceFalloff || plug == influenceMatrix)
+    MFnMesh outputMesh;
+    float *rawPoints = NULL;
+    MArrayDataHandle outputArray = block.outputArrayValue(outputGeom);
+    if (outputArray.jumpToElement(multiIndex) == MS::kSuccess)
     {
-        refreshLogicalIndex = true;
+        MDataHandle outputHandle = outputArray.outputValue();
+        if (outputHandle.type() == MFnData::kMesh && outputMesh.setObject(outputHandle.asMesh()) == MS::kSuccess &&
+            outputMesh.numVertices() == iter.exactCount())
+            rawPoints = const_cast<float*>(outputMesh.getRawPoints(&returnStatus));
+    }
+    
+    PointBuffer points;
+    if (rawPoints)
+        points = PointBuffer(rawPoints, outputMesh.numVertices());
+    else
+    {
+        iter.allPositions(state.inputPoints);
+        points = PointBuffer(&state.inputPoints);
+    }
+    
+    if (!painted.valid || (painted.painted && painted.weights.size() != points.length()))
+    {
+        //the projections are only filled for the vertices with a weight, newly painted ones have none
+        StageScope stageScope("Painted weights", stats.compileTime);
+        readPaintedWeights(block, multiIndex, iter, painted);
+        projectionCache.valid = false;
+        state.valid = false;
+    }
+    
+    //every vertex is painted out, the output already holds the input points
+    if (painted.painted && painted.activeVertices.empty())
+    {
+        stats.skipped += points.length();
+        return MS::kSuccess;
+    }
+    
+    if (hasStackedLattices)
+    {
+        LatticeStage stage;
+        stage.lattice = lattice;
+        stage.projectionMatrix = projectionMatrix;
+        stage.invProjectionMatrix = invProjectionMatrix;
+        stage.filmHAperture = filmHAperture;
+        stage.filmVAperture = filmVAperture;
+        stage.isOrtho = isOrtho;
+        stage.behaviour = behaviour;
+        stage.gateOffsetValue = gateOffsetValue;
+        stage.envelopeValue = envelopeValue;
+        stage.useInfluencers = true;
+        
+        std::vector<LatticeStage> stages;
+        if (envelopeValue >= 0.01 && !lattice->isAtRest())
+            stages.push_back(stage);
+        
+        Matrix4 invObjMat = objMat.inverse();
+        unsigned int numStacked = stackedHandle.elementCount();
+        for (unsigned int i = 0; i < numStacked; i++)
+        {
+            stackedHandle.jumpToArrayElement(i);
+            MDataHandle elementHandle = stackedHandle.inputValue();
+            const CompiledLatticeData *stackedData = static_cast<const CompiledLatticeData*>(elementHandle.child(stackedCompiledLattice).asPluginData());
+            float stackedEnvelopeValue = elementHandle.child(stackedEnvelope).asFloat();
+            if (!stackedData || stackedEnvelopeValue < 0.01 || !stackedData->camera.valid ||
+                !stackedData->lattice->isValid() || stackedData->lattice->isAtRest())
+                continue;
+            
+            stage.lattice = stackedData->lattice.get();
+            stage.setCamera(stackedData->camera, objMat, invObjMat);
+            stage.behaviour = stackedData->behaviour;
+            stage.gateOffsetValue = elementHandle.child(stackedGateOffset).asDouble();
+            stage.envelopeValue = stackedEnvelopeValue;
+            stage.useInfluencers = false;
+            stages.push_back(stage);
+        }
+        
+        return deformStacked(block, iter, stages, objMat, rawPoints ? &outputMesh : NULL, points, state, projectionCache,
+                             *weightCachePtr, painted, activeInfluencers, activeInfluencerGrid, stats);
+    }
+    
+    if (!projectionCache.boundsValid)
+    {
+        StageScope stageScope("Gate bounds", stats.kernelTime);
+        computeGateBounds(points, projectionMatrix, filmHAperture, filmVAperture, isOrtho, projectionCache);
+        if (projectionCache.isOutsideGate(gateOffsetValue))
+        {
+            stats.culled += points.length();
+            return MS::kSuccess;
+        }
+    }
+    
+    if (projectionCache.u.size() != points.length())
+    {
+        projectionCache.valid = false;
+        projectionCache.u.resize(points.length());
+        projectionCache.v.resize(points.length());
+        projectionCache.cameraZ.resize(points.length());
+    }
+    
+    InfluenceWeightCache &weightCache = *weightCachePtr;
+    prepareWeightCache(weightCache, *activeInfluencers, points.length());
+    
+    int precisionValue = block.inputValue(precision).asShort();
+    int recursionValue = behaviour == kBezier ? lattice->maxRecursion : 0;
+    
+    //identical inputs give identical results, scrubbing over frames already evaluated copies them out of the cache
+    unsigned long long fingerprint = 0;
+    bool useResultCache = false;
+    //the raw points of a mesh are deformed in place, their input is kept for the result cache
+    std::vector<float> resultCacheInput;
+    if (normalContext)
+    {
+        tbb::spin_mutex::scoped_lock lock(resultCacheMutex);
+        resultCache.setBudget(size_t(block.inputValue(resultCacheBudget).asDouble() * 1024.0 * 1024.0));
+        useResultCache = resultCache.budget > 0;
+    }
+    if (useResultCache)
+    {
+        StageScope stageScope("Result cache", stats.outputTime);
+        fingerprint = fingerprintEvaluation(multiIndex, *lattice, behaviour, *camera, objMat, envelopeValue, gateOffsetValue,
+                                            precisionValue, *activeInfluencers, painted, points);
+        
+        //copied out under the lock, another geometry could evict the entry
+        tbb::spin_mutex::scoped_lock lock(resultCacheMutex);
+        const CachedResult *cached = resultCache.find(fingerprint, points);
+        if (cached)
+        {
+            //the previous result is not kept up to date by a cached evaluation
+            state.valid = false;
+            if (rawPoints)
+            {
+                std::copy(cached->raw.begin(), cached->raw.end(), rawPoints);
+                outputMesh.updateSurface();
+            }
+            else
+                iter.setAllPositions(cached->points);
+            return MS::kSuccess;
+        }
+        
+        if (rawPoints)
+            resultCacheInput.assign(rawPoints, rawPoints + 3 * size_t(points.length()));
+    }
+    
+    //when only some lattice points changed since the last evaluation, only the vertices they support are updated
+    bool incremental = projectionCache.valid && lattice->hasChangedPoints &&
+                       state.matches(lattice->version, envelopeValue, gateOffsetValue, behaviour, recursionValue, precisionValue) &&
+                       (rawPoints ? state.rawDeformedPoints.size() == 3 * size_t(points.length()) : state.deformedPoints.length() == points.length());
+    
+    std::vector<unsigned int> vertexIndices;
+    if (incremental)
+    {
+        std::vector<char> changedCells;
+        lattice->findChangedCells(behaviour, changedCells);
+        for (size_t cell = 0; cell < changedCells.size(); cell++)
+        {
+            if (changedCells[cell])
+                vertexIndices.insert(vertexIndices.end(), state.cellVertices.begin() + state.cellStart[cell],
+                                     state.cellVertices.begin() + state.cellStart[cell + 1]);
+        }
+    }
+    
+    //a full evaluation of a mesh writes straight into its buffer, which already holds the input points,
+    //an incremental one updates the previous result which is then copied over
+    PointBuffer deformedPoints;
+    if (rawPoints)
+    {
+        if (incremental)
+            deformedPoints = PointBuffer(&state.rawDeformedPoints[0], points.length());
+        else
+            deformedPoints = points;
+    }
+    else
+    {
+        if (!incremental)
+            state.deformedPoints.copy(state.inputPoints);
+        deformedPoints = PointBuffer(&state.deformedPoints);
+    }
+    
+    //a full evaluation of a painted geometry only visits the vertices with a weight
+    size_t numVertices = points.length();
+    const unsigned int *indices = NULL;
+    if (incremental)
+    {
+        numVertices = vertexIndices.size();
+        indices = vertexIndices.empty() ? NULL : &vertexIndices[0];
+    }
+    else if (painted.painted)
+    {
+        numVertices = painted.activeVertices.size();
+        indices = &painted.activeVertices[0];
+    }
+    
+    int maxThreadsValue = block.inputValue(maxThreads).asInt();
+    size_t grainSize = kernelGrainSize(behaviour);
+    
+    KernelCounters counters;
+    double kernelTime = 0.0;
+    {
+        StageScope stageScope("Kernel", kernelTime);
+        
+        if (precisionValue == kFloatPrecision)
+        {
+            CameraLatticeFloatData dataObj(&projectionMatrix, &invProjectionMatrix, &objMat, points, deformedPoints, lattice, &projectionCache, &weightCache, filmHAperture, filmVAperture, isOrtho, behaviour, activeInfluencers, activeInfluencerGrid, gateOffsetValue, envelopeValue);
+            dataObj.setVertexIndices(indices);
+            dataObj.setPaintedWeights(painted.values());
+            dataObj.setCounters(&counters);
+            runKernel(dataObj, numVertices, std::max(grainSize, size_t(CameraLatticeFloatData::batchSize)), maxThreadsValue);
+        }
+        else
+        {
+            CameraLatticeData dataObj(&projectionMatrix, &invProjectionMatrix, &objMat, points, deformedPoints, lattice, &projectionCache, &weightCache, filmHAperture, filmVAperture, isOrtho, behaviour, activeInfluencers, activeInfluencerGrid, gateOffsetValue, envelopeValue);
+            dataObj.setVertexIndices(indices);
+            dataObj.setPaintedWeights(painted.values());
+            dataObj.setCounters(&counters);
+            runKernel(dataObj, numVertices, grainSize, maxThreadsValue);
+        }
+    }
+    
+    stats.kernelTime += kernelTime;
+    moveInfluenceTime(counters, kernelTime, stats);
+    stats.processed += counters.processed;
+    stats.culled += counters.culled;
+    stats.skipped += counters.skipped;
+    //the vertices painted out are not visited by a full evaluation
+    if (!incremental && painted.painted)
+        stats.skipped += points.length() - painted.activeVertices.size();
+    
+    if (!incremental)
+    {
+        StageScope stageScope("Cell index", stats.kernelTime);
+        projectionCache.valid = true;
+        buildCellIndex(projectionCache, *lattice, gateOffsetValue, painted.values(), state.cellStart, state.cellVertices);
+        
+        state.envelopeValue = envelopeValue;
+        state.gateOffsetValue = gateOffsetValue;
+        state.behaviour = behaviour;
+        state.maxRecursion = recursionValue;
+        state.precision = precisionValue;
+        state.valid = true;
+    }
+    state.latticeVersion = lattice->version;
+    
+    {
+        StageScope stageScope("Output", stats.outputTime);
+        
+        if (rawPoints)
+        {
+            if (incremental)
+                std::copy(state.rawDeformedPoints.begin(), state.rawDeformedPoints.end(), rawPoints);
+            else
+            {
+                //kept for the next incremental evaluation, the buffer is reused across evaluations
+                state.rawDeformedPoints.assign(rawPoints, rawPoints + 3 * size_t(points.length()));
+                state.deformedPoints.clear();
+            }
+            outputMesh.updateSurface();
+        }
+        else
+        {
+            if (!incremental)
+                std::vector<float>().swap(state.rawDeformedPoints);
+            iter.setAllPositions(state.deformedPoints);
+        }
+    
+        if (useResultCache)
+        {
+            tbb::spin_mutex::scoped_lock lock(resultCacheMutex);
+            resultCache.insert(fingerprint, rawPoints ? PointBuffer(&resultCacheInput[0], points.length()) : points,
+                               rawPoints ? PointBuffer(rawPoints, points.length()) : PointBuffer(&state.deformedPoints));
+        }
+    }
+    
+	return MS::kSuccess;
+}
+
+MStatus CameraLattice::deformFromCache(MDataBlock& block, MItGeometry& iter, unsigned int multiIndex, bool &played)
+{
+    played = false;
+    
+    //the reader is replaced, never modified, when the file changes, so this one stays mapped until the end of the evaluation
+    MString fileName = block.inputValue(cacheFile).asString();
+    std::shared_ptr<CacheReader> reader;
+    {
+        tbb::spin_mutex::scoped_lock lock(stateMutex);
+        
+        //the output is not produced by the kernel, the next lattice evaluation starts from scratch.
+        //other contexts, like the background fill of cached playback, keep nothing on the node
+        if (block.context().isNormal())
+            incrementalStates[multiIndex].valid = false;
+        
+        if (fileName != cacheReaderFile || !cacheReader)
+        {
+            cacheReaderFile = fileName;
+            resetWarnings();
+            cacheReader.reset(new CacheReader());
+            if (!cacheReader->open(fileName) && fileName.length() > 0)
+                warnOnce("cacheFile", "tcCameraLatticeDeformer: cannot read the cache file " + fileName + ".");
+        }
+        reader = cacheReader;
+    }
+    
+    //geometries missing from the cache, or times outside the baked range, are deformed by the lattice
+    if (!reader->isOpen())
+        return MS::kSuccess;
+    
+    //subframe times blend the offsets of the two baked frames around them
+    const CacheFrame *frame, *nextFrame;
+    double blend;
+    if (!reader->findFrames(block.inputValue(cacheTime).asTime().as(MTime::kSeconds), multiIndex, frame, nextFrame, blend))
+        return MS::kSuccess;
+    
+    MArrayDataHandle outputArray = block.outputArrayValue(outputGeom);
+    if (outputArray.jumpToElement(multiIndex) != MS::kSuccess)
+        return MS::kSuccess;
+    MDataHandle outputHandle = outputArray.outputValue();
+    
+    //the bake stores the vertices of the whole geometry, the iterator only visits the members of the deformer
+    MFnMesh outputMesh;
+    bool isMesh = outputHandle.type() == MFnData::kMesh && outputMesh.setObject(outputHandle.asMesh()) == MS::kSuccess;
+    unsigned int numVertices;
+    if (isMesh)
+        numVertices = outputMesh.numVertices();
+    else
+    {
+        MItGeometry geometryIter(outputHandle);
+        numVertices = geometryIter.exactCount();
+    }
+    
+    //the geometry changed since the bake, the offsets do not match its vertices any more
+    if (frame->numVertices != numVertices || (nextFrame && nextFrame->numVertices != numVertices))
+    {
+        MString message = "tcCameraLatticeDeformer: the vertex count of geometry ";
+        message += (int)multiIndex;
+        message += " does not match the cache file " + fileName + ", the lattice deforms it instead.";
+        warnOnce("cacheVertices" + std::to_string(multiIndex), message);
+        return MS::kSuccess;
+    }
+    
+    if (isMesh && numVertices == (unsigned int)iter.exactCount())
+    {
+        //the offsets are added straight from the mapped file to the output mesh
+        PointBuffer points(const_cast<float*>(outputMesh.getRawPoints(NULL)), numVertices);
+        reader->apply(*frame, points, NULL, float(1.0 - blend));
+        if (nextFrame)
+            reader->apply(*nextFrame, points, NULL, float(blend));
+        outputMesh.updateSurface();
+    }
+    else
+    {
+        //the position in the iterator of every vertex of the geometry, -1 for the ones the deformer does not affect
+        std::vector<int> vertexPositions(numVertices, -1);
+        int position = 0;
+        for (iter.reset(); !iter.isDone(); iter.next(), position++)
+        {
+            if ((unsigned int)iter.index() < numVertices)
+                vertexPositions[iter.index()] = position;
+        }
+        iter.reset();
+        
+        MPointArray points;
+        iter.allPositions(points);
+        reader->apply(*frame, PointBuffer(&points), &vertexPositions, float(1.0 - blend));
+        if (nextFrame)
+            reader->apply(*nextFrame, PointBuffer(&points), &vertexPositions, float(blend));
+        iter.setAllPositions(points);
+    }
+    
+    played = true;
+    return MS::kSuccess;
+}
+
+void CameraLattice::compileCamera(MDataBlock& block, CompiledCamera &camera)
+{
+    camera.compile(toMatrix4(block.inputValue(cameraMatrix).asMatrix()),
+                           block.inputValue(inOrtho).asBool(),
+                           block.inputValue(inOrthographicWidth).asDouble(),
+                           block.inputValue(inHorizontalFilmAperture).asDouble(),
+                           block.inputValue(inVerticalFilmAperture).asDouble(),
+                           block.inputValue(inFocalLength).asDouble());
+}
+
+void CameraLattice::compileLattice(MDataBlock& block, CompiledLattice &lattice)
+{
+    int sD = block.inputValue(sSubidivision).asInt();
+    int tD = block.inputValue(tSubidivision).asInt();
+    
+    MDataHandle inputLatticeHnd = block.inputValue(inputLattice);
+    MFnMesh planeMesh(inputLatticeHnd.asMesh());
+    MPointArray meshPoints;
+    planeMesh.getPoints(meshPoints);
+    std::vector<Point3> planePoints;
+    toPoint3Array(meshPoints, planePoints);
+    
+    lattice.compile(planePoints, sD, tD);
+}
+
+void CameraLattice::compileLatticeMode(MDataBlock& block, CompiledLattice &lattice, int behaviour)
+{
+    //both only recompile when the interpolation or the recursion change
+    if (lattice.isValid())
+    {
+        if (behaviour == kBezier)
+            lattice.compileBezierWindows(block.inputValue(maxBezierRecursion).asInt());
+        lattice.compileIdentityMask(behaviour);
+    }
+}
+
+MStatus CameraLattice::deformStacked(MDataBlock& block, MItGeometry& iter, const std::vector<LatticeStage> &stages,
+                                     Matrix4 &objMat, MFnMesh *outputMesh, const PointBuffer &points,
+                                     IncrementalState &state, ProjectionCache &projectionCache, InfluenceWeightCache &weightCache,
+                                     const PaintedWeights &paintedWeights,
+                                     std::vector<Influencer> *activeInfluencers, const InfluencerGrid *activeInfluencerGrid,
+                                     EvaluationStats &stats)
+{
+    //the stack moves points between lattices, so neither the projections nor the previous result can be reused
+    state.valid = false;
+    projectionCache.invalidate();
+    
+    if (stages.empty())
+        return MS::kSuccess;
+    
+    //meshes are deformed in place, the other geometries start from a copy of their input
+    PointBuffer deformedPoints = points;
+    if (!outputMesh)
+    {
+        state.deformedPoints.copy(state.inputPoints);
+        deformedPoints = PointBuffer(&state.deformedPoints);
+    }
+    
+    prepareWeightCache(weightCache, *activeInfluencers, points.length());
+    
+    //every vertex costs as much as all the lattices of the stack
+    size_t grainSize = kernelGrainSize(kLinear);
+    for (size_t k = 0; k < stages.size(); k++)
+        grainSize = std::min(grainSize, kernelGrainSize(stages[k].behaviour));
+    grainSize = std::max(grainSize / stages.size(), size_t(1));
+    
+    KernelCounters counters;
+    double kernelTime = 0.0;
+    {
+        StageScope stageScope("Kernel", kernelTime);
+        
+        StackedLatticeData dataObj(&stages, points, deformedPoints, &weightCache, &objMat, activeInfluencers, activeInfluencerGrid);
+        dataObj.setCounters(&counters);
+        size_t numVertices = points.length();
+        if (paintedWeights.painted)
+        {
+            dataObj.setVertexIndices(&paintedWeights.activeVertices[0]);
+            dataObj.setPaintedWeights(paintedWeights.values());
+            numVertices = paintedWeights.activeVertices.size();
+            stats.skipped += points.length() - numVertices;
+        }
+        runKernel(dataObj, numVertices, grainSize, block.inputValue(maxThreads).asInt());
+    }
+    
+    stats.kernelTime += kernelTime;
+    moveInfluenceTime(counters, kernelTime, stats);
+    stats.processed += counters.processed;
+    stats.culled += counters.culled;
+    stats.skipped += counters.skipped;
+    
+    StageScope stageScope("Output", stats.outputTime);
+    if (outputMesh)
+    {
+        std::vector<float>().swap(state.rawDeformedPoints);
+        outputMesh->updateSurface();
+    }
+    else
+        iter.setAllPositions(state.deformedPoints);
+    
+    return MS::kSuccess;
+}
+
+//reads through plugs in the current context, the datablock only holds the current time
+MStatus CameraLattice::readSubframeSample(unsigned int geometryIndex, SubframeSample &sample)
+{
+    MStatus status;
+    MObject node = thisMObject();
+    
+    MPlug objectMatrixPlug = MPlug(node, objectMatrices).elementByLogicalIndex(geometryIndex);
+    if (!objectMatrixPlug.isConnected())
+        objectMatrixPlug = MPlug(node, objectMatrix);
+    Matrix4 objMat = toMatrix4(MFnMatrixData(objectMatrixPlug.asMObject()).matrix());
+    Matrix4 invObjMat = objMat.inverse();
+    sample.toWorldMatrix = objMat;
+    
+    LatticeStage stage;
+    stage.envelopeValue = MPlug(node, envelope).asFloat();
+    stage.gateOffsetValue = MPlug(node, gateOffset).asDouble();
+    stage.useInfluencers = true;
+    
+    const CompiledLattice *lattice = &sample.localLattice;
+    const CompiledCamera *camera = &sample.localCamera;
+    
+    MObject sharedObject = MPlug(node, inCompiledLattice).asMObject();
+    const CompiledLatticeData *sharedData = sharedObject.isNull() ? NULL :
+        static_cast<const CompiledLatticeData*>(MFnPluginData(sharedObject).constData());
+    if (sharedData)
+    {
+        sample.dataObjects.push_back(sharedObject);
+        lattice = sharedData->lattice.get();
+        camera = &sharedData->camera;
+        stage.behaviour = sharedData->behaviour;
+    }
+    else
+    {
+        Matrix4 cameraMat = toMatrix4(MFnMatrixData(MPlug(node, cameraMatrix).asMObject()).matrix());
+        sample.localCamera.compile(cameraMat, MPlug(node, inOrtho).asBool(), MPlug(node, inOrthographicWidth).asDouble(),
+                                   MPlug(node, inHorizontalFilmAperture).asDouble(), MPlug(node, inVerticalFilmAperture).asDouble(),
+                                   MPlug(node, inFocalLength).asDouble());
+        
+        MFnMesh planeMesh(MPlug(node, inputLattice).asMObject());
+        MPointArray meshPoints;
+        planeMesh.getPoints(meshPoints);
+        std::vector<Point3> planePoints;
+        toPoint3Array(meshPoints, planePoints);
+        sample.localLattice.compile(planePoints, MPlug(node, sSubidivision).asInt(), MPlug(node, tSubidivision).asInt());
+        
+        stage.behaviour = MPlug(node, interpolation).asShort();
+        if (sample.localLattice.isValid())
+        {
+            if (stage.behaviour == kBezier)
+                sample.localLattice.compileBezierWindows(MPlug(node, maxBezierRecursion).asInt());
+            sample.localLattice.compileIdentityMask(stage.behaviour);
+        }
+    }
+    
+    if (stage.envelopeValue >= 0.01 && camera->valid && lattice->isValid() && !lattice->isAtRest())
+    {
+        stage.lattice = lattice;
+        stage.setCamera(*camera, objMat, invObjMat);
+        sample.stages.push_back(stage);
+    }
+    
+    MPlug stackedPlug(node, stackedLattice);
+    for (unsigned int i = 0; i < stackedPlug.numElements(); i++)
+    {
+        MPlug elementPlug = stackedPlug.elementByPhysicalIndex(i);
+        MObject stackedObject = elementPlug.child(stackedCompiledLattice).asMObject();
+        const CompiledLatticeData *stackedData = stackedObject.isNull() ? NULL :
+            static_cast<const CompiledLatticeData*>(MFnPluginData(stackedObject).constData());
+        float stackedEnvelopeValue = elementPlug.child(stackedEnvelope).asFloat();
+        if (!stackedData || stackedEnvelopeValue < 0.01 || !stackedData->camera.valid ||
+            !stackedData->lattice->isValid() || stackedData->lattice->isAtRest())
+            continue;
+        
+        sample.dataObjects.push_back(stackedObject);
+        stage.lattice = stackedData->lattice.get();
+        stage.setCamera(stackedData->camera, objMat, invObjMat);
+        stage.behaviour = stackedData->behaviour;
+        stage.gateOffsetValue = elementPlug.child(stackedGateOffset).asDouble();
+        stage.envelopeValue = stackedEnvelopeValue;
+        stage.useInfluencers = false;
+        sample.stages.push_back(stage);
+    }
+    
+    MPlug falloffPlug(node, influenceFalloff);
+    MPlug influenceMatrixPlug(node, influenceMatrix);
+    MIntArray influenceIndices;
+    falloffPlug.getExistingArrayAttributeIndices(influenceIndices);
+    for (unsigned int i = 0; i < influenceIndices.length(); i++)
+    {
+        MPlug elementPlug = falloffPlug.elementByLogicalIndex(influenceIndices[i]);
+        if (!elementPlug.isDestination())
+            continue;
+        
+        Influencer influencer;
+        influencer.set(toMatrix4(MFnMatrixData(influenceMatrixPlug.elementByLogicalIndex(influenceIndices[i]).asMObject()).matrix()),
+                       elementPlug.asDouble());
+        sample.influencers.push_back(influencer);
+    }
+    sample.influencerGrid.build(sample.influencers);
+    
+    return status;
+}
+
+static bool sameInfluencers(const std::vector<Influencer> &a, const std::vector<Influencer> &b)
+{
+    if (a.size() != b.size())
+        return false;
+    for (size_t i = 0; i < a.size(); i++)
+    {
+        if (a[i].falloff != b[i].falloff || a[i].invMat != b[i].invMat)
+            return false;
+    }
+    return true;
+}
+
+static bool samePoints(const MPointArray &a, const MPointArray &b)
+{
+    if (a.length() != b.length())
+        return false;
+    for (unsigned int i = 0; i < a.length(); i++)
+    {
+        if (a[i].x != b[i].x || a[i].y != b[i].y || a[i].z != b[i].z)
+            return false;
+    }
+    return true;
+}
+
+MStatus CameraLattice::evaluateSubframes(const MTimeArray &times, unsigned int geometryIndex, SubframeResult &result)
+{
+    result.inputPoints.clear();
+    result.inputIndex.assign(times.length(), 0);
+    result.deformedPoints.assign(times.length(), MPointArray());
+    
+    MPlug inputGeomPlug = MPlug(thisMObject(), input).elementByLogicalIndex(geometryIndex).child(inputGeom);
+    
+    //all the time dependent data is gathered first, so the vertices are only visited once
+    std::vector<SubframeSample> samples(times.length());
+    for (unsigned int s = 0; s < times.length(); s++)
+    {
+        MDGContext context(times[s]);
+        MDGContextGuard guard(context);
+        
+        SubframeSample &sample = samples[s];
+        MStatus status = readSubframeSample(geometryIndex, sample);
+        if (!status)
+            return status;
+        
+        MObject geometry = inputGeomPlug.asMObject();
+        if (geometry.isNull())
+            return MS::kFailure;
+        
+        MPointArray points;
+        MItGeometry iter(geometry);
+        iter.allPositions(points);
+        
+        //the geometry is often still across the shutter, only the camera and the lattice move
+        sample.inputIndex = (unsigned int)result.inputPoints.size();
+        for (unsigned int k = 0; k < result.inputPoints.size(); k++)
+        {
+            if (samePoints(points, result.inputPoints[k]))
+            {
+                sample.inputIndex = k;
+                break;
+            }
+        }
+        if (sample.inputIndex == result.inputPoints.size())
+            result.inputPoints.push_back(points);
+        result.inputIndex[s] = sample.inputIndex;
+        
+        for (unsigned int k = 0; k < s && !sample.influencers.empty(); k++)
+        {
+            if (samples[k].weightSource < 0 && samples[k].inputIndex == sample.inputIndex &&
+                samples[k].toWorldMatrix == sample.toWorldMatrix && sameInfluencers(samples[k].influencers, sample.influencers))
+            {
+                sample.weightSource = k;
+                break;
+            }
+        }
+    }
+    
+    if (result.inputPoints.empty())
+        return MS::kSuccess;
+    
+    unsigned int numPoints = result.inputPoints[0].length();
+    std::vector<PointBuffer> inputs, outputs;
+    for (size_t k = 0; k < result.inputPoints.size(); k++)
+    {
+        //the topology must not change across the shutter
+        if (result.inputPoints[k].length() != numPoints)
+            return MS::kFailure;
+        inputs.push_back(PointBuffer(&result.inputPoints[k]));
+    }
+    for (unsigned int s = 0; s < times.length(); s++)
+    {
+        result.deformedPoints[s].setLength(numPoints);
+        outputs.push_back(PointBuffer(&result.deformedPoints[s]));
+    }
+    
+    //every vertex costs as much as all the lattices of all the samples
+    size_t grainSize = kernelGrainSize(kLinear);
+    size_t numStages = 0;
+    for (size_t s = 0; s < samples.size(); s++)
+    {
+        for (size_t k = 0; k < samples[s].stages.size(); k++)
+            grainSize = std::min(grainSize, kernelGrainSize(samples[s].stages[k].behaviour));
+        numStages += std::max(samples[s].stages.size(), size_t(1));
+    }
+    grainSize = std::max(grainSize / numStages, size_t(1));
+    
+    //painted weights do not depend on time, they are read once for all the samples
+    std::vector<float> componentWeights;
+    MPlug weightsPlug = MPlug(thisMObject(), weightList).elementByLogicalIndex(geometryIndex).child(weights);
+    MIntArray weightIndices;
+    weightsPlug.getExistingArrayAttributeIndices(weightIndices);
+    for (unsigned int i = 0; i < weightIndices.length(); i++)
+    {
+        if (size_t(weightIndices[i]) >= componentWeights.size())
+            componentWeights.resize(weightIndices[i] + 1, 1.0f);
+        componentWeights[weightIndices[i]] = weightsPlug.elementByLogicalIndex(weightIndices[i]).asFloat();
+    }
+    
+    //the input geometry is iterated as a whole, so the vertices are in component order
+    std::vector<int> componentIndices(numPoints);
+    for (unsigned int i = 0; i < numPoints; i++)
+        componentIndices[i] = int(i);
+    PaintedWeights painted;
+    painted.compile(componentWeights, componentIndices);
+    
+    SubframeLatticeData dataObj(&samples, &inputs, &outputs);
+    dataObj.setPaintedWeights(painted.values());
+    runKernel(dataObj, numPoints, grainSize, MPlug(thisMObject(), maxThreads).asInt());
+    
+    return MS::kSuccess;
+}
+
+void CameraLattice::getStats(EvaluationStats &total, EvaluationStats &last)
+{
+    tbb::spin_mutex::scoped_lock lock(statsMutex);
+    total = totalStats;
+    last = lastStats;
+}
+
+void CameraLattice::resetStats()
+{
+    tbb::spin_mutex::scoped_lock lock(statsMutex);
+    totalStats.clear();
+    lastStats.clear();
+    pendingStats.clear();
+    pendingGeometries.clear();
+}
+
+void CameraLattice::findGeometryCaches(unsigned int index, ProjectionCache *&projectionCache, IncrementalState *&state,
+                                       InfluenceWeightCache *&weightCache, PaintedWeights *&paintedWeights)
+{
+    //the maps are shared by the geometries deformed concurrently, their elements are not
+    tbb::spin_mutex::scoped_lock lock(stateMutex);
+    projectionCache = &projectionCaches[index];
+    state = &incrementalStates[index];
+    weightCache = &weightCaches[index];
+    paintedWeights = &this->paintedWeights[index];
+}
+
+void CameraLattice::readPaintedWeights(MDataBlock& block, unsigned int multiIndex, MItGeometry& iter, PaintedWeights &paintedWeights)
+{
+    //the weight list is sparse, the vertices which were never painted are missing from it
+    std::vector<float> componentWeights;
+    MArrayDataHandle weightListHandle = block.inputArrayValue(weightList);
+    if (weightListHandle.jumpToElement(multiIndex) == MS::kSuccess)
+    {
+        MArrayDataHandle weightsHandle(weightListHandle.inputValue().child(weights));
+        unsigned int numWeights = weightsHandle.elementCount();
+        for (unsigned int i = 0; i < numWeights; i++)
+        {
+            weightsHandle.jumpToArrayElement(i);
+            unsigned int component = weightsHandle.elementIndex();
+            if (component >= componentWeights.size())
+                componentWeights.resize(component + 1, 1.0f);
+            componentWeights[component] = weightsHandle.inputValue().asFloat();
+        }
+    }
+    
+    //the kernels run in the order of the iterator, which is not the component order for partial memberships
+    std::vector<int> componentIndices;
+    componentIndices.reserve(iter.exactCount());
+    for (iter.reset(); !iter.isDone(); iter.next())
+        componentIndices.push_back(iter.index());
+    iter.reset();
+    
+    paintedWeights.compile(componentWeights, componentIndices);
+}
+
+void CameraLattice::invalidatePaintedWeights(unsigned int index)
+{
+    paintedWeights[index].valid = false;
+    incrementalStates[index].valid = false;
+}
+
+void CameraLattice::prepareWeightCache(InfluenceWeightCache &weightCache, const std::vector<Influencer> &activeInfluencers, unsigned int numPoints)
+{
+    if (activeInfluencers.empty())
+    {
+        //nothing to store, the buffer is rebuilt when influence areas are connected
+        weightCache.valid = false;
+        weightCache.weights.clear();
+    }
+    else if (!weightCache.valid || weightCache.weights.size() != numPoints)
+    {
+        //the weights are evaluated lazily by the kernel, only for the points inside the gate
+        weightCache.weights.assign(numPoints, -1.0f);
+        weightCache.valid = true;
+    }
+}
+
+void CameraLattice::invalidateGeometryCaches(unsigned int index)
+{
+    projectionCaches[index].invalidate();
+    weightCaches[index].valid = false;
+    incrementalStates[index].valid = false;
+}
+
+void CameraLattice::invalidateProjectionCaches()
+{
+    std::map<unsigned int, ProjectionCache>::iterator it;
+    for (it = projectionCaches.begin(); it != projectionCaches.end(); ++it)
+        it->second.invalidate();
+    
+    invalidateIncrementalStates();
+}
+
+template <typename Body>
+void CameraLattice::runKernel(const Body &body, size_t numVertices, size_t grainSize, int maxThreadsValue)
+{
+    if (numVertices < serialThreshold || maxThreadsValue == 1)
+    {
+        body(tbb::blocked_range<size_t>(0, numVertices));
+        return;
+    }
+    
+    //geometries deformed concurrently share the arena, it is only rebuilt when no kernel runs in it
+    tbb::spin_rw_mutex::scoped_lock lock(arenaMutex, false);
+    if (maxThreadsValue != arenaThreads)
+    {
+        lock.upgrade_to_writer();
+        if (maxThreadsValue != arenaThreads)
+        {
+            if (arena.is_active())
+                arena.terminate();
+            arena.initialize(maxThreadsValue > 0 ? maxThreadsValue : int(tbb::task_arena::automatic));
+            arenaThreads = maxThreadsValue;
+        }
+        lock.downgrade_to_reader();
+    }
+    
+    arena.execute(ArenaParallelFor<Body>(body, numVertices, grainSize));
+}
+
+void CameraLattice::invalidateIncrementalStates()
+{
+    std::map<unsigned int, IncrementalState>::iterator it;
+    for (it = incrementalStates.begin(); it != incrementalStates.end(); ++it)
+        it->second.valid = false;
+}
+
+void CameraLattice::invalidateWeightCaches()
+{
+    std::map<unsigned int, InfluenceWeightCache>::iterator it;
+    for (it = weightCaches.begin(); it != weightCaches.end(); ++it)
+        it->second.valid = false;
+    
+    invalidateIncrementalStates();
+}
+
+MStatus CameraLattice::setDependentsDirty(const MPlug &plug, MPlugArray &plugArray)
+{
+    markDirty(plug);
+    return MPxDeformerNode::setDependentsDirty(plug, plugArray);
+}
+
+MStatus CameraLattice::preEvaluation(const MDGContext &context, const MEvaluationNode &evaluationNode)
+{
+    //the evaluation manager does not call setDependentsDirty, the dirty plugs are only known here
+    if (context.isNormal())
+    {
+        MStatus status;
+        for (MEvaluationNodeIterator it = evaluationNode.iterator(&status); status && !it.isDone(); it.next())
+            markDirty(it.plug());
+    }
+    
+    return MPxDeformerNode::preEvaluation(context, evaluationNode);
+}
+
+MPxNode::SchedulingType CameraLattice::schedulingType() const
+{
+    //the state shared by the geometries is locked, different nodes have nothing in common
+    return MPxNode::kParallel;
+}
+
+void CameraLattice::getCacheSetup(const MEvaluationNode &evaluationNode, MNodeCacheDisablingInfo &disablingInfo,
+                                  MNodeCacheSetupInfo &cacheSetupInfo, MObjectArray &monitoredAttributes) const
+{
+    MPxDeformerNode::getCacheSetup(evaluationNode, disablingInfo, cacheSetupInfo, monitoredAttributes);
+    
+    //evaluations in the background do not touch the node's caches, see deform
+    cacheSetupInfo.setPreference(MNodeCacheSetupInfo::kWantToCacheByDefault, true);
+}
+
+void CameraLattice::markDirty(const MPlug &plug)
+{
+    evaluationGeneration++;
+    
+    tbb::spin_mutex::scoped_lock lock(stateMutex);
+    if (plug == inputLattice || plug == sSubidivision || plug == tSubidivision)
+    {
+        refreshCompiledLattice = true;
+    }
+    else if (plug == influenceMatrix || plug == influenceFalloff)
+    {
+        refreshInfluencers = true;
+    }
+    else if (plug == weightList || plug == weights)
+    {
+        //painting dirties single weights, only the geometry they belong to is read again
+        MPlug listPlug = plug;
+        if (plug == weights)
+            listPlug = plug.isElement() ? plug.array().parent() : plug.parent();
+        
+        if (listPlug.isElement())
+            invalidatePaintedWeights(listPlug.logicalIndex());
+        else
+        {
+            std::map<unsigned int, PaintedWeights>::iterator it;
+            for (it = paintedWeights.begin(); it != paintedWeights.end(); ++it)
+                it->second.valid = false;
+            invalidateIncrementalStates();
+        }
+    }
+    
+    if (plug == cameraMatrix || plug == inOrtho || plug == inOrthographicWidth ||
+        plug == inVerticalFilmAperture || plug == inHorizontalFilmAperture || plug == inFocalLength)
+    {
+        refreshCamera = true;
+    }
+    
+    if (plug == objectMatrix)
+    {
+        invalidateWeightCaches();
+    }
+    
+    if (plug == objectMatrices)
+    {
+        //only the geometry the matrix belongs to
+        if (plug.isElement())
+            invalidateGeometryCaches(plug.logicalIndex());
+        else
+        {
+            invalidateProjectionCaches();
+            invalidateWeightCaches();
+        }
+    }
+    else if (plug == objectMatrix || plug == cameraMatrix || plug == inOrtho || plug == inOrthographicWidth ||
+        plug == inVerticalFilmAperture || plug == inHorizontalFilmAperture || plug == inFocalLength || plug == precision)
+    {
+        invalidateProjectionCaches();
+    }
+    else if (plug == inputGeom || plug == input)
+    {
+        //the input points of a single geometry changed
+        MPlug inputPlug = plug == inputGeom ? plug.parent() : plug;
+        if (inputPlug.isElement())
+            invalidateGeometryCaches(inputPlug.logicalIndex());
+        else
+        {
+            invalidateProjectionCaches();
+            invalidateWeightCaches();
+        }
+    }
+}
+
+bool CameraLattice::getInternalValue(const MPlug &plug, MDataHandle &dataHandle)
+{
+    tbb::spin_mutex::scoped_lock lock(resultCacheMutex);
+    if (plug == resultCacheHits)
+    {
+        dataHandle.set(double(resultCache.hits));
+        return true;
+    }
+    else if (plug == resultCacheMisses)
+    {
+        dataHandle.set(double(resultCache.misses));
+        return true;
+    }
+    else if (plug == resultCacheMemory)
+    {
+        //in MB, like the budget
+        dataHandle.set(double(resultCache.memory) / (1024.0 * 1024.0));
+        return true;
+    }
+    
+    return MPxDeformerNode::getInternalValue(plug, dataHandle);
+}
+
+MStatus CameraLattice::connectionMade (const MPlug &plug, const MPlug &otherPlug, bool asSrc)
+{
+    //the plug is not connected yet, but its index is known, so deform never has to query the connections
+    tbb::spin_mutex::scoped_lock lock(stateMutex);
+    if (plug == influenceFalloff || plug == influenceMatrix)
+    {
+        if (plug == influenceFalloff && plug.isElement() && !asSrc)
+            connectedInfluences.insert(plug.logicalIndex());
+        refreshInfluencers = true;
+        //a broken connection is reported again if it happens after this change
+        resetWarnings();
+    }
+    
+    if (plug == inCompiledLattice)
+    {
+        //the camera versions of different evaluators are unrelated
+        sharedCameraVersion = 0;
+        invalidateProjectionCaches();
     }
     
     return MPxDeformerNode::connectionMade(plug, otherPlug, asSrc);
@@ -548,9 +1949,21 @@ MStatus CameraLattice::connectionMade (const MPlug &plug, const MPlug &otherPlug
 
 MStatus CameraLattice::connectionBroken (const MPlug &plug, const MPlug &otherPlug, bool asSrc)
 {
+    tbb::spin_mutex::scoped_lock lock(stateMutex);
     if (plug == influenceFalloff || plug == influenceMatrix)
     {
-        refreshLogicalIndex = true;
+        if (plug == influenceFalloff && plug.isElement() && !asSrc)
+            connectedInfluences.erase(plug.logicalIndex());
+        refreshInfluencers = true;
+        //a broken connection is reported again if it happens after this change
+        resetWarnings();
+    }
+    
+    if (plug == inCompiledLattice)
+    {
+        //the camera versions of different evaluators are unrelated
+        sharedCameraVersion = 0;
+        invalidateProjectionCaches();
     }
     
     return MPxDeformerNode::connectionBroken(plug, otherPlug, asSrc);
@@ -0,0 +1,502 @@
+/*
+ *  cameraLatticeCache.cpp
+ *  cameraLattice
+ *
+ *
+ */
+
+#include <string.h>
+#include <math.h>
+#include <algorithm>
+
+#ifdef _WIN32
+#include <windows.h>
+#else
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <fcntl.h>
+#include <unistd.h>
+#endif
+
+#include <maya/MArgDatabase.h>
+#include <maya/MSelectionList.h>
+#include <maya/MStringArray.h>
+#include <maya/MFnDependencyNode.h>
+#include <maya/MPlug.h>
+#include <maya/MIntArray.h>
+#include <maya/MItGeometry.h>
+#include <maya/MAnimControl.h>
+#include <maya/MDGContext.h>
+#include <maya/MDGContextGuard.h>
+#include <maya/MTime.h>
+
+#include "cameraLatticeCache.h"
+
+static const char cacheMagic[4] = {'T', 'C', 'L', 'C'};
+static const unsigned int cacheVersion = 1;
+
+// playback times further than this from the baked range, in seconds, have no frame
+static const double cacheRangeTolerance = 1e-3;
+
+// long is 32 bits on windows, the offsets of the file stay 64 bits past 2GB
+static long long tellFile(FILE *file)
+{
+#ifdef _WIN32
+    return _ftelli64(file);
+#else
+    return ftello(file);
+#endif
+}
+
+static int seekFile(FILE *file, long long offset)
+{
+#ifdef _WIN32
+    return _fseeki64(file, offset, SEEK_SET);
+#else
+    return fseeko(file, off_t(offset), SEEK_SET);
+#endif
+}
+
+// frames are sorted by geometry, then time, so lookups are a binary search
+static bool frameLess(const CacheFrame &a, const CacheFrame &b)
+{
+    if (a.geometryIndex != b.geometryIndex)
+        return a.geometryIndex < b.geometryIndex;
+    return a.time < b.time;
+}
+
+/**********************************************************
+ CACHE WRITER
+ **********************************************************/
+
+bool CacheWriter::open(const MString &path)
+{
+    close();
+    m_frames.clear();
+
+    m_file = fopen(path.asChar(), "wb");
+    if (!m_file)
+        return false;
+
+    //the header is written again on close, with the index offset
+    CacheHeader header;
+    memset(&header, 0, sizeof(CacheHeader));
+    return fwrite(&header, sizeof(CacheHeader), 1, m_file) == 1;
+}
+
+bool CacheWriter::addFrame(double time, unsigned int geometryIndex, const MPointArray &inputPoints, const MPointArray &outputPoints,
+                           bool quantise, double tolerance)
+{
+    if (!m_file || inputPoints.length() != outputPoints.length())
+        return false;
+
+    std::vector<unsigned int> indices;
+    std::vector<float> deltas;
+    float maxDelta = 0.0f;
+    for (unsigned int i = 0; i < inputPoints.length(); i++)
+    {
+        MVector delta = outputPoints[i] - inputPoints[i];
+        if (fabs(delta.x) <= tolerance && fabs(delta.y) <= tolerance && fabs(delta.z) <= tolerance)
+            continue;
+
+        indices.push_back(i);
+        for (int axis = 0; axis < 3; axis++)
+        {
+            deltas.push_back(float(delta[axis]));
+            maxDelta = std::max(maxDelta, float(fabs(delta[axis])));
+        }
+    }
+
+    //blocks start 8 bytes aligned
+    long long position = tellFile(m_file);
+    static const char padding[8] = {0, 0, 0, 0, 0, 0, 0, 0};
+    if (position < 0 || (position % 8 && fwrite(padding, size_t(8 - position % 8), 1, m_file) != 1))
+        return false;
+
+    CacheFrame frame;
+    memset(&frame, 0, sizeof(CacheFrame));
+    frame.time = time;
+    frame.geometryIndex = geometryIndex;
+    frame.numVertices = inputPoints.length();
+    frame.numChanged = (unsigned int)indices.size();
+    frame.quantised = quantise ? 1 : 0;
+    frame.scale = quantise ? maxDelta / 32767.0f : 1.0f;
+    frame.offset = (unsigned long long)tellFile(m_file);
+
+    if (indices.empty())
+    {
+        m_frames.push_back(frame);
+        return true;
+    }
+
+    if (fwrite(&indices[0], sizeof(unsigned int), indices.size(), m_file) != indices.size())
+        return false;
+
+    if (quantise)
+    {
+        std::vector<short> quantised(deltas.size());
+        float invScale = frame.scale > 0.0f ? 1.0f / frame.scale : 0.0f;
+        for (size_t i = 0; i < deltas.size(); i++)
+            quantised[i] = short(floor(deltas[i] * invScale + 0.5f));
+
+        if (fwrite(&quantised[0], sizeof(short), quantised.size(), m_file) != quantised.size())
+            return false;
+    }
+    else if (fwrite(&deltas[0], sizeof(float), deltas.size(), m_file) != deltas.size())
+        return false;
+
+    m_frames.push_back(frame);
+    return true;
+}
+
+bool CacheWriter::close()
+{
+    if (!m_file)
+        return false;
+
+    std::sort(m_frames.begin(), m_frames.end(), frameLess);
+
+    long long position = tellFile(m_file);
+    static const char padding[8] = {0, 0, 0, 0, 0, 0, 0, 0};
+    bool result = position >= 0 && (!(position % 8) || fwrite(padding, size_t(8 - position % 8), 1, m_file) == 1);
+
+    CacheHeader header;
+    memset(&header, 0, sizeof(CacheHeader));
+    memcpy(header.magic, cacheMagic, 4);
+    header.version = cacheVersion;
+    header.numFrames = (unsigned int)m_frames.size();
+    header.indexOffset = (unsigned long long)tellFile(m_file);
+
+    if (!m_frames.empty())
+        result = result && fwrite(&m_frames[0], sizeof(CacheFrame), m_frames.size(), m_file) == m_frames.size();
+
+    result = result && seekFile(m_file, 0) == 0 && fwrite(&header, sizeof(CacheHeader), 1, m_file) == 1;
+
+    result = fclose(m_file) == 0 && result;
+    m_file = NULL;
+    m_frames.clear();
+    return result;
+}
+
+/**********************************************************
+ CACHE READER
+ **********************************************************/
+
+CacheReader::CacheReader() : m_data(NULL), m_size(0)
+{
+#ifdef _WIN32
+    m_fileHandle = NULL;
+    m_mappingHandle = NULL;
+#endif
+}
+
+bool CacheReader::open(const MString &path)
+{
+    close();
+
+#ifdef _WIN32
+    HANDLE file = CreateFileA(path.asChar(), GENERIC_READ, FILE_SHARE_READ, NULL, OPEN_EXISTING, FILE_ATTRIBUTE_NORMAL, NULL);
+    if (file == INVALID_HANDLE_VALUE)
+        return false;
+
+    LARGE_INTEGER size;
+    HANDLE mapping = GetFileSizeEx(file, &size) ? CreateFileMappingA(file, NULL, PAGE_READONLY, 0, 0, NULL) : NULL;
+    const void *data = mapping ? MapViewOfFile(mapping, FILE_MAP_READ, 0, 0, 0) : NULL;
+    if (!data)
+    {
+        if (mapping)
+            CloseHandle(mapping);
+        CloseHandle(file);
+        return false;
+    }
+
+    m_fileHandle = file;
+    m_mappingHandle = mapping;
+    m_size = size_t(size.QuadPart);
+#else
+    int file = ::open(path.asChar(), O_RDONLY);
+    if (file < 0)
+        return false;
+
+    struct stat info;
+    void *data = fstat(file, &info) == 0 && info.st_size > 0 ? mmap(NULL, info.st_size, PROT_READ, MAP_SHARED, file, 0) : MAP_FAILED;
+    ::close(file);
+    if (data == MAP_FAILED)
+        return false;
+
+    m_size = info.st_size;
+#endif
+
+    m_data = static_cast<const unsigned char*>(data);
+
+    //validate the header and the index before trusting any offset
+    const CacheHeader *header = reinterpret_cast<const CacheHeader*>(m_data);
+    if (m_size < sizeof(CacheHeader) || memcmp(header->magic, cacheMagic, 4) != 0 || header->version != cacheVersion ||
+        header->indexOffset + header->numFrames * sizeof(CacheFrame) > m_size)
+    {
+        close();
+        return false;
+    }
+
+    const CacheFrame *frames = reinterpret_cast<const CacheFrame*>(m_data + header->indexOffset);
+    m_frames.assign(frames, frames + header->numFrames);
+    for (size_t i = 0; i < m_frames.size(); i++)
+    {
+        const CacheFrame &frame = m_frames[i];
+        size_t deltaSize = frame.quantised ? sizeof(short) : sizeof(float);
+        if (frame.offset + frame.numChanged * (sizeof(unsigned int) + 3 * deltaSize) > m_size)
+        {
+            close();
+            return false;
+        }
+    }
+
+    return true;
+}
+
+void CacheReader::close()
+{
+    if (m_data)
+    {
+#ifdef _WIN32
+        UnmapViewOfFile(m_data);
+        CloseHandle(m_mappingHandle);
+        CloseHandle(m_fileHandle);
+        m_fileHandle = NULL;
+        m_mappingHandle = NULL;
+#else
+        munmap(const_cast<unsigned char*>(m_data), m_size);
+#endif
+    }
+
+    m_data = NULL;
+    m_size = 0;
+    m_frames.clear();
+}
+
+bool CacheReader::findFrames(double time, unsigned int geometryIndex, const CacheFrame *&previous, const CacheFrame *&next, double &blend) const
+{
+    CacheFrame key;
+    memset(&key, 0, sizeof(CacheFrame));
+    key.time = time;
+    key.geometryIndex = geometryIndex;
+
+    std::vector<CacheFrame>::const_iterator it = std::lower_bound(m_frames.begin(), m_frames.end(), key, frameLess);
+
+    //the first frame at or after the time, and the one before
+    next = it != m_frames.end() && it->geometryIndex == geometryIndex ? &(*it) : NULL;
+    previous = it != m_frames.begin() && (it - 1)->geometryIndex == geometryIndex ? &(*(it - 1)) : NULL;
+    blend = 0.0;
+
+    //before the first or after the last baked frame, the closest one is not the geometry at that time
+    if (!previous)
+    {
+        if (!next || next->time - time > cacheRangeTolerance)
+            return false;
+        previous = next;
+        next = NULL;
+        return true;
+    }
+
+    if (!next)
+        return time - previous->time <= cacheRangeTolerance;
+
+    //the time is on next when the lower bound matches it exactly
+    blend = (time - previous->time) / (next->time - previous->time);
+    return true;
+}
+
+bool CacheReader::apply(const CacheFrame &frame, const PointBuffer &points, const std::vector<int> *vertexPositions, float weight) const
+{
+    if (vertexPositions ? vertexPositions->size() != frame.numVertices : frame.numVertices != points.length())
+        return false;
+    if (frame.numChanged == 0 || weight == 0.0f)
+        return true;
+
+    const unsigned int *indices = reinterpret_cast<const unsigned int*>(m_data + frame.offset);
+    const unsigned char *deltas = m_data + frame.offset + frame.numChanged * sizeof(unsigned int);
+
+    //quantised offsets are scaled back along with the weight
+    const short *quantised = reinterpret_cast<const short*>(deltas);
+    const float *offsets = reinterpret_cast<const float*>(deltas);
+    float scale = frame.quantised ? frame.scale * weight : weight;
+
+    for (unsigned int i = 0; i < frame.numChanged; i++)
+    {
+        //the index is not validated when the file is opened
+        if (indices[i] >= frame.numVertices)
+            continue;
+        
+        int position = int(indices[i]);
+        if (vertexPositions)
+        {
+            position = (*vertexPositions)[indices[i]];
+            if (position < 0)
+                continue;
+        }
+
+        Point3 point = points.get(position);
+        if (frame.quantised)
+        {
+            point.x += quantised[3 * i] * scale;
+            point.y += quantised[3 * i + 1] * scale;
+            point.z += quantised[3 * i + 2] * scale;
+        }
+        else
+        {
+            point.x += offsets[3 * i] * scale;
+            point.y += offsets[3 * i + 1] * scale;
+            point.z += offsets[3 * i + 2] * scale;
+        }
+        points.set(position, point);
+    }
+
+    return true;
+}
+
+/**********************************************************
+ BAKE COMMAND
+ **********************************************************/
+
+const MString CameraLatticeBakeCommand::commandName( "tcCameraLatticeBake" );
+
+static const char *fileFlag = "-f";
+static const char *fileLongFlag = "-file";
+static const char *startFlag = "-st";
+static const char *startLongFlag = "-startTime";
+static const char *endFlag = "-et";
+static const char *endLongFlag = "-endTime";
+static const char *stepFlag = "-s";
+static const char *stepLongFlag = "-step";
+static const char *quantiseFlag = "-q";
+static const char *quantiseLongFlag = "-quantise";
+static const char *toleranceFlag = "-tol";
+static const char *toleranceLongFlag = "-tolerance";
+
+void *CameraLatticeBakeCommand::creator()
+{
+    return new CameraLatticeBakeCommand();
+}
+
+MSyntax CameraLatticeBakeCommand::newSyntax()
+{
+    MSyntax syntax;
+    syntax.addFlag(fileFlag, fileLongFlag, MSyntax::kString);
+    syntax.addFlag(startFlag, startLongFlag, MSyntax::kDouble);
+    syntax.addFlag(endFlag, endLongFlag, MSyntax::kDouble);
+    syntax.addFlag(stepFlag, stepLongFlag, MSyntax::kDouble);
+    syntax.addFlag(quantiseFlag, quantiseLongFlag);
+    syntax.addFlag(toleranceFlag, toleranceLongFlag, MSyntax::kDouble);
+    syntax.setObjectType(MSyntax::kStringObjects, 1, 1);
+    return syntax;
+}
+
+MStatus CameraLatticeBakeCommand::doIt(const MArgList &args)
+{
+    MStatus status;
+    MArgDatabase argData(syntax(), args, &status);
+    if (!status)
+        return status;
+
+    MStringArray objects;
+    argData.getObjects(objects);
+
+    MSelectionList selection;
+    MObject deformer;
+    if (objects.length() != 1 || !selection.add(objects[0]) || !selection.getDependNode(0, deformer) ||
+        MFnDependencyNode(deformer).typeId() != CameraLattice::id)
+    {
+        displayError("tcCameraLatticeBake: a tcCameraLatticeDeformer is needed.");
+        return MS::kFailure;
+    }
+
+    if (!argData.isFlagSet(fileFlag))
+    {
+        displayError("tcCameraLatticeBake: the -file flag is needed.");
+        return MS::kFailure;
+    }
+
+    MString fileName;
+    argData.getFlagArgument(fileFlag, 0, fileName);
+
+    double startTime = MAnimControl::minTime().as(MTime::uiUnit());
+    double endTime = MAnimControl::maxTime().as(MTime::uiUnit());
+    double step = 1.0;
+    double tolerance = 0.0001;
+    if (argData.isFlagSet(startFlag))
+        argData.getFlagArgument(startFlag, 0, startTime);
+    if (argData.isFlagSet(endFlag))
+        argData.getFlagArgument(endFlag, 0, endTime);
+    if (argData.isFlagSet(stepFlag))
+        argData.getFlagArgument(stepFlag, 0, step);
+    if (argData.isFlagSet(toleranceFlag))
+        argData.getFlagArgument(toleranceFlag, 0, tolerance);
+    bool quantise = argData.isFlagSet(quantiseFlag);
+
+    if (step <= 0.0 || endTime < startTime)
+    {
+        displayError("tcCameraLatticeBake: invalid frame range.");
+        return MS::kFailure;
+    }
+
+    //baking a deformer in playback would only copy its own cache
+    MFnDependencyNode deformerFn(deformer);
+    if (deformerFn.findPlug(CameraLattice::cacheMode).asShort() == kCachePlayback)
+    {
+        displayError("tcCameraLatticeBake: " + deformerFn.name() + " is in playback mode.");
+        return MS::kFailure;
+    }
+
+    MPlug inputPlug(deformer, CameraLattice::input);
+    MPlug outputPlug(deformer, CameraLattice::outputGeom);
+    MIntArray geometryIndices;
+    outputPlug.getExistingArrayAttributeIndices(geometryIndices);
+
+    CacheWriter writer;
+    if (!writer.open(fileName))
+    {
+        displayError("tcCameraLatticeBake: cannot write " + fileName + ".");
+        return MS::kFailure;
+    }
+
+    //the input and the output of every geometry are pulled at each frame, the difference is what the deformer does
+    int numFrames = 0;
+    for (double frame = startTime; frame <= endTime + 1e-6; frame += step)
+    {
+        MTime time(frame, MTime::uiUnit());
+        MDGContext context(time);
+        MDGContextGuard guard(context);
+
+        for (unsigned int i = 0; i < geometryIndices.length(); i++)
+        {
+            unsigned int index = geometryIndices[i];
+            MObject inputGeometry = inputPlug.elementByLogicalIndex(index).child(CameraLattice::inputGeom).asMObject();
+            MObject outputGeometry = outputPlug.elementByLogicalIndex(index).asMObject();
+            if (inputGeometry.isNull() || outputGeometry.isNull())
+                continue;
+
+            MPointArray inputPoints, outputPoints;
+            MItGeometry inputIter(inputGeometry);
+            inputIter.allPositions(inputPoints);
+            MItGeometry outputIter(outputGeometry);
+            outputIter.allPositions(outputPoints);
+
+            if (!writer.addFrame(time.as(MTime::kSeconds), index, inputPoints, outputPoints, quantise, tolerance))
+            {
+                writer.close();
+                displayError("tcCameraLatticeBake: failed writing " + fileName + ".");
+                return MS::kFailure;
+            }
+        }
+        numFrames++;
+    }
+
+    if (!writer.close())
+    {
+        displayError("tcCameraLatticeBake: failed writing " + fileName + ".");
+        return MS::kFailure;
+    }
+
+    setResult(numFrames);
+    return MS::kSuccess;
+}
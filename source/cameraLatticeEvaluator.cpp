@@ -0,0 +1,275 @@
+/*
+ *  cameraLatticeEvaluator.cpp
+ *  cameraLattice
+ *
+ *
+ */
+
+#include <maya/MFnTypedAttribute.h>
+#include <maya/MFnNumericAttribute.h>
+#include <maya/MFnMatrixAttribute.h>
+#include <maya/MFnEnumAttribute.h>
+#include <maya/MFnMeshData.h>
+#include <maya/MFnPluginData.h>
+#include <maya/MFnMesh.h>
+#include <maya/MPointArray.h>
+
+#include "cameraLatticeEvaluator.h"
+
+/**********************************************************
+ COMPILED LATTICE DATA
+ **********************************************************/
+
+const MTypeId CompiledLatticeData::id( 0x00122C06 );
+const MString CompiledLatticeData::typeName( "tcCompiledLatticeData" );
+
+void *CompiledLatticeData::creator()
+{
+    return new CompiledLatticeData();
+}
+
+void CompiledLatticeData::copy(const MPxData &other)
+{
+    const CompiledLatticeData &otherData = static_cast<const CompiledLatticeData&>(other);
+    lattice = otherData.lattice;
+    camera = otherData.camera;
+    behaviour = otherData.behaviour;
+    cameraVersion = otherData.cameraVersion;
+}
+
+/**********************************************************
+ CAMERA LATTICE EVALUATOR
+ **********************************************************/
+
+MTypeId CameraLatticeEvaluator::id( 0x00122C05 );
+
+MObject CameraLatticeEvaluator::inputLattice;
+MObject CameraLatticeEvaluator::sSubdivision;
+MObject CameraLatticeEvaluator::tSubdivision;
+MObject CameraLatticeEvaluator::interpolation;
+MObject CameraLatticeEvaluator::maxBezierRecursion;
+MObject CameraLatticeEvaluator::cameraMatrix;
+MObject CameraLatticeEvaluator::inOrtho;
+MObject CameraLatticeEvaluator::inOrthographicWidth;
+MObject CameraLatticeEvaluator::inHorizontalFilmAperture;
+MObject CameraLatticeEvaluator::inVerticalFilmAperture;
+MObject CameraLatticeEvaluator::inFocalLength;
+MObject CameraLatticeEvaluator::outCompiledLattice;
+
+CameraLatticeEvaluator::CameraLatticeEvaluator()
+{
+    refreshLattice = true;
+    refreshCamera = true;
+    cameraVersion = 0;
+}
+
+void *CameraLatticeEvaluator::creator()
+{
+	return new CameraLatticeEvaluator();
+}
+
+MStatus CameraLatticeEvaluator::compute( const MPlug& plug, MDataBlock& data )
+{
+    if (plug != outCompiledLattice)
+        return MS::kUnknownParameter;
+
+    MStatus stat;
+
+    //evaluations at other times, like the background fill of cached playback, must not touch
+    //the lattice and the camera of the current time, they compile their own
+    bool normalContext = data.context().isNormal();
+    CompiledCamera contextCamera;
+    CompiledCamera &camera = normalContext ? compiledCamera : contextCamera;
+
+    int behaviour = data.inputValue(interpolation).asShort();
+    std::shared_ptr<const CompiledLattice> lattice;
+    if (normalContext)
+    {
+        if (refreshLattice || !compiledLattice)
+        {
+            //the deformers may still read the lattice given to them, it is copied before compiling over it
+            if (!compiledLattice)
+                compiledLattice.reset(new CompiledLattice());
+            else if (compiledLattice.use_count() > 1)
+                compiledLattice.reset(new CompiledLattice(*compiledLattice));
+            compileLattice(data, behaviour, *compiledLattice);
+            refreshLattice = false;
+        }
+        lattice = compiledLattice;
+    }
+    else
+    {
+        std::shared_ptr<CompiledLattice> contextLattice(new CompiledLattice());
+        compileLattice(data, behaviour, *contextLattice);
+        lattice = contextLattice;
+    }
+
+    if (refreshCamera || !normalContext)
+    {
+        camera.compile(toMatrix4(data.inputValue(cameraMatrix).asMatrix()),
+                       data.inputValue(inOrtho).asBool(),
+                       data.inputValue(inOrthographicWidth).asDouble(),
+                       data.inputValue(inHorizontalFilmAperture).asDouble(),
+                       data.inputValue(inVerticalFilmAperture).asDouble(),
+                       data.inputValue(inFocalLength).asDouble());
+        if (normalContext)
+        {
+            cameraVersion++;
+            refreshCamera = false;
+        }
+    }
+
+    MFnPluginData fnData;
+    MObject dataObject = fnData.create(CompiledLatticeData::id, &stat);
+    if (!stat)
+        return stat;
+
+    CompiledLatticeData *compiledData = static_cast<CompiledLatticeData*>(fnData.data(&stat));
+    compiledData->lattice = lattice;
+    compiledData->camera = camera;
+    compiledData->behaviour = behaviour;
+    compiledData->cameraVersion = cameraVersion;
+
+    MDataHandle outHandle = data.outputValue(outCompiledLattice);
+    outHandle.set(compiledData);
+    outHandle.setClean();
+
+    return MS::kSuccess;
+}
+
+MStatus CameraLatticeEvaluator::setDependentsDirty(const MPlug &plug, MPlugArray &plugArray)
+{
+    markDirty(plug);
+    return MPxNode::setDependentsDirty(plug, plugArray);
+}
+
+MStatus CameraLatticeEvaluator::preEvaluation(const MDGContext &context, const MEvaluationNode &evaluationNode)
+{
+    //the evaluation manager does not call setDependentsDirty
+    if (context.isNormal())
+    {
+        MStatus status;
+        for (MEvaluationNodeIterator it = evaluationNode.iterator(&status); status && !it.isDone(); it.next())
+            markDirty(it.plug());
+    }
+
+    return MPxNode::preEvaluation(context, evaluationNode);
+}
+
+MPxNode::SchedulingType CameraLatticeEvaluator::schedulingType() const
+{
+    return MPxNode::kParallel;
+}
+
+void CameraLatticeEvaluator::compileLattice(MDataBlock &data, int behaviour, CompiledLattice &lattice)
+{
+    int sD = data.inputValue(sSubdivision).asInt();
+    int tD = data.inputValue(tSubdivision).asInt();
+
+    MFnMesh planeMesh(data.inputValue(inputLattice).asMesh());
+    MPointArray meshPoints;
+    planeMesh.getPoints(meshPoints);
+    std::vector<Point3> planePoints;
+    toPoint3Array(meshPoints, planePoints);
+
+    //compiled in place, so the changed points are diffed against the previous evaluation
+    lattice.compile(planePoints, sD, tD);
+
+    if (lattice.isValid())
+    {
+        if (behaviour == kBezier)
+            lattice.compileBezierWindows(data.inputValue(maxBezierRecursion).asInt());
+        lattice.compileIdentityMask(behaviour);
+    }
+}
+
+void CameraLatticeEvaluator::markDirty(const MPlug &plug)
+{
+    if (plug == inputLattice || plug == sSubdivision || plug == tSubdivision ||
+        plug == interpolation || plug == maxBezierRecursion)
+    {
+        refreshLattice = true;
+    }
+
+    if (plug == cameraMatrix || plug == inOrtho || plug == inOrthographicWidth ||
+        plug == inVerticalFilmAperture || plug == inHorizontalFilmAperture || plug == inFocalLength)
+    {
+        refreshCamera = true;
+    }
+}
+
+MStatus CameraLatticeEvaluator::initialize()
+{
+	MFnTypedAttribute tAttr;
+	inputLattice = tAttr.create( "inputLattice", "il", MFnMeshData::kMesh );
+	tAttr.setStorable( false );
+	tAttr.setHidden( true );
+
+    outCompiledLattice = tAttr.create( "outCompiledLattice", "ocl", CompiledLatticeData::id );
+    tAttr.setStorable( false );
+    tAttr.setWritable( false );
+	tAttr.setHidden( true );
+
+    MFnMatrixAttribute mAttr;
+	cameraMatrix = mAttr.create( "cameraMatrix", "cm");
+	mAttr.setHidden( true );
+
+    MFnNumericAttribute nAttr;
+	sSubdivision = nAttr.create( "sSubdivision", "ss", MFnNumericData::kLong);
+	nAttr.setDefault(0);
+
+	tSubdivision = nAttr.create( "tSubdivision", "ts", MFnNumericData::kLong);
+	nAttr.setDefault(0);
+
+    maxBezierRecursion = nAttr.create( "maxBezierRecursion", "mbr", MFnNumericData::kLong);
+	nAttr.setDefault(10);
+
+    inFocalLength = nAttr.create( "inFocalLength", "iFL", MFnNumericData::kDouble);
+	nAttr.setDefault(0);
+
+    inHorizontalFilmAperture = nAttr.create( "inHorizontalFilmAperture", "iHF", MFnNumericData::kDouble);
+	nAttr.setDefault(0);
+
+    inVerticalFilmAperture = nAttr.create( "inVerticalFilmAperture", "iVF", MFnNumericData::kDouble);
+	nAttr.setDefault(0);
+
+    inOrthographicWidth = nAttr.create( "inOrthographicWidth", "iOW", MFnNumericData::kDouble);
+	nAttr.setDefault(0);
+
+    inOrtho = nAttr.create("inOrtho", "iO", MFnNumericData::kBoolean);
+    nAttr.setDefault(false);
+
+	MFnEnumAttribute enumAttr;
+	interpolation = enumAttr.create("interpolation", "i", 0);
+	enumAttr.addField("Linear", kLinear);
+	enumAttr.addField("Bezier", kBezier);
+	enumAttr.addField("BSpline", kBSpline);
+	enumAttr.addField("CatmullRom", kCatmullRom);
+
+    addAttribute(inputLattice);
+    addAttribute(sSubdivision);
+    addAttribute(tSubdivision);
+    addAttribute(interpolation);
+    addAttribute(maxBezierRecursion);
+    addAttribute(cameraMatrix);
+    addAttribute(inOrtho);
+    addAttribute(inOrthographicWidth);
+    addAttribute(inHorizontalFilmAperture);
+    addAttribute(inVerticalFilmAperture);
+    addAttribute(inFocalLength);
+    addAttribute(outCompiledLattice);
+
+    attributeAffects(inputLattice, outCompiledLattice);
+    attributeAffects(sSubdivision, outCompiledLattice);
+    attributeAffects(tSubdivision, outCompiledLattice);
+    attributeAffects(interpolation, outCompiledLattice);
+    attributeAffects(maxBezierRecursion, outCompiledLattice);
+    attributeAffects(cameraMatrix, outCompiledLattice);
+    attributeAffects(inOrtho, outCompiledLattice);
+    attributeAffects(inOrthographicWidth, outCompiledLattice);
+    attributeAffects(inHorizontalFilmAperture, outCompiledLattice);
+    attributeAffects(inVerticalFilmAperture, outCompiledLattice);
+    attributeAffects(inFocalLength, outCompiledLattice);
+
+	return MS::kSuccess;
+}
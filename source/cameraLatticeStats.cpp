@@ -0,0 +1,130 @@
+/*
+ *  cameraLatticeStats.cpp
+ *  cameraLattice
+ *
+ *
+ */
+
+#include <maya/MArgDatabase.h>
+#include <maya/MSelectionList.h>
+#include <maya/MStringArray.h>
+#include <maya/MFnDependencyNode.h>
+#include <maya/MItDependencyNodes.h>
+#include <maya/MObjectArray.h>
+
+#include <stdio.h>
+
+#include "cameraLattice.h"
+#include "cameraLatticeStats.h"
+
+const MString CameraLatticeStatsCommand::commandName( "tcCameraLatticeStats" );
+
+static const char *jsonFlag = "-j";
+static const char *jsonLongFlag = "-json";
+static const char *resetFlag = "-r";
+static const char *resetLongFlag = "-reset";
+
+static MString jsonStats(const EvaluationStats &stats)
+{
+    char buffer[512];
+    snprintf(buffer, sizeof(buffer),
+             "{\"evaluations\": %llu, \"totalTime\": %.6f, \"compileTime\": %.6f, \"influenceTime\": %.6f, "
+             "\"kernelTime\": %.6f, \"outputTime\": %.6f, \"processed\": %llu, \"culled\": %llu, \"skipped\": %llu}",
+             stats.evaluations, stats.totalTime, stats.compileTime, stats.influenceTime, stats.kernelTime, stats.outputTime,
+             stats.processed, stats.culled, stats.skipped);
+    return MString(buffer);
+}
+
+static MString describeStats(const MString &nodeName, const EvaluationStats &total, const EvaluationStats &last)
+{
+    char buffer[512];
+    snprintf(buffer, sizeof(buffer),
+             ": %llu evaluations, %.3f ms (last %.3f ms), kernel %.3f ms, influence areas %.3f ms, "
+             "vertices processed %llu, culled %llu, skipped %llu (last %llu, %llu, %llu)",
+             total.evaluations, total.totalTime * 1000.0, last.totalTime * 1000.0, total.kernelTime * 1000.0,
+             total.influenceTime * 1000.0, total.processed, total.culled, total.skipped,
+             last.processed, last.culled, last.skipped);
+    return nodeName + buffer;
+}
+
+void *CameraLatticeStatsCommand::creator()
+{
+    return new CameraLatticeStatsCommand();
+}
+
+MSyntax CameraLatticeStatsCommand::newSyntax()
+{
+    MSyntax syntax;
+    syntax.addFlag(jsonFlag, jsonLongFlag);
+    syntax.addFlag(resetFlag, resetLongFlag);
+    syntax.setObjectType(MSyntax::kStringObjects, 0);
+    return syntax;
+}
+
+MStatus CameraLatticeStatsCommand::doIt(const MArgList &args)
+{
+    MStatus status;
+    MArgDatabase argData(syntax(), args, &status);
+    if (!status)
+        return status;
+
+    MStringArray objects;
+    argData.getObjects(objects);
+
+    MObjectArray deformers;
+    if (objects.length() == 0)
+    {
+        for (MItDependencyNodes it(MFn::kPluginDeformerNode); !it.isDone(); it.next())
+        {
+            if (MFnDependencyNode(it.thisNode()).typeId() == CameraLattice::id)
+                deformers.append(it.thisNode());
+        }
+    }
+
+    for (unsigned int i = 0; i < objects.length(); i++)
+    {
+        MSelectionList selection;
+        MObject deformer;
+        if (!selection.add(objects[i]) || !selection.getDependNode(0, deformer) ||
+            MFnDependencyNode(deformer).typeId() != CameraLattice::id)
+        {
+            displayError("tcCameraLatticeStats: " + objects[i] + " is not a tcCameraLatticeDeformer.");
+            return MS::kFailure;
+        }
+        deformers.append(deformer);
+    }
+
+    bool json = argData.isFlagSet(jsonFlag);
+    bool reset = argData.isFlagSet(resetFlag);
+
+    //maya node names need no escaping in json
+    MString jsonResult("{");
+    MStringArray result;
+    for (unsigned int i = 0; i < deformers.length(); i++)
+    {
+        MFnDependencyNode fnNode(deformers[i]);
+        CameraLattice *node = static_cast<CameraLattice*>(fnNode.userNode());
+
+        EvaluationStats total, last;
+        node->getStats(total, last);
+        if (reset)
+            node->resetStats();
+
+        if (json)
+        {
+            if (i > 0)
+                jsonResult += ", ";
+            jsonResult += "\"" + fnNode.name() + "\": {\"total\": " + jsonStats(total) + ", \"last\": " + jsonStats(last) + "}";
+        }
+        else
+            result.append(describeStats(fnNode.name(), total, last));
+    }
+    jsonResult += "}";
+
+    if (json)
+        setResult(jsonResult);
+    else
+        setResult(result);
+
+    return MS::kSuccess;
+}
@@ -0,0 +1,164 @@
+/*
+ *  cameraLatticeSubframes.cpp
+ *  cameraLattice
+ *
+ *
+ */
+
+#include <maya/MArgDatabase.h>
+#include <maya/MSelectionList.h>
+#include <maya/MStringArray.h>
+#include <maya/MFnDependencyNode.h>
+#include <maya/MDoubleArray.h>
+#include <maya/MIntArray.h>
+#include <maya/MPlug.h>
+#include <maya/MTime.h>
+#include <maya/MTimeArray.h>
+
+#include "cameraLattice.h"
+#include "cameraLatticeCache.h"
+#include "cameraLatticeSubframes.h"
+
+const MString CameraLatticeSubframesCommand::commandName( "tcCameraLatticeSubframes" );
+
+static const char *sampleFlag = "-sa";
+static const char *sampleLongFlag = "-sample";
+static const char *geometryIndexFlag = "-gi";
+static const char *geometryIndexLongFlag = "-geometryIndex";
+static const char *fileFlag = "-f";
+static const char *fileLongFlag = "-file";
+static const char *quantiseFlag = "-q";
+static const char *quantiseLongFlag = "-quantise";
+static const char *toleranceFlag = "-tol";
+static const char *toleranceLongFlag = "-tolerance";
+
+void *CameraLatticeSubframesCommand::creator()
+{
+    return new CameraLatticeSubframesCommand();
+}
+
+MSyntax CameraLatticeSubframesCommand::newSyntax()
+{
+    MSyntax syntax;
+    syntax.addFlag(sampleFlag, sampleLongFlag, MSyntax::kDouble);
+    syntax.makeFlagMultiUse(sampleFlag);
+    syntax.addFlag(geometryIndexFlag, geometryIndexLongFlag, MSyntax::kUnsigned);
+    syntax.addFlag(fileFlag, fileLongFlag, MSyntax::kString);
+    syntax.addFlag(quantiseFlag, quantiseLongFlag);
+    syntax.addFlag(toleranceFlag, toleranceLongFlag, MSyntax::kDouble);
+    syntax.setObjectType(MSyntax::kStringObjects, 1, 1);
+    return syntax;
+}
+
+MStatus CameraLatticeSubframesCommand::doIt(const MArgList &args)
+{
+    MStatus status;
+    MArgDatabase argData(syntax(), args, &status);
+    if (!status)
+        return status;
+
+    MStringArray objects;
+    argData.getObjects(objects);
+
+    MSelectionList selection;
+    MObject deformer;
+    if (objects.length() != 1 || !selection.add(objects[0]) || !selection.getDependNode(0, deformer) ||
+        MFnDependencyNode(deformer).typeId() != CameraLattice::id)
+    {
+        displayError("tcCameraLatticeSubframes: a tcCameraLatticeDeformer is needed.");
+        return MS::kFailure;
+    }
+
+    CameraLattice *node = static_cast<CameraLattice*>(MFnDependencyNode(deformer).userNode());
+
+    //samples are frames in the current time unit
+    MTimeArray times;
+    unsigned int numSamples = argData.numberOfFlagUses(sampleFlag);
+    for (unsigned int i = 0; i < numSamples; i++)
+    {
+        MArgList sampleArgs;
+        argData.getFlagArgumentList(sampleFlag, i, sampleArgs);
+        times.append(MTime(sampleArgs.asDouble(0), MTime::uiUnit()));
+    }
+
+    if (times.length() == 0)
+    {
+        displayError("tcCameraLatticeSubframes: at least one -sample is needed.");
+        return MS::kFailure;
+    }
+
+    if (argData.isFlagSet(fileFlag))
+    {
+        MString fileName;
+        argData.getFlagArgument(fileFlag, 0, fileName);
+        double tolerance = 0.0001;
+        if (argData.isFlagSet(toleranceFlag))
+            argData.getFlagArgument(toleranceFlag, 0, tolerance);
+        bool quantise = argData.isFlagSet(quantiseFlag);
+
+        CacheWriter writer;
+        if (!writer.open(fileName))
+        {
+            displayError("tcCameraLatticeSubframes: cannot write " + fileName + ".");
+            return MS::kFailure;
+        }
+
+        MIntArray geometryIndices;
+        MPlug(deformer, CameraLattice::outputGeom).getExistingArrayAttributeIndices(geometryIndices);
+        for (unsigned int i = 0; i < geometryIndices.length(); i++)
+        {
+            SubframeResult result;
+            if (!node->evaluateSubframes(times, geometryIndices[i], result))
+                continue;
+
+            for (unsigned int s = 0; s < times.length() && !result.inputPoints.empty(); s++)
+            {
+                if (!writer.addFrame(times[s].as(MTime::kSeconds), geometryIndices[i], result.inputPoints[result.inputIndex[s]],
+                                     result.deformedPoints[s], quantise, tolerance))
+                {
+                    writer.close();
+                    displayError("tcCameraLatticeSubframes: failed writing " + fileName + ".");
+                    return MS::kFailure;
+                }
+            }
+        }
+
+        if (!writer.close())
+        {
+            displayError("tcCameraLatticeSubframes: failed writing " + fileName + ".");
+            return MS::kFailure;
+        }
+
+        setResult(int(times.length()));
+        return MS::kSuccess;
+    }
+
+    unsigned int geometryIndex = 0;
+    if (argData.isFlagSet(geometryIndexFlag))
+        argData.getFlagArgument(geometryIndexFlag, 0, geometryIndex);
+
+    SubframeResult result;
+    status = node->evaluateSubframes(times, geometryIndex, result);
+    if (!status)
+    {
+        MString message("tcCameraLatticeSubframes: cannot evaluate the geometry ");
+        message += geometryIndex;
+        displayError(message + ".");
+        return status;
+    }
+
+    MDoubleArray positions;
+    for (unsigned int s = 0; s < result.deformedPoints.size(); s++)
+    {
+        const MPointArray &points = result.deformedPoints[s];
+        for (unsigned int i = 0; i < points.length(); i++)
+        {
+            positions.append(points[i].x);
+            positions.append(points[i].y);
+            positions.append(points[i].z);
+        }
+    }
+    setResult(positions);
+
+    return MS::kSuccess;
+}